@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,8 +45,64 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
-        'rest_framework_api_key.permissions.HasAPIKey',
+        'finances.permissions.CachedHasAPIKey',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'finances.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Cache of API key verifications, see finances.permissions.CachedHasAPIKey
+API_KEY_CACHE = {
+    "TTL": 30,
+    "MAX_SIZE": 10000,
+    "CACHE_ALIAS": None,
+}
+
+BALANCE_CACHE = {
+    "TTL": 60,
+    "MAX_SIZE": 10000,
+    "CACHE_ALIAS": None,
+}
+
+IDEMPOTENCY = {
+    "TTL": 24 * 60 * 60,
+    "LOCK_TIMEOUT": 60,
+}
+
+PAYMENT_QUEUE = {
+    "ASYNC": False,
+    "BATCH_SIZE": 1000,
+    "THROUGHPUT_WINDOW": 60,
+}
+
+ANALYTICS = {
+    "TTL": 300,
+    "CHUNK_SIZE": 50000,
+    "VELOCITY_WINDOW": 90,
+    "CACHE_ALIAS": None,
+}
+
+SNAPSHOTS = {
+    "BATCH_SIZE": 1000,
+    "LAG": 60,
+}
+
+INSTRUMENTATION = {
+    "ENABLED": True,
+    "SAMPLE_RATE": 0.1,
+    "SERVER_TIMING": True,
+}
+
+AMORTIZATION = {
+    "DEFAULT_CONTRACT": "v1.0",
+    "BATCH_SIZE": 10000,
+}
+
+ACCRUAL = {
+    "BATCH_SIZE": 5000,
+    "WORKERS": 1,
+    "GRACE_DAYS": 5,
+    "LATE_FEE_RATE": "0.36",
 }
 
 
@@ -53,6 +110,7 @@ REST_FRAMEWORK = {
 
 
 MIDDLEWARE = [
+    "finances.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -86,11 +144,39 @@ WSGI_APPLICATION = "base_app.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+# The backend comes from the environment: DB_ENGINE=sqlite (default, development and
+# single node) or DB_ENGINE=postgres (production, several workers or nodes)
+
+
+def database_from_environment(environ):
+    if environ.get("DB_ENGINE", "sqlite") == "postgres":
+        return {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": environ.get("POSTGRES_DB", "loans"),
+            "USER": environ.get("POSTGRES_USER", "loans"),
+            "PASSWORD": environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": environ.get("POSTGRES_PORT", "5432"),
+            # Persistent connections, reused by the requests of a worker for up to
+            # DB_CONN_MAX_AGE seconds and checked before reuse after an error
+            "CONN_MAX_AGE": int(environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    return {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
     }
+
+
+DATABASES = {"default": database_from_environment(os.environ)}
+
+# PRAGMAs run on every new SQLite connection (see finances/db.py). WAL lets readers
+# run while a transaction writes, synchronous=NORMAL only syncs at checkpoints in WAL
+# mode, and busy_timeout makes writers wait for the lock instead of failing at once
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
 }
 
 
@@ -17,7 +17,8 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path
-from finances.views import  CustomerCreateView, CustomerBalanceView, CustomerListView, LoanCreateView, LoansByCustomerExternalIdView, PaymentListCreateView
+from finances.async_views import AsyncCustomerBalanceView, AsyncLoansByCustomerView
+from finances.views import  CustomerCreateView, CustomerBalanceView, CustomerDailyReportView, CustomerListView, DailyReportView, LoanBulkCreateView, LoanCreateView, LoansByCustomerExternalIdView, MetricsView, PaymentBulkCreateView, PaymentListCreateView, PaymentQueueMetricsView, PortfolioAnalyticsView, QueuedPaymentStatusView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -25,6 +26,16 @@ urlpatterns = [
     path("get_customers/", CustomerListView.as_view(), name="customer_list"),
     path('get_customer_balance/<str:external_id>/', CustomerBalanceView.as_view(), name='customer-detail'),
     path('create_loan/', LoanCreateView.as_view(), name='loan-create'),
+    path('create_loans/bulk/', LoanBulkCreateView.as_view(), name='loan-bulk-create'),
     path('getLoans/<str:external_id>/', LoansByCustomerExternalIdView.as_view(), name='get_loans_by_customer_external_id'),
     path('make_payment/', PaymentListCreateView.as_view(), name='make_payment'),
+    path('make_payments/bulk/', PaymentBulkCreateView.as_view(), name='payment-bulk-create'),
+    path('async/get_customer_balance/<str:external_id>/', AsyncCustomerBalanceView.as_view(), name='customer-detail-async'),
+    path('async/getLoans/<str:external_id>/', AsyncLoansByCustomerView.as_view(), name='get_loans_by_customer_external_id_async'),
+    path('payment_queue/metrics/', PaymentQueueMetricsView.as_view(), name='payment-queue-metrics'),
+    path('payment_queue/<str:external_id>/', QueuedPaymentStatusView.as_view(), name='payment-queue-status'),
+    path('analytics/portfolio/', PortfolioAnalyticsView.as_view(), name='analytics-portfolio'),
+    path('reports/daily/', DailyReportView.as_view(), name='report-daily'),
+    path('reports/customers/<str:external_id>/daily/', CustomerDailyReportView.as_view(), name='report-customer-daily'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
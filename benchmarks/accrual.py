@@ -0,0 +1,68 @@
+"""
+Time of the nightly accrual against the number of worker processes.
+
+    python -m benchmarks.accrual --customers 10000 --loans-per-customer 10 --workers 1 2 4
+
+Seeds a temporary SQLite file with benchmarks.datagen (schedules included), then
+accrues one day per worker count, each on a new date so every open loan is accrued,
+and finally runs the last date again, when every loan is skipped. Prints the open
+loans per second and the time the same rate would need for --target loans. Set
+DB_ENGINE=postgres to run against PostgreSQL instead, where the workers write in
+parallel; SQLite serializes their transactions.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--loans-per-customer", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--target", type=int, default=10000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Set before Django starts, so the worker processes open the same file
+        os.environ.setdefault("SQLITE_PATH", str(Path(directory) / "accrual.sqlite3"))
+        from benchmarks.datagen import generate
+        from benchmarks.utils import setup_django
+
+        setup_django()
+        from django.core.management import call_command
+        from django.utils import timezone
+        from finances.business_logic.accrual_logic import accrue
+        from finances.models import Loan
+
+        call_command("migrate", verbosity=0)
+        generate(args.customers, args.loans_per_customer, 0)
+        loans = Loan.objects.filter(status=2).count()
+
+        print(f"{loans} open loans")
+        print(
+            f"{'workers':>7} {'accrued':>8} {'seconds':>8} {'loans/s':>8} {'target':>9}"
+        )
+        day = timezone.localdate()
+        runs = [
+            (workers, day + timedelta(days=n)) for n, workers in enumerate(args.workers)
+        ]
+        runs.append((args.workers[-1], runs[-1][1]))
+        for workers, accrual_date in runs:
+            start = time.perf_counter()
+            totals = accrue(accrual_date, workers, args.batch_size)
+            seconds = time.perf_counter() - start
+            rate = loans / seconds
+            print(
+                f"{workers:>7} {totals['loans']:>8} {seconds:>8.2f} {rate:>8.0f} "
+                f"{args.target / rate / 60:>7.1f}m"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Time to generate amortization schedules against the number of loans.
+
+    python -m benchmarks.amortization --plans 1000000 10000000 --loans 100000
+
+The plans part computes the installments of --plans loans in memory for each method,
+the NumPy work of generate_schedules alone. The loans part seeds --loans open loans
+and times generate_schedules end to end: reading the loans, building the plans and
+writing one LoanSchedule row per loan, then again to regenerate them all.
+"""
+
+import argparse
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+CUSTOMERS = 1000
+
+
+def seed(loans, batch_size=50000):
+    from django.utils import timezone
+    from finances.models import Customer, Loan
+
+    Customer.objects.bulk_create(
+        Customer(external_id=f"customer_{n}", score=Decimal("5000.00"), status=1)
+        for n in range(CUSTOMERS)
+    )
+    customer_ids = list(Customer.objects.values_list("id", flat=True))
+    generator = random.Random(24)
+    now = timezone.now()
+    for offset in range(0, loans, batch_size):
+        amounts = [
+            Decimal(generator.randrange(1000, 100001)) / 100
+            for _ in range(offset, min(offset + batch_size, loans))
+        ]
+        Loan.objects.bulk_create(
+            Loan(
+                external_id=f"loan_{offset + index}",
+                customer_id_id=generator.choice(customer_ids),
+                amount=amount,
+                outstanding=amount,
+                status=2,
+                contract_version="v1.0",
+                taken_at=now - timedelta(days=generator.randrange(365)),
+            )
+            for index, amount in enumerate(amounts)
+        )
+
+
+def time_plans(counts):
+    import numpy as np
+    from finances.amortization import installment_plan
+
+    generator = np.random.default_rng(24)
+    results = []
+    for count in counts:
+        principal = generator.integers(1000, 100001, count)
+        for method in ("annuity", "flat", "bullet"):
+            start = time.perf_counter()
+            installment_plan(method, principal, 0.24 * 30 / 365, 12)
+            seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "loans": count,
+                    "method": method,
+                    "seconds": round(seconds, 3),
+                    "loans_per_s": round(count / seconds),
+                }
+            )
+    return results
+
+
+def time_generation(loans, batch_size):
+    from finances.amortization import generate_schedules
+
+    seed(loans)
+    results = []
+    for step in ("generate", "regenerate"):
+        start = time.perf_counter()
+        written, _ = generate_schedules(batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        results.append(
+            {
+                "step": step,
+                "schedules": written,
+                "seconds": round(seconds, 2),
+                "loans_per_s": round(written / seconds),
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--plans", type=int, nargs="+", default=[1000000])
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    setup_django()
+    print(f"{'loans':>10} {'method':<8} {'seconds':>8} {'loans/s':>12}")
+    for result in time_plans(args.plans):
+        print(
+            f"{result['loans']:>10} {result['method']:<8} "
+            f"{result['seconds']:>8} {result['loans_per_s']:>12}"
+        )
+
+    with benchmark_database():
+        results = time_generation(args.loans, args.batch_size)
+    print(f"\n{'step':<10} {'schedules':>10} {'seconds':>8} {'loans/s':>10}")
+    for result in results:
+        print(
+            f"{result['step']:<10} {result['schedules']:>10} "
+            f"{result['seconds']:>8} {result['loans_per_s']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
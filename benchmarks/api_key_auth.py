@@ -0,0 +1,58 @@
+"""
+Authenticated requests per second with HasAPIKey against CachedHasAPIKey.
+
+    python -m benchmarks.api_key_auth --requests 500
+"""
+
+import argparse
+import time
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def run(requests):
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from rest_framework_api_key.models import APIKey
+    from rest_framework_api_key.permissions import HasAPIKey
+    from finances import views
+    from finances.models import Customer
+
+    setup_test_environment()
+    Customer.objects.create(external_id="bench", score=Decimal("1000.00"), status=1)
+    _, key = APIKey.objects.create_key(name="bench")
+    client = Client(HTTP_AUTHORIZATION=f"Api-Key {key}")
+    url = "/get_customer_balance/bench/"
+
+    results = {}
+    for name, permission in (
+        ("HasAPIKey", HasAPIKey),
+        ("CachedHasAPIKey", views.CachedHasAPIKey),
+    ):
+        with mock.patch.object(
+            views.CustomerBalanceView, "permission_classes", [permission]
+        ):
+            assert client.get(url).status_code == 200
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(url)
+            results[name] = requests / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.requests)
+    for name, rate in results.items():
+        print(f"{name:>16}: {rate:,.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Payments per second of create_payments_bulk against one create_payment per payment.
+
+    python -m benchmarks.bulk_payments --customers 200 --payments 5000
+"""
+
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def seed(customers, loans_per_customer):
+    from finances.models import Customer, Loan
+
+    Customer.objects.bulk_create(
+        Customer(external_id=f"bench_{index}", score=Decimal("1000000.00"), status=1)
+        for index in range(customers)
+    )
+    Loan.objects.bulk_create(
+        Loan(
+            external_id=f"bench_{customer.id}_{index}",
+            customer_id=customer,
+            amount=Decimal("100.00"),
+            outstanding=Decimal("100.00"),
+            status=2,
+            contract_version="v1.0",
+        )
+        for customer in Customer.objects.all()
+        for index in range(loans_per_customer)
+    )
+
+
+def payment_rows(prefix, customers, payments):
+    return [
+        (
+            index,
+            {
+                "external_id": f"{prefix}_{index}",
+                "customer_external_id": f"bench_{index % customers}",
+                "total_amount": Decimal("7.50"),
+            },
+        )
+        for index in range(payments)
+    ]
+
+
+def run(customers, payments, chunk_size):
+    from finances.business_logic.payment_logic import (
+        create_payment,
+        create_payments_bulk,
+    )
+
+    # Each payment of 7.50 settles parts of one or two loans of 100
+    seed(customers, loans_per_customer=payments // customers + 1)
+    results = {}
+
+    rows = payment_rows("single", customers, payments // 10)
+    start = time.perf_counter()
+    for _, data in rows:
+        create_payment(data)
+    results["create_payment"] = len(rows) / (time.perf_counter() - start)
+
+    rows = payment_rows("bulk", customers, payments)
+    start = time.perf_counter()
+    accepted, rejected = create_payments_bulk(rows, chunk_size=chunk_size)
+    results["create_payments_bulk"] = len(accepted) / (time.perf_counter() - start)
+    assert not rejected, rejected[:3]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.customers, args.payments, args.chunk_size)
+    for name, rate in results.items():
+        print(f"{name:>22}: {rate:,.0f} payments/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Fire parallel loans and payments at one customer and report the throughput.
+
+    python -m benchmarks.concurrency_stress --threads 8 --operations 50
+"""
+
+import argparse
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def run(threads, operations):
+    from django.db import connection
+    from rest_framework.exceptions import ValidationError
+    from finances.business_logic.loan_logic import create_loan
+    from finances.business_logic.payment_logic import create_payment
+    from finances.models import Customer, CustomerBalance, Loan
+
+    customer = Customer.objects.create(
+        external_id="stress_customer", score=Decimal("100000.00"), status=1
+    )
+    counters = {"loans": 0, "payments": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def worker(thread):
+        try:
+            for operation in range(operations):
+                try:
+                    if thread % 2:
+                        create_loan(
+                            {
+                                "external_id": f"loan_{thread}_{operation}",
+                                "customer_external_id": customer.external_id,
+                                "amount": Decimal("40.00"),
+                            }
+                        )
+                        outcome = "loans"
+                    else:
+                        create_payment(
+                            {
+                                "external_id": f"payment_{thread}_{operation}",
+                                "customer_external_id": customer.external_id,
+                                "total_amount": Decimal("25.00"),
+                            }
+                        )
+                        outcome = "payments"
+                except ValidationError:
+                    outcome = "rejected"
+                except Exception:
+                    outcome = "failed"
+                with lock:
+                    counters[outcome] += 1
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    open_loans = Loan.objects.filter(customer_id=customer, status=2)
+    balance = CustomerBalance.objects.get(customer_id=customer)
+    consistent = balance.total_debt == sum(loan.outstanding for loan in open_loans)
+    return {
+        **counters,
+        "seconds": round(elapsed, 3),
+        "operations_per_second": round(threads * operations / elapsed, 1),
+        "ledger_consistent": consistent,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        result = run(args.threads, args.operations)
+    for name, value in result.items():
+        print(f"{name:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Concurrent write throughput of the database profiles, one process per writer.
+
+    python -m benchmarks.concurrent_writes --processes 4 --operations 200
+    DB_ENGINE=postgres python -m benchmarks.concurrent_writes --modes postgres
+
+Each writer process alternates create_loan and create_payment on its own customer,
+like gunicorn workers serving different customers. rollback is SQLite with its
+default rollback journal and synchronous=FULL, wal is the WAL profile of the
+settings, postgres uses the DB_ENGINE=postgres settings of the environment. Every
+mode runs on a throwaway database.
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.utils import setup_django
+
+SQLITE_MODES = {
+    "rollback": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL"},
+    "wal": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL"},
+}
+
+
+def configure(environ):
+    # Initializer of the spawned processes, the settings read the environment
+    os.environ.update(environ)
+    setup_django()
+
+
+def create_database(processes):
+    from decimal import Decimal
+    from django.core.management import call_command
+    from django.db import connection
+    from finances.models import Customer
+
+    if connection.vendor == "sqlite":
+        call_command("migrate", verbosity=0)
+        name = connection.settings_dict["NAME"]
+    else:
+        name = connection.creation.create_test_db(verbosity=0)
+    Customer.objects.bulk_create(
+        Customer(external_id=f"writer_{n}", score=Decimal("100000000.00"), status=1)
+        for n in range(processes)
+    )
+    connection.close()
+    return str(name)
+
+
+def drop_database(original_name):
+    from django.db import connection
+
+    connection.creation.destroy_test_db(original_name, verbosity=0)
+
+
+def write(writer, operations):
+    from decimal import Decimal
+    from django.db import connection
+    from finances.business_logic.loan_logic import create_loan
+    from rest_framework.exceptions import ValidationError
+    from finances.business_logic.payment_logic import create_payment
+
+    customer = f"writer_{writer}"
+    failed = rejected = 0
+    start = time.time()
+    for operation in range(operations):
+        try:
+            if operation % 2:
+                create_payment(
+                    {
+                        "external_id": f"payment_{writer}_{operation}",
+                        "customer_external_id": customer,
+                        "total_amount": Decimal("10.00"),
+                    }
+                )
+            else:
+                create_loan(
+                    {
+                        "external_id": f"loan_{writer}_{operation}",
+                        "customer_external_id": customer,
+                        "amount": Decimal("40.00"),
+                    }
+                )
+        except ValidationError:
+            # A payment after a failed loan can exceed the debt, not a database error
+            rejected += 1
+        except Exception:
+            failed += 1
+    end = time.time()
+    connection.close()
+    return start, end, failed, rejected
+
+
+def run(mode, processes, operations):
+    context = multiprocessing.get_context("spawn")
+    if mode == "postgres":
+        environ = {"DB_ENGINE": "postgres"}
+    else:
+        directory = tempfile.mkdtemp()
+        environ = {
+            "DB_ENGINE": "sqlite",
+            "SQLITE_PATH": os.path.join(directory, "bench.sqlite3"),
+            **SQLITE_MODES[mode],
+        }
+
+    with context.Pool(1, configure, (environ,)) as pool:
+        name = pool.apply(create_database, (processes,))
+    writers_environ = (
+        {**environ, "POSTGRES_DB": name} if mode == "postgres" else environ
+    )
+    try:
+        with context.Pool(processes, configure, (writers_environ,)) as pool:
+            results = pool.starmap(write, [(n, operations) for n in range(processes)])
+    finally:
+        if mode == "postgres":
+            original = os.environ.get("POSTGRES_DB", "loans")
+            with context.Pool(1, configure, (writers_environ,)) as pool:
+                pool.apply(drop_database, (original,))
+
+    elapsed = max(result[1] for result in results) - min(
+        result[0] for result in results
+    )
+    failed = sum(result[2] for result in results)
+    rejected = sum(result[3] for result in results)
+    return {
+        "writes_per_second": round(
+            (processes * operations - failed - rejected) / elapsed, 1
+        ),
+        "failed": failed,
+        "rejected": rejected,
+        "seconds": round(elapsed, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--operations", type=int, default=200)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["rollback", "wal"],
+        choices=["rollback", "wal", "postgres"],
+    )
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        result = run(mode, args.processes, args.operations)
+        print(
+            f"{mode:>9}: {result['writes_per_second']:>8,.1f} writes/s,"
+            f" {result['failed']} failed, {result['rejected']} rejected,"
+            f" {result['seconds']} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Seed a database with customers, loans and a payment history for the benchmarks.
+
+    python -m benchmarks.datagen --customers 1000 --loans-per-customer 10 \\
+        --payments-per-customer 3 --seed 22
+
+Customers are bench_<n>, loans bench_<n>_loan_<m> and payments bench_<n>_payment_<m>.
+Every payment pays off the oldest open loans of its customer, and the balance
+ledger and the schedules of the open loans are built from the loans at the end, so
+the data is the same as if it had gone through the API. The same arguments and
+--seed give the same rows. Without a throwaway database it writes to the configured one (set
+SQLITE_PATH to seed another SQLite file).
+"""
+
+import argparse
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.utils import setup_django
+
+# Big enough for every customer to take the generated loans and the ones created by
+# the benchmarks
+SCORE = Decimal("100000000.00")
+
+
+def customer_id(index):
+    return f"bench_{index}"
+
+
+def generate(
+    customers,
+    loans_per_customer,
+    payments_per_customer,
+    seed=22,
+    batch_size=1000,
+):
+    # Writes the rows batch_size customers at a time and returns the number of
+    # customers, loans and payments created
+    from io import StringIO
+    from django.core.management import call_command
+    from django.db import transaction
+    from django.utils import timezone
+    from finances.amortization import generate_schedules
+    from finances.models import Customer, Loan, Payment, PaymentDetail
+
+    generator = random.Random(seed)
+    now = timezone.now()
+    totals = {"customers": 0, "loans": 0, "payments": 0}
+    for start in range(0, customers, batch_size):
+        indexes = range(start, min(start + batch_size, customers))
+        with transaction.atomic():
+            created = Customer.objects.bulk_create(
+                Customer(external_id=customer_id(index), score=SCORE, status=1)
+                for index in indexes
+            )
+            loans = []
+            for customer in created:
+                for number in range(loans_per_customer):
+                    amount = Decimal(generator.randrange(1000, 100001)) / 100
+                    loans.append(
+                        Loan(
+                            external_id=f"{customer.external_id}_loan_{number}",
+                            customer_id=customer,
+                            amount=amount,
+                            outstanding=amount,
+                            status=2,
+                            contract_version="v1.0",
+                            taken_at=now - timedelta(days=generator.randrange(365)),
+                        )
+                    )
+
+            payments = []
+            allocations = []
+            for position, customer in enumerate(created):
+                # Loans are allocated oldest first, in the order they were generated
+                open_loans = loans[
+                    position * loans_per_customer : (position + 1) * loans_per_customer
+                ]
+                for number in range(payments_per_customer):
+                    debt = sum(loan.outstanding for loan in open_loans)
+                    if not debt:
+                        break
+                    total = min(
+                        debt,
+                        Decimal(generator.randrange(100, 50001)) / 100,
+                    )
+                    payment = Payment(
+                        external_id=f"{customer.external_id}_payment_{number}",
+                        customer_id=customer,
+                        total_amount=total,
+                        status=1,
+                        paid_at=now,
+                    )
+                    payments.append(payment)
+                    for loan in open_loans:
+                        if not total:
+                            break
+                        paid = min(loan.outstanding, total)
+                        if not paid:
+                            continue
+                        loan.outstanding -= paid
+                        total -= paid
+                        if not loan.outstanding:
+                            loan.status = 4
+                        allocations.append((loan, payment, paid))
+
+            Loan.objects.bulk_create(loans)
+            Payment.objects.bulk_create(payments)
+            PaymentDetail.objects.bulk_create(
+                PaymentDetail(amount=amount, loand_id=loan, payment_id=payment)
+                for loan, payment, amount in allocations
+            )
+        totals["customers"] += len(created)
+        totals["loans"] += len(loans)
+        totals["payments"] += len(payments)
+
+    call_command("rebuild_balances", stdout=StringIO())
+    generate_schedules()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--loans-per-customer", type=int, default=10)
+    parser.add_argument("--payments-per-customer", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=22)
+    args = parser.parse_args()
+
+    setup_django()
+    totals = generate(
+        args.customers,
+        args.loans_per_customer,
+        args.payments_per_customer,
+        seed=args.seed,
+    )
+    print(", ".join(f"{count} {name}" for name, count in totals.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Request time with the instrumentation middleware disabled, sampling and timing
+every request.
+
+    python -m benchmarks.instrumentation_overhead --requests 200 --rounds 7
+
+Every round sends --requests requests to each endpoint in each mode, the modes
+taking turns so that they see the same machine load. The overhead is the median
+time per request of a mode against the median with the instrumentation disabled.
+"""
+
+import argparse
+import statistics
+import time
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+MODES = {
+    "disabled": {"ENABLED": False},
+    "sampled": {"SAMPLE_RATE": 0.1},
+    "every request": {"SAMPLE_RATE": 1},
+}
+
+
+def seed(loans):
+    from django.utils import timezone
+    from finances.models import Customer, Loan
+
+    customer = Customer.objects.create(
+        external_id="bench", score=Decimal("1000000.00"), status=1
+    )
+    Loan.objects.bulk_create(
+        Loan(
+            external_id=f"loan_{index}",
+            customer_id=customer,
+            amount=Decimal("100.00"),
+            outstanding=Decimal("100.00"),
+            status=2,
+            contract_version="v1.0",
+            taken_at=timezone.now(),
+        )
+        for index in range(loans)
+    )
+
+
+def run(requests, rounds, loans):
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+    from rest_framework_api_key.models import APIKey
+
+    setup_test_environment()
+    seed(loans)
+    _, key = APIKey.objects.create_key(name="bench")
+    client = Client(HTTP_AUTHORIZATION=f"Api-Key {key}")
+    urls = {
+        "balance": "/get_customer_balance/bench/",
+        "loans": "/getLoans/bench/?format=json",
+    }
+
+    timings = {(url, mode): [] for url in urls for mode in MODES}
+    for _ in range(rounds):
+        for url, path in urls.items():
+            for mode, config in MODES.items():
+                with override_settings(INSTRUMENTATION=config):
+                    assert client.get(path).status_code == 200
+                    start = time.perf_counter()
+                    for _ in range(requests):
+                        client.get(path)
+                    seconds = time.perf_counter() - start
+                timings[(url, mode)].append(seconds / requests * 1000)
+    return {key: statistics.median(values) for key, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--loans", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.requests, args.rounds, args.loans)
+
+    print(f"{'endpoint':<10} {'mode':<14} {'ms/request':>10} {'overhead':>9}")
+    for (url, mode), milliseconds in results.items():
+        overhead = milliseconds / results[(url, "disabled")] - 1
+        print(f"{url:<10} {mode:<14} {milliseconds:>10.3f} {overhead:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
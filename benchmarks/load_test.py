@@ -0,0 +1,222 @@
+"""
+Concurrent-connection load test of running deployments, to compare WSGI and ASGI.
+
+    python -m benchmarks.load_test seed
+    python -m benchmarks.load_test run --api-key <key> \\
+        --target wsgi=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001/async \\
+        --path /get_customer_balance/loadtest/ --connections 16,64,256
+
+seed creates the loadtest customer, its loans and an API key in the configured
+database. run opens --connections keep-alive connections per target, each one sending
+requests back to back for --duration seconds, and reports the requests per second and
+the latency percentiles. The target URL prefixes the path, /async serves the async
+views of an ASGI deployment.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from benchmarks.utils import percentiles, setup_django
+
+
+def seed(loans):
+    from decimal import Decimal
+    from rest_framework_api_key.models import APIKey
+    from finances.models import Customer, Loan
+
+    customer, _ = Customer.objects.get_or_create(
+        external_id="loadtest", defaults={"score": Decimal("100000000.00"), "status": 1}
+    )
+    Loan.objects.filter(customer_id=customer).delete()
+    Loan.objects.bulk_create(
+        Loan(
+            external_id=f"loadtest_{index}",
+            customer_id=customer,
+            amount=Decimal("100.00"),
+            outstanding=Decimal("100.00"),
+            status=2,
+        )
+        for index in range(loans)
+    )
+    _, key = APIKey.objects.create_key(name="loadtest")
+    return key
+
+
+async def read_response(reader):
+    # Status and body of one HTTP/1.1 response, with Content-Length or chunked body
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get("content-length", 0)))
+    return status, headers.get("connection") == "close"
+
+
+async def connection(host, port, request, deadline, latencies, errors):
+    # One keep-alive connection sending requests back to back until the deadline,
+    # reconnecting when the server closes it. request is the raw request, or a
+    # function building a new one for every request
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request() if callable(request) else request)
+            await writer.drain()
+            status, closed = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if not 200 <= status < 300:
+                errors.append(status)
+            if closed:
+                writer.close()
+                writer = None
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError):
+            errors.append("connection")
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def http_request(parts, api_key, method="GET", body=None):
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    head = (
+        f"{method} {path} HTTP/1.1\r\n"
+        f"Host: {parts.netloc}\r\n"
+        f"Authorization: Api-Key {api_key}\r\n"
+        "Accept: application/json\r\n"
+    )
+    if body is None:
+        return (head + "\r\n").encode()
+    content = json.dumps(body).encode()
+    head += (
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(content)}\r\n"
+        "\r\n"
+    )
+    return head.encode() + content
+
+
+async def load(url, api_key, connections, duration, method="GET", body=None):
+    # body is None, a JSON payload, or a function returning a new payload for every
+    # request (unique external ids)
+    parts = urlsplit(url)
+    if callable(body):
+
+        def request():
+            return http_request(parts, api_key, method, body())
+
+    else:
+        request = http_request(parts, api_key, method, body)
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(
+        *(
+            connection(
+                parts.hostname, parts.port or 80, request, deadline, latencies, errors
+            )
+            for _ in range(connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies, errors, elapsed):
+    if not latencies:
+        return {"requests": 0, "errors": len(errors), "requests_per_s": 0}
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        **percentiles([latency * 1000 for latency in latencies]),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed_parser = commands.add_parser("seed")
+    seed_parser.add_argument("--loans", type=int, default=100)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--api-key", required=True)
+    run_parser.add_argument(
+        "--target",
+        action="append",
+        required=True,
+        help="name=base URL of a deployment, repeat to compare several",
+    )
+    run_parser.add_argument(
+        "--path",
+        action="append",
+        default=None,
+        help="Path to request, repeat to test several. "
+        "Defaults to the loadtest customer balance",
+    )
+    run_parser.add_argument(
+        "--connections",
+        default="16,64",
+        help="Comma separated concurrent connection counts",
+    )
+    run_parser.add_argument("--duration", type=float, default=10.0)
+    run_parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        setup_django()
+        print(f"API key: {seed(args.loans)}")
+        return
+
+    results = []
+    for path in args.path or ["/get_customer_balance/loadtest/"]:
+        for connections in map(int, args.connections.split(",")):
+            for target in args.target:
+                name, _, base_url = target.partition("=")
+                result = asyncio.run(
+                    load(
+                        base_url.rstrip("/") + path,
+                        args.api_key,
+                        connections,
+                        args.duration,
+                    )
+                )
+                results.append(
+                    {"target": name, "path": path, "connections": connections, **result}
+                )
+                if not args.json:
+                    print(
+                        f"{name:>8} {path} c={connections:<4}"
+                        f" {result['requests_per_s']:>10,.1f} req/s"
+                        f"  p50 {result.get('p50_ms', '-')} ms"
+                        f"  p99 {result.get('p99_ms', '-')} ms"
+                        f"  errors {result['errors']}"
+                    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Queries and latency of listing a customer's loans with LoanSerializer over a plain
+queryset (one customer query per loan) against LoanReadSerializer over
+loan_read_queryset (one joined query).
+
+    python -m benchmarks.loan_listing --loans 100 1000 5000
+"""
+
+import argparse
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, measure, setup_django, summarize
+
+
+def run(loan_counts, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from finances.models import Customer, Loan
+    from finances.serializers import (
+        LoanReadSerializer,
+        LoanSerializer,
+        loan_read_queryset,
+    )
+
+    paths = {
+        "LoanSerializer": lambda customer: LoanSerializer(
+            Loan.objects.filter(customer_id=customer.id), many=True
+        ).data,
+        "LoanReadSerializer": lambda customer: LoanReadSerializer(
+            loan_read_queryset(
+                Loan.objects.filter(customer_id__external_id=customer.external_id)
+            ),
+            many=True,
+        ).data,
+    }
+    results = []
+    for loan_count in loan_counts:
+        customer = Customer.objects.create(
+            external_id=f"bench_{loan_count}", score=Decimal("1000.00"), status=1
+        )
+        Loan.objects.bulk_create(
+            Loan(
+                external_id=f"bench_{loan_count}_{index}",
+                customer_id=customer,
+                amount=Decimal("10.00"),
+                outstanding=Decimal("10.00"),
+                status=2,
+                contract_version="v1.0",
+            )
+            for index in range(loan_count)
+        )
+        for name, path in paths.items():
+            with CaptureQueriesContext(connection) as queries:
+                path(customer)
+            timings = measure(lambda: path(customer), repeat=repeat)
+            results.append(
+                {
+                    "loans": loan_count,
+                    "path": name,
+                    "queries": len(queries),
+                    **summarize(timings),
+                }
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--loans", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.loans, args.repeat)
+
+    print(f"{'loans':>8} {'path':>20} {'queries':>8} {'median ms':>10}")
+    for row in results:
+        print(
+            f"{row['loans']:>8} {row['path']:>20} {row['queries']:>8}"
+            f" {row['median_ms']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
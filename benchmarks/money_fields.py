@@ -0,0 +1,135 @@
+"""
+Aggregate and allocation speed of decimal and integer cent amount columns.
+
+    python -m benchmarks.money_fields --rows 200000 --customers 1000 --repeat 5
+
+Two tables with the same rows, one storing the amount in a DecimalField(12, 2) and
+one in a MoneyField(12, 2), integer cents. aggregate sums the whole column and the
+column grouped by customer. allocation is the write path of create_payment: read
+the open amounts of a customer oldest first, pay them off in Python and save them
+with bulk_update.
+"""
+
+import argparse
+import random
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, measure, setup_django, summarize
+
+
+def amount_models():
+    from django.db import models
+    from finances.fields import MoneyField
+
+    class DecimalAmount(models.Model):
+        customer = models.IntegerField(db_index=True)
+        amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+        class Meta:
+            app_label = "finances"
+            db_table = "bench_decimal_amount"
+
+    class CentsAmount(models.Model):
+        customer = models.IntegerField(db_index=True)
+        amount = MoneyField(max_digits=12, decimal_places=2)
+
+        class Meta:
+            app_label = "finances"
+            db_table = "bench_cents_amount"
+
+    return {"decimal": DecimalAmount, "cents": CentsAmount}
+
+
+def seed(models, rows, customers):
+    from django.db import connection
+
+    generator = random.Random(18)
+    amounts = [
+        (generator.randrange(customers), Decimal(generator.randrange(1, 10**6)) / 100)
+        for _ in range(rows)
+    ]
+    for model in models.values():
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(model)
+        model.objects.bulk_create(
+            (model(customer=customer, amount=amount) for customer, amount in amounts),
+            batch_size=5000,
+        )
+
+
+def allocate(model, customer, payment):
+    # Pay off the customer's amounts oldest first, as create_payment does with loans
+    from django.db import transaction
+
+    with transaction.atomic():
+        rows = list(
+            model.objects.filter(customer=customer, amount__gt=0)
+            .order_by("id")
+            .only("id", "amount")
+        )
+        changed = []
+        for row in rows:
+            if not payment:
+                break
+            paid = min(row.amount, payment)
+            row.amount -= paid
+            payment -= paid
+            changed.append(row)
+        model.objects.bulk_update(changed, ["amount"])
+
+
+def run(rows, customers, repeat):
+    from django.db.models import Sum
+
+    models = amount_models()
+    seed(models, rows, customers)
+    results = {}
+    for name, model in models.items():
+        totals = []
+        customer_ids = iter(range(customers))
+        timings = {
+            "sum": measure(
+                lambda: totals.append(model.objects.aggregate(total=Sum("amount"))),
+                repeat,
+            ),
+            "sum by customer": measure(
+                lambda: list(
+                    model.objects.values("customer").annotate(total=Sum("amount"))
+                ),
+                repeat,
+            ),
+            "allocation": measure(
+                lambda: allocate(model, next(customer_ids), Decimal("1500.00")),
+                min(repeat, customers),
+            ),
+        }
+        results[name] = {
+            "total": totals[0]["total"],
+            **{label: summarize(values) for label, values in timings.items()},
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.rows, args.customers, args.repeat)
+
+    # SQLite sums decimal columns as floats, integer cents add up exactly
+    print(f"{'total':<18} {results['decimal']['total']} {results['cents']['total']}")
+    print(f"{'':<18} {'decimal ms':>12} {'cents ms':>12}")
+    for label in ("sum", "sum by customer", "allocation"):
+        print(
+            f"{label:<18} {results['decimal'][label]['median_ms']:>12}"
+            f" {results['cents'][label]['median_ms']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Latency of create_payment against the number of loans settled by one payment.
+
+    python -m benchmarks.payment_allocation --loans 1 10 50 200 --repeat 5
+"""
+
+import argparse
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, measure, setup_django, summarize
+
+
+def run(loan_counts, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from finances.business_logic.payment_logic import create_payment
+    from finances.models import Customer, Loan
+
+    results = []
+    for loan_count in loan_counts:
+        customer = Customer.objects.create(
+            external_id=f"bench_{loan_count}",
+            score=Decimal(loan_count * repeat * 10),
+            status=1,
+        )
+        Loan.objects.bulk_create(
+            Loan(
+                external_id=f"bench_{loan_count}_{index}",
+                customer_id=customer,
+                amount=Decimal("10.00"),
+                outstanding=Decimal("10.00"),
+                status=2,
+                contract_version="v1.0",
+            )
+            for index in range(loan_count * repeat)
+        )
+        payments = iter(range(repeat))
+        queries = []
+
+        def settle():
+            # Each payment settles exactly loan_count loans
+            with CaptureQueriesContext(connection) as captured:
+                create_payment(
+                    {
+                        "external_id": f"bench_{loan_count}_payment_{next(payments)}",
+                        "customer_external_id": customer.external_id,
+                        "total_amount": Decimal(loan_count * 10),
+                    }
+                )
+            queries.append(len(captured))
+
+        timings = measure(settle, repeat=repeat)
+        results.append({"loans": loan_count, "queries": max(queries), **summarize(timings)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--loans", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.loans, args.repeat)
+
+    print(f"{'loans':>8} {'queries':>8} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+    for row in results:
+        print(
+            f"{row['loans']:>8} {row['queries']:>8} {row['median_ms']:>10}"
+            f" {row['min_ms']:>10} {row['max_ms']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Time and peak memory of the portfolio metrics against the number of loans.
+
+    python -m benchmarks.portfolio_analytics --loans 100000 1000000 --chunk-size 50000
+
+Each run adds loans to the same customers until the table holds --loans rows, with
+one payment detail for every ten loans, then computes the metrics once. The peak
+memory is the Python allocations traced during the computation, it is bounded by
+--chunk-size and stays flat as the tables grow.
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+CUSTOMERS = 10000
+
+
+def grow(loans, batch_size=50000):
+    from django.utils import timezone
+    from finances.models import Customer, Loan, Payment, PaymentDetail
+
+    if not Customer.objects.exists():
+        Customer.objects.bulk_create(
+            Customer(external_id=f"customer_{n}", score=Decimal("5000.00"), status=1)
+            for n in range(CUSTOMERS)
+        )
+        customer = Customer.objects.first()
+        Payment.objects.create(
+            external_id="payment", customer_id=customer, total_amount=0, status=1
+        )
+    customer_ids = list(Customer.objects.values_list("id", flat=True))
+    payment = Payment.objects.get()
+    generator = random.Random(19)
+    now = timezone.now()
+    start = Loan.objects.count()
+    for offset in range(start, loans, batch_size):
+        created = Loan.objects.bulk_create(
+            Loan(
+                external_id=f"loan_{index}",
+                customer_id_id=generator.choice(customer_ids),
+                amount=Decimal("100.00"),
+                outstanding=Decimal(generator.randrange(0, 10001)) / 100,
+                status=generator.choice([2, 2, 2, 4]),
+                contract_version="v1.0",
+                taken_at=now - timedelta(days=generator.randrange(365)),
+            )
+            for index in range(offset, min(offset + batch_size, loans))
+        )
+        PaymentDetail.objects.bulk_create(
+            PaymentDetail(
+                amount=Decimal("10.00"), loand_id_id=loan.id, payment_id=payment
+            )
+            for loan in created[::10]
+        )
+
+
+def run(loan_counts, chunk_size):
+    from finances.analytics import compute_portfolio_metrics
+
+    results = []
+    for loans in loan_counts:
+        grow(loans)
+        tracemalloc.start()
+        start = time.perf_counter()
+        metrics = compute_portfolio_metrics(chunk_size=chunk_size)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(
+            {
+                "loans": loans,
+                "seconds": round(seconds, 2),
+                "peak_mb": round(peak / 2**20, 1),
+                "open_outstanding": metrics["loans"]["by_status"]["2"]["outstanding"],
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--loans", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(sorted(args.loans), args.chunk_size)
+
+    print(f"{'loans':>10} {'seconds':>8} {'peak MB':>8} {'open outstanding':>18}")
+    for row in results:
+        print(
+            f"{row['loans']:>10} {row['seconds']:>8} {row['peak_mb']:>8}"
+            f" {row['open_outstanding']:>18}"
+        )
+
+
+if __name__ == "__main__":
+    main()
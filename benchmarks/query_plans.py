@@ -0,0 +1,145 @@
+"""
+EXPLAIN plans and timings of the hot Loan and Payment queries, with and without the
+composite indexes of the models, on a seeded database.
+
+    python -m benchmarks.query_plans --customers 10000 --loans-per-customer 100
+"""
+
+import argparse
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, measure, setup_django, summarize
+
+
+def seed(customers, loans_per_customer, payments_per_customer, batch_size=50000):
+    from django.utils import timezone
+    from finances.models import Customer, Loan, Payment
+
+    Customer.objects.bulk_create(
+        (
+            Customer(external_id=f"bench_{index}", score=Decimal("1000.00"), status=1)
+            for index in range(customers)
+        ),
+        batch_size=batch_size,
+    )
+    customer_ids = list(Customer.objects.values_list("id", flat=True))
+    now = timezone.now()
+    # Loans of all customers interleaved in time, a quarter of them still open
+    Loan.objects.bulk_create(
+        (
+            Loan(
+                external_id=f"bench_{customer_id}_{index}",
+                customer_id_id=customer_id,
+                amount=Decimal("100.00"),
+                outstanding=Decimal("100.00") if index % 4 == 0 else Decimal("0"),
+                status=2 if index % 4 == 0 else 4,
+                contract_version="v1.0",
+            )
+            for index in range(loans_per_customer)
+            for customer_id in customer_ids
+        ),
+        batch_size=batch_size,
+    )
+    Payment.objects.bulk_create(
+        (
+            Payment(
+                external_id=f"bench_{customer_id}_{index}",
+                customer_id_id=customer_id,
+                total_amount=Decimal("10.00"),
+                status=1,
+                paid_at=now - timedelta(days=index),
+            )
+            for index in range(payments_per_customer)
+            for customer_id in customer_ids
+        ),
+        batch_size=batch_size,
+    )
+    return customer_ids
+
+
+def hot_querysets(customer_id):
+    from django.db.models import Sum
+    from finances.models import Loan, Payment
+
+    loans = Loan.objects.filter(customer_id=customer_id)
+    return {
+        "total debt (customer_id, status)": loans.filter(status=2)
+        .values("customer_id")
+        .annotate(total=Sum("outstanding")),
+        "open loans (customer_id, outstanding > 0) by created_at": loans.filter(
+            outstanding__gt=0
+        ).order_by("created_at"),
+        "loan page (customer_id) by created_at, id": loans.order_by("created_at", "id")[
+            :100
+        ],
+        "payments (customer_id) by paid_at": Payment.objects.filter(
+            customer_id=customer_id
+        ).order_by("-paid_at")[:100],
+    }
+
+
+def run_queries(customer_ids, repeat):
+    results = {}
+    sample = random.Random(0).sample(customer_ids, min(repeat, len(customer_ids)))
+    for name, queryset in hot_querysets(sample[0]).items():
+        customers = iter(sample)
+        timings = measure(
+            lambda: list(hot_querysets(next(customers))[name]), repeat=len(sample)
+        )
+        results[name] = {"plan": queryset.explain(), **summarize(timings)}
+    return results
+
+
+def set_indexes(enabled):
+    from django.db import connection
+    from finances.models import Loan, Payment
+
+    with connection.schema_editor() as editor:
+        for model in (Loan, Payment):
+            for index in model._meta.indexes:
+                if enabled:
+                    editor.add_index(model, index)
+                else:
+                    editor.remove_index(model, index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--loans-per-customer", type=int, default=100)
+    parser.add_argument("--payments-per-customer", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        from django.db import connection
+
+        customer_ids = seed(
+            args.customers, args.loans_per_customer, args.payments_per_customer
+        )
+        set_indexes(False)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        before = run_queries(customer_ids, args.repeat)
+        set_indexes(True)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        after = run_queries(customer_ids, args.repeat)
+
+    for name in before:
+        print(f"== {name}")
+        for label, result in (("without indexes", before), ("with indexes", after)):
+            row = result[name]
+            print(
+                f"-- {label}: median {row['median_ms']} ms,"
+                f" min {row['min_ms']} ms, max {row['max_ms']} ms"
+            )
+            print(row["plan"])
+        print()
+
+
+if __name__ == "__main__":
+    main()
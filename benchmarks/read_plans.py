@@ -0,0 +1,127 @@
+"""
+Rows per second of the list endpoints' serializers (plus JSONRenderer) against their
+compiled read plans, over the same rows.
+
+    python -m benchmarks.read_plans --rows 20000
+"""
+
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks.utils import benchmark_database, setup_django
+
+
+def seed(rows):
+    from django.utils import timezone
+    from finances.models import Customer, Loan, Payment
+
+    customer = Customer.objects.create(
+        external_id="bench", score=Decimal("1000.00"), status=1
+    )
+    Customer.objects.bulk_create(
+        Customer(external_id=f"bench_{index}", score=Decimal("1000.00"), status=1)
+        for index in range(rows)
+    )
+    Loan.objects.bulk_create(
+        Loan(
+            external_id=f"bench_{index}",
+            customer_id=customer,
+            amount=Decimal("150.25"),
+            outstanding=Decimal("75.50"),
+            status=2,
+            contract_version="v1.0",
+        )
+        for index in range(rows)
+    )
+    Payment.objects.bulk_create(
+        Payment(
+            external_id=f"bench_{index}",
+            customer_id=customer,
+            total_amount=Decimal("10.1234567890"),
+            status=1,
+            paid_at=timezone.now(),
+        )
+        for index in range(rows)
+    )
+
+
+def run(rows):
+    from rest_framework.renderers import JSONRenderer
+    from finances.business_logic.customer_logic import with_total_debt
+    from finances.models import Customer, Loan, Payment
+    from finances.read_plans import (
+        CUSTOMER_READ_PLAN,
+        LOAN_READ_PLAN,
+        PAYMENT_READ_PLAN,
+    )
+    from finances.serializers import (
+        CustomerSerializer,
+        LoanSerializer,
+        PaymentSerializer,
+        loan_read_queryset,
+    )
+
+    seed(rows)
+    renderer = JSONRenderer()
+    loans = Loan.objects.all()
+    cases = [
+        (
+            "customers",
+            lambda: CustomerSerializer(
+                with_total_debt(Customer.objects.all()), many=True
+            ).data,
+            lambda: CUSTOMER_READ_PLAN.queryset(
+                with_total_debt(Customer.objects.all())
+            ),
+            CUSTOMER_READ_PLAN,
+        ),
+        (
+            "loans",
+            lambda: LoanSerializer(loans.select_related("customer_id"), many=True).data,
+            lambda: LOAN_READ_PLAN.queryset(loan_read_queryset(loans)),
+            LOAN_READ_PLAN,
+        ),
+        (
+            "payments",
+            lambda: PaymentSerializer(Payment.objects.all(), many=True).data,
+            lambda: PAYMENT_READ_PLAN.queryset(Payment.objects.all()),
+            PAYMENT_READ_PLAN,
+        ),
+    ]
+    results = []
+    for name, serialize, plan_queryset, plan in cases:
+        start = time.perf_counter()
+        serializer_output = renderer.render(serialize())
+        serializer_rate = rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        plan_output = plan.render_list(plan_queryset())
+        plan_rate = rows / (time.perf_counter() - start)
+
+        assert len(serializer_output) == len(plan_output), name
+        results.append((name, serializer_rate, plan_rate))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    setup_django()
+    with benchmark_database():
+        results = run(args.rows)
+
+    print(
+        f"{'endpoint':>10} {'serializer rows/s':>18} {'read plan rows/s':>18} {'speedup':>8}"
+    )
+    for name, serializer_rate, plan_rate in results:
+        print(
+            f"{name:>10} {serializer_rate:>18,.0f} {plan_rate:>18,.0f}"
+            f" {plan_rate / serializer_rate:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+"""
+Benchmark suite of the business logic and of every endpoint, with regression checks.
+
+    python -m benchmarks.suite run --output results.json
+    python -m benchmarks.suite run --parts micro --customers 1000 --calls 200
+    python -m benchmarks.suite compare baseline.json results.json --tolerance 0.15
+
+run seeds the data with benchmarks.datagen, then:
+
+- micro times get_total_debt, create_loan, create_payment and the customer and loan
+  serializers in process, against a throwaway database.
+- macro seeds a temporary SQLite file, starts gunicorn on it with the WSGI
+  deployment settings and drives every named URL of base_app/urls.py with
+  --connections concurrent keep-alive clients (benchmarks.load_test) for --duration
+  seconds each, after --warmup seconds of load. The queries per request are counted
+  in process, with the test client, before the server starts.
+
+Both report the throughput, p50/p95/p99 latency and the queries per call or
+request, and write them with the run parameters to --output. compare checks a
+result file against a stored baseline (run on the same machine with the same
+parameters): lower throughput or higher latency than the baseline by more than
+--tolerance, and any extra query or error, are regressions and make it exit with
+status 1.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from benchmarks.datagen import customer_id, generate
+from benchmarks.load_test import load
+from benchmarks.utils import benchmark_database, percentiles, setup_django
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def micro_operations(customers, seed):
+    # name -> function running the operation once, create_payment pays off the loans
+    # created by create_loan so that it always has debt to allocate
+    from finances.business_logic.customer_logic import get_total_debt, with_total_debt
+    from finances.business_logic.loan_logic import create_loan
+    from finances.business_logic.payment_logic import create_payment
+    from finances.models import Customer, Loan
+    from finances.serializers import CustomerSerializer, LoanSerializer
+
+    generator = random.Random(seed)
+    ids = dict(Customer.objects.values_list("external_id", "id"))
+    counter = itertools.count()
+    borrowers = []
+
+    def pick():
+        return customer_id(generator.randrange(customers))
+
+    def take_loan():
+        borrowers.append(pick())
+        create_loan(
+            {
+                "external_id": f"micro_loan_{next(counter)}",
+                "customer_external_id": borrowers[-1],
+                "amount": Decimal("100.00"),
+            }
+        )
+
+    def pay():
+        create_payment(
+            {
+                "external_id": f"micro_payment_{next(counter)}",
+                "customer_external_id": borrowers.pop(),
+                "total_amount": Decimal("1.00"),
+            }
+        )
+
+    return {
+        "get_total_debt": lambda: get_total_debt(ids[pick()]),
+        "create_loan": take_loan,
+        "create_payment": pay,
+        "serialize_customers": lambda: CustomerSerializer(
+            with_total_debt(Customer.objects.order_by("id"))[:100], many=True
+        ).data,
+        "serialize_loans": lambda: LoanSerializer(
+            Loan.objects.filter(customer_id=ids[pick()]), many=True
+        ).data,
+    }
+
+
+def run_micro(args):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    results = {}
+    with benchmark_database():
+        generate(
+            args.customers,
+            args.loans_per_customer,
+            args.payments_per_customer,
+            seed=args.seed,
+        )
+        for name, operation in micro_operations(args.customers, args.seed).items():
+            # Queries are counted on a separate warm-up run, capturing them slows
+            # the timed calls down
+            warmup = max(1, args.calls // 10)
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(warmup):
+                    operation()
+            timings = []
+            start = time.perf_counter()
+            for _ in range(args.calls):
+                call_start = time.perf_counter()
+                operation()
+                timings.append((time.perf_counter() - call_start) * 1000)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "calls_per_s": round(args.calls / elapsed, 1),
+                **percentiles(timings),
+                "queries_per_call": round(len(queries) / warmup, 2),
+            }
+            print(f"micro {name:<22} {format_result(results[name])}")
+    return results
+
+
+def macro_scenarios(seed):
+    # URL name -> (method, path, body). body is None or a function returning the
+    # JSON payload of a request, with a new external id every time. Every named URL
+    # of base_app/urls.py must have one
+    from django.urls import reverse
+    from finances.models import CustomerBalance
+    from finances.serializers import PaymentEnqueueSerializer
+
+    generator = random.Random(seed)
+    counter = itertools.count()
+    customer = customer_id(1)
+    # Customers with debt left for the payments of the run, 0.01 at a time
+    debtors = list(
+        CustomerBalance.objects.filter(total_debt__gt=100)
+        .order_by("customer_id")
+        .values_list("customer_id__external_id", flat=True)[:1000]
+    )
+    customers = list(
+        CustomerBalance.objects.order_by("customer_id").values_list(
+            "customer_id__external_id", flat=True
+        )[:1000]
+    )
+    queued = PaymentEnqueueSerializer(
+        data={
+            "external_id": "macro_queued",
+            "customer_external_id": debtors[0],
+            "total_amount": "0.01",
+        }
+    )
+    queued.is_valid(raise_exception=True)
+    queued.save()
+
+    def customer_body():
+        return {"external_id": f"macro_customer_{next(counter)}", "score": "1000.00"}
+
+    def loan_body():
+        return {
+            "external_id": f"macro_loan_{next(counter)}",
+            "customer_external_id": generator.choice(customers),
+            "amount": "10.00",
+        }
+
+    def payment_body():
+        return {
+            "external_id": f"macro_payment_{next(counter)}",
+            "customer_external_id": generator.choice(debtors),
+            "total_amount": "0.01",
+        }
+
+    return {
+        "create_customer": ("POST", reverse("create_customer"), customer_body),
+        "customer_list": ("GET", reverse("customer_list"), None),
+        "customer-detail": (
+            "GET",
+            reverse("customer-detail", args=[customer]),
+            None,
+        ),
+        "loan-create": ("POST", reverse("loan-create"), loan_body),
+        "loan-bulk-create": (
+            "POST",
+            reverse("loan-bulk-create"),
+            lambda: [loan_body() for _ in range(10)],
+        ),
+        "get_loans_by_customer_external_id": (
+            "GET",
+            reverse("get_loans_by_customer_external_id", args=[customer]),
+            None,
+        ),
+        "make_payment": ("POST", reverse("make_payment"), payment_body),
+        "payment-bulk-create": (
+            "POST",
+            reverse("payment-bulk-create"),
+            lambda: [payment_body() for _ in range(10)],
+        ),
+        "customer-detail-async": (
+            "GET",
+            reverse("customer-detail-async", args=[customer]),
+            None,
+        ),
+        "get_loans_by_customer_external_id_async": (
+            "GET",
+            reverse("get_loans_by_customer_external_id_async", args=[customer]),
+            None,
+        ),
+        "payment-queue-metrics": ("GET", reverse("payment-queue-metrics"), None),
+        "payment-queue-status": (
+            "GET",
+            reverse("payment-queue-status", args=["macro_queued"]),
+            None,
+        ),
+        "analytics-portfolio": ("GET", reverse("analytics-portfolio"), None),
+        "report-daily": ("GET", reverse("report-daily"), None),
+        "report-customer-daily": (
+            "GET",
+            reverse("report-customer-daily", args=[customer]),
+            None,
+        ),
+        "metrics": ("GET", reverse("metrics"), None),
+    }
+
+
+def url_names():
+    from base_app.urls import urlpatterns
+
+    return {pattern.name for pattern in urlpatterns if getattr(pattern, "name", None)}
+
+
+def count_queries(scenarios, api_key):
+    # Queries of one request to each scenario, after a first request warming up the
+    # caches
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext, setup_test_environment
+
+    setup_test_environment()
+    client = Client(HTTP_AUTHORIZATION=f"Api-Key {api_key}")
+    counts = {}
+    for name, (method, path, body) in scenarios.items():
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                if method == "GET":
+                    response = client.get(path, HTTP_ACCEPT="application/json")
+                else:
+                    response = client.post(
+                        path, json.dumps(body()), content_type="application/json"
+                    )
+            if not 200 <= response.status_code < 300:
+                raise SystemExit(
+                    f"{name}: {method} {path} answered {response.status_code}"
+                )
+        counts[name] = len(queries)
+    return counts
+
+
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def start_server(database, port, workers, log):
+    environment = {
+        **os.environ,
+        "SQLITE_PATH": str(database),
+        "BIND": f"127.0.0.1:{port}",
+        "WEB_CONCURRENCY": str(workers),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "deploy/gunicorn_wsgi.conf.py",
+            "base_app.wsgi:application",
+        ],
+        cwd=BASE_DIR,
+        env=environment,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with status {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("gunicorn did not start within 30 seconds")
+
+
+def run_macro(args):
+    from django.core.management import call_command
+    from django.db import connections
+    from finances.business_logic.snapshot_logic import build_snapshots
+    from rest_framework_api_key.models import APIKey
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database = Path(directory) / "benchmark.sqlite3"
+        # Seeded in process, then served by gunicorn through SQLITE_PATH. The
+        # connection left open by the micro benchmarks is dropped first
+        connections.close_all()
+        connections["default"].settings_dict["NAME"] = str(database)
+        call_command("migrate", verbosity=0)
+        generate(
+            args.customers,
+            args.loans_per_customer,
+            args.payments_per_customer,
+            seed=args.seed,
+        )
+        build_snapshots(lag=0)
+        _, api_key = APIKey.objects.create_key(name="benchmarks")
+        scenarios = macro_scenarios(args.seed)
+        missing = url_names() - set(scenarios)
+        if missing:
+            raise SystemExit(f"No macro scenario for {', '.join(sorted(missing))}")
+        queries = count_queries(scenarios, api_key)
+        connections.close_all()
+
+        port = free_port()
+        with open(Path(directory) / "gunicorn.log", "w") as log:
+            server = start_server(database, port, args.workers, log)
+            try:
+                for name, (method, path, body) in scenarios.items():
+                    url = f"http://localhost:{port}{path}"
+                    # Load the code paths and fill the caches of every worker first
+                    asyncio.run(
+                        load(
+                            url,
+                            api_key,
+                            max(args.connections),
+                            args.warmup,
+                            method=method,
+                            body=body,
+                        )
+                    )
+                    for clients in args.connections:
+                        result = asyncio.run(
+                            load(
+                                url,
+                                api_key,
+                                clients,
+                                args.duration,
+                                method=method,
+                                body=body,
+                            )
+                        )
+                        key = f"{name} c={clients}"
+                        results[key] = {
+                            "requests_per_s": result["requests_per_s"],
+                            **{
+                                metric: result.get(metric)
+                                for metric in ("p50_ms", "p95_ms", "p99_ms")
+                            },
+                            "errors": result["errors"],
+                            "queries_per_request": queries[name],
+                        }
+                        print(f"macro {key:<46} {format_result(results[key])}")
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+    return results
+
+
+def format_result(result):
+    return "  ".join(f"{metric} {value}" for metric, value in result.items())
+
+
+LATENCIES = ("p50_ms", "p95_ms", "p99_ms")
+COUNTS = ("queries_per_call", "queries_per_request", "errors")
+
+
+def compare(baseline, results, tolerance):
+    # Regressions of results against baseline as (benchmark, metric, old, new) rows.
+    # Throughput and latency are allowed to move by tolerance (a share of the
+    # baseline), query and error counts are not allowed to grow at all
+    regressions = []
+    for part in ("micro", "macro"):
+        for name, new in results.get(part, {}).items():
+            old = baseline.get(part, {}).get(name)
+            if old is None:
+                continue
+            for metric, value in new.items():
+                before = old.get(metric)
+                if before is None or value is None:
+                    continue
+                if metric.endswith("_per_s"):
+                    worse = value < before * (1 - tolerance)
+                elif metric in LATENCIES:
+                    worse = value > before * (1 + tolerance)
+                elif metric in COUNTS:
+                    worse = value > before
+                else:
+                    continue
+                if worse:
+                    regressions.append((f"{part} {name}", metric, before, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument(
+        "--parts", nargs="+", choices=["micro", "macro"], default=["micro", "macro"]
+    )
+    run_parser.add_argument("--customers", type=int, default=1000)
+    run_parser.add_argument("--loans-per-customer", type=int, default=10)
+    run_parser.add_argument("--payments-per-customer", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=22)
+    run_parser.add_argument(
+        "--calls", type=int, default=200, help="Calls per micro benchmark"
+    )
+    run_parser.add_argument(
+        "--connections",
+        type=int,
+        nargs="+",
+        default=[1, 8],
+        help="Concurrent clients of each macro load test",
+    )
+    run_parser.add_argument(
+        "--duration", type=float, default=5.0, help="Seconds per macro load test"
+    )
+    run_parser.add_argument(
+        "--warmup", type=float, default=1.0, help="Seconds of load before each test"
+    )
+    run_parser.add_argument("--workers", type=int, default=2)
+    run_parser.add_argument("--output", help="JSON file receiving the results")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        baseline = json.loads(Path(args.baseline).read_text())
+        results = json.loads(Path(args.results).read_text())
+        if baseline.get("parameters") != results.get("parameters"):
+            print("warning: the runs used different parameters")
+        regressions = compare(baseline, results, args.tolerance)
+        for name, metric, before, value in regressions:
+            print(f"REGRESSION {name} {metric}: {before} -> {value}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+        return
+
+    setup_django()
+    import django
+
+    parameters = {
+        name: getattr(args, name)
+        for name in (
+            "customers",
+            "loans_per_customer",
+            "payments_per_customer",
+            "seed",
+            "calls",
+            "connections",
+            "duration",
+            "warmup",
+            "workers",
+        )
+    }
+    results = {
+        "parameters": parameters,
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+    }
+    if "micro" in args.parts:
+        results["micro"] = run_micro(args)
+    if "macro" in args.parts:
+        results["macro"] = run_macro(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "base_app.settings")
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    # Run against a throwaway test database, never against db.sqlite3
+    from django.db import connection
+
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(function, repeat=5):
+    # Run function repeat times and return the timings in milliseconds
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def percentiles(timings):
+    # p50, p95 and p99 of timings in milliseconds
+    if len(timings) == 1:
+        return {key: round(timings[0], 3) for key in ("p50_ms", "p95_ms", "p99_ms")}
+    cuts = statistics.quantiles(timings, n=100)
+    return {
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+    }
+
+
+def summarize(timings):
+    return {
+        "min_ms": round(min(timings), 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(max(timings), 3),
+    }
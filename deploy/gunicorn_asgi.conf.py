@@ -0,0 +1,20 @@
+# ASGI deployment, gunicorn managing uvicorn workers
+#
+#     gunicorn -c deploy/gunicorn_asgi.conf.py base_app.asgi:application
+#
+# or uvicorn alone, for development or behind a process manager:
+#
+#     uvicorn base_app.asgi:application --host 0.0.0.0 --port 8000 --workers 4
+#
+# Each uvicorn worker runs an event loop serving many connections at once. The async
+# views (/async/...) stay on the loop; the synchronous DRF views run in a thread
+# pool, one request at a time per worker, so they do not gain from this deployment
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
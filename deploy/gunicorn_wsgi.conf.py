@@ -0,0 +1,16 @@
+# WSGI deployment, the default one (see the Dockerfile)
+#
+#     gunicorn -c deploy/gunicorn_wsgi.conf.py base_app.wsgi:application
+#
+# Each sync worker serves one request at a time, concurrency comes from the number of
+# workers. WEB_CONCURRENCY overrides it, keep it equal to the ASGI deployment's when
+# comparing both with benchmarks.load_test
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "sync"
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
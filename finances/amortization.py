@@ -0,0 +1,247 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.utils import timezone
+from .analytics import cents, column_chunks
+from .models import Loan, LoanSchedule
+
+# Defaults of the AMORTIZATION setting
+AMORTIZATION_DEFAULTS = {
+    # Terms of each contract version. METHOD is annuity (equal installments, French),
+    # flat (equal principal parts, interest on the original principal) or bullet
+    # (interest every period, the principal with the last installment). The rate of
+    # a period is ANNUAL_RATE * PERIOD_DAYS / 365
+    "CONTRACTS": {
+        "v1.0": {
+            "METHOD": "annuity",
+            "INSTALLMENTS": 12,
+            "PERIOD_DAYS": 30,
+            "ANNUAL_RATE": "0.24",
+        },
+    },
+    # Contract of the loans created through the API and of the loans without one
+    "DEFAULT_CONTRACT": "v1.0",
+    # Loans read per query by generate_schedules
+    "BATCH_SIZE": 10000,
+}
+
+EPOCH = date(1970, 1, 1)
+
+
+def amortization_settings():
+    return {**AMORTIZATION_DEFAULTS, **getattr(settings, "AMORTIZATION", {})}
+
+
+def installment_plan(method, principal, rate, installments):
+    # Principal and interest parts in cents of the installments of loans sharing the
+    # same terms, two int64 arrays of shape (loans, installments). principal holds
+    # the amounts lent in cents. Parts are rounded to the cent (half to even) and the
+    # last installment takes the rounding difference, the principal parts of a loan
+    # always add up to its principal
+    principal = np.asarray(principal, dtype=np.int64)
+    parts = np.zeros((len(principal), installments), dtype=np.int64)
+    interest = np.zeros_like(parts)
+    if method == "bullet":
+        interest[:] = np.rint(principal * rate).astype(np.int64)[:, None]
+        parts[:, -1] = principal
+    elif method == "flat":
+        interest[:] = np.rint(principal * rate).astype(np.int64)[:, None]
+        parts[:] = (principal // installments)[:, None]
+        parts[:, -1] = principal - parts[:, 0] * (installments - 1)
+    elif method == "annuity":
+        if rate:
+            payment = principal * rate / (1 - (1 + rate) ** -installments)
+        else:
+            payment = principal / installments
+        payment = np.rint(payment).astype(np.int64)
+        balance = principal.copy()
+        # One vector operation per installment over every loan
+        for number in range(installments):
+            interest[:, number] = np.rint(balance * rate)
+            if number == installments - 1:
+                parts[:, number] = balance
+            else:
+                parts[:, number] = np.minimum(payment - interest[:, number], balance)
+            balance -= parts[:, number]
+    else:
+        raise ValueError(f"Unknown amortization method {method!r}")
+    return parts, interest
+
+
+def day_numbers(values):
+    # Days since EPOCH of the local dates of the datetimes
+    return np.fromiter(
+        ((timezone.localdate(value) - EPOCH).days for value in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+
+
+def build_schedules(loans, versions, principal, paid, taken_at, now):
+    # Schedules of the loans described by the arrays, one LoanSchedule per loan of a
+    # known contract version. loans holds Loan instances or ids, principal and paid
+    # are in cents. Returns the schedules and (positions, term) pairs giving the
+    # positions of the scheduled loans of each version and the time from taken_at
+    # to their last due date
+    config = amortization_settings()
+    versions = np.where(versions == "", config["DEFAULT_CONTRACT"], versions)
+    schedules = []
+    terms_by_version = []
+    for version in np.unique(versions).tolist():
+        terms = config["CONTRACTS"].get(version)
+        if terms is None:
+            continue
+        positions = np.flatnonzero(versions == version)
+        installments = terms["INSTALLMENTS"]
+        period = terms["PERIOD_DAYS"]
+        rate = float(Decimal(terms["ANNUAL_RATE"]) * period / 365)
+        parts, interest = installment_plan(
+            terms["METHOD"], principal[positions], rate, installments
+        )
+        steps = period * np.arange(1, installments + 1, dtype=np.int32)
+        due_days = (day_numbers(taken_at[positions])[:, None] + steps).astype("<i4")
+        parts = parts.astype("<i8")
+        interest = interest.astype("<i8")
+        field = "loan_id" if isinstance(loans[0], Loan) else "loan_id_id"
+        for row, position in enumerate(positions.tolist()):
+            schedules.append(
+                LoanSchedule(
+                    **{field: loans[position]},
+                    contract_version=version,
+                    method=terms["METHOD"],
+                    due_days=due_days[row].tobytes(),
+                    principal=parts[row].tobytes(),
+                    interest=interest[row].tobytes(),
+                    paid=Decimal(int(paid[position])).scaleb(-2),
+                    generated_at=now,
+                )
+            )
+        terms_by_version.append((positions, timedelta(days=period * installments)))
+    return schedules, terms_by_version
+
+
+def schedule_loans(loans, now=None):
+    # Schedules of new Loan instances, to bulk_create once the loans are saved. Sets
+    # the maximum_payment_date of the loans to their last due date
+    if not loans:
+        return []
+    now = now or timezone.now()
+    schedules, terms_by_version = build_schedules(
+        loans,
+        np.array([loan.contract_version for loan in loans], dtype=object),
+        np.array([int(loan.amount * 100) for loan in loans], dtype=np.int64),
+        np.array(
+            [int((loan.amount - loan.outstanding) * 100) for loan in loans],
+            dtype=np.int64,
+        ),
+        np.array([loan.taken_at for loan in loans], dtype=object),
+        now,
+    )
+    for positions, term in terms_by_version:
+        for position in positions.tolist():
+            loans[position].maximum_payment_date = loans[position].taken_at + term
+    return schedules
+
+
+def generate_schedules(queryset=None, batch_size=None, now=None):
+    # Generate or regenerate the schedules of the loans of queryset (the open loans
+    # by default) from their amount, taken_at and contract terms, one chunk of loans
+    # per transaction. The money already paid is kept, a new schedule starts with
+    # the amount repaid so far. Returns the number of schedules written and of loans
+    # skipped for an unknown contract version
+    batch_size = batch_size or amortization_settings()["BATCH_SIZE"]
+    now = now or timezone.now()
+    if queryset is None:
+        queryset = Loan.objects.filter(status=2)
+    queryset = queryset.annotate(
+        amount_cents=cents("amount"), outstanding_cents=cents("outstanding")
+    )
+    fields = ["id", "contract_version", "amount_cents", "outstanding_cents", "taken_at"]
+    written = skipped = 0
+    for chunk in column_chunks(queryset, fields, batch_size):
+        principal = chunk["amount_cents"].astype(np.int64)
+        schedules, terms_by_version = build_schedules(
+            chunk["id"].tolist(),
+            chunk["contract_version"],
+            principal,
+            np.maximum(principal - chunk["outstanding_cents"].astype(np.int64), 0),
+            chunk["taken_at"],
+            now,
+        )
+        with transaction.atomic():
+            LoanSchedule.objects.bulk_create(
+                schedules,
+                update_conflicts=True,
+                unique_fields=["loan_id"],
+                update_fields=[
+                    "contract_version",
+                    "method",
+                    "due_days",
+                    "principal",
+                    "interest",
+                    "generated_at",
+                ],
+            )
+            # One UPDATE per contract version, only for the loans whose terms moved
+            # their last due date
+            for positions, term in terms_by_version:
+                last_due = F("taken_at") + Value(term)
+                Loan.objects.filter(id__in=chunk["id"][positions].tolist()).exclude(
+                    maximum_payment_date=last_due
+                ).update(maximum_payment_date=last_due)
+        written += len(schedules)
+        skipped += len(chunk["id"]) - len(schedules)
+    return written, skipped
+
+
+def installments(schedule):
+    # Due dates and amounts in cents of a schedule's installments
+    due_days = np.frombuffer(schedule.due_days, dtype="<i4")
+    amounts = np.frombuffer(schedule.principal, dtype="<i8") + np.frombuffer(
+        schedule.interest, dtype="<i8"
+    )
+    return due_days, amounts
+
+
+def amount_due(schedule, today):
+    # Money of the installments due by today not paid yet
+    due_days, amounts = installments(schedule)
+    reached = int(np.searchsorted(due_days, (today - EPOCH).days, side="right"))
+    scheduled = Decimal(int(amounts[:reached].sum())).scaleb(-2)
+    return max(scheduled - schedule.paid, Decimal(0))
+
+
+def loan_schedules(loans):
+    # LoanSchedule of each loan by loan id, for loans read with
+    # select_related("loanschedule"). Loans without a schedule are left out
+    schedules = {}
+    for loan in loans:
+        schedule = getattr(loan, "loanschedule", None)
+        if schedule is not None:
+            schedules[loan.id] = schedule
+    return schedules
+
+
+def amounts_due(schedules, today):
+    # Money due on each loan by today, for allocate_payment. schedules maps loan ids
+    # to their LoanSchedule
+    return {
+        loan_id: amount_due(schedule, today) for loan_id, schedule in schedules.items()
+    }
+
+
+def record_payments(schedules, allocations):
+    # Add the (loan, amount) allocations of a payment to the paid amount of the
+    # loans' schedules, in memory. Loans without a schedule are skipped. Returns the
+    # changed schedules, to bulk_update on "paid"
+    changed = []
+    for loan, amount in allocations:
+        schedule = schedules.get(loan.id)
+        if schedule is not None:
+            schedule.paid += amount
+            changed.append(schedule)
+    return changed
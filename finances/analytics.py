@@ -0,0 +1,310 @@
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import (
+    BigIntegerField,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import LRUCache
+from .models import Customer, Loan, PaymentDetail
+
+# Defaults of the ANALYTICS setting
+ANALYTICS_DEFAULTS = {
+    # Seconds the portfolio metrics are reused before being computed again
+    "TTL": 300,
+    # Rows read per query. The metrics are reduced chunk by chunk into fixed size
+    # accumulators, so the memory used depends on this and not on the table sizes
+    "CHUNK_SIZE": 50000,
+    # Days of payment details the repayment velocity is measured over
+    "VELOCITY_WINDOW": 90,
+    # Alias of a Django cache shared by every worker, replacing the in-process cache
+    "CACHE_ALIAS": None,
+}
+
+# Upper bounds in days of the aging buckets of the open loans, the last one is open
+AGING_BUCKETS = [30, 60, 90, 180]
+
+# Utilization (debt / score) is counted in bins of 1 / UTILIZATION_BINS_PER_UNIT up
+# to UTILIZATION_MAX, plus one bin above it. Percentiles are read from these bins,
+# the distribution is reported in bins of 0.1
+UTILIZATION_BINS_PER_UNIT = 100
+UTILIZATION_MAX = 2
+
+CACHE_KEY = "analytics:portfolio"
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def analytics_settings():
+    return {**ANALYTICS_DEFAULTS, **getattr(settings, "ANALYTICS", {})}
+
+
+def cents(field):
+    # Raw integer cents of a MoneyField column, skipping the conversion to Decimal
+    return ExpressionWrapper(F(field), output_field=BigIntegerField())
+
+
+def money(value):
+    # Amount in cents rendered like the DecimalField(12, 2) fields of the API
+    return str(Decimal(int(value)).scaleb(-2))
+
+
+def column_chunks(queryset, fields, chunk_size):
+    # One dict of NumPy arrays per chunk_size rows of queryset, read in primary key
+    # order after the last key of the previous chunk. fields[0] is the primary key
+    pk = fields[0]
+    last = None
+    while True:
+        chunk = queryset.order_by(pk)
+        if last is not None:
+            chunk = chunk.filter(**{f"{pk}__gt": last})
+        rows = list(chunk.values_list(*fields)[:chunk_size])
+        if not rows:
+            return
+        yield {
+            name: np.array(values, dtype=object)
+            for name, values in zip(fields, zip(*rows))
+        }
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def timestamps(values):
+    return np.fromiter(
+        (value.timestamp() for value in values), dtype=np.float64, count=len(values)
+    )
+
+
+def loan_metrics(now, chunk_size):
+    # Outstanding and amount by status, and the aging of the open loans (status 2
+    # with money outstanding) by taken_at
+    statuses = {}
+    aging_count = np.zeros(len(AGING_BUCKETS) + 1, dtype=np.int64)
+    aging_outstanding = [0] * (len(AGING_BUCKETS) + 1)
+    queryset = Loan.objects.annotate(
+        outstanding_cents=cents("outstanding"), amount_cents=cents("amount")
+    )
+    fields = ["id", "status", "outstanding_cents", "amount_cents", "taken_at"]
+    for chunk in column_chunks(queryset, fields, chunk_size):
+        status = chunk["status"].astype(np.int64)
+        outstanding = chunk["outstanding_cents"].astype(np.int64)
+        amount = chunk["amount_cents"].astype(np.int64)
+
+        # Group by status: chunk sums are exact in int64, the totals are Python ints
+        keys, groups = np.unique(status, return_inverse=True)
+        count = np.bincount(groups, minlength=len(keys))
+        outstanding_sum = np.zeros(len(keys), dtype=np.int64)
+        amount_sum = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(outstanding_sum, groups, outstanding)
+        np.add.at(amount_sum, groups, amount)
+        for index, key in enumerate(keys.tolist()):
+            totals = statuses.setdefault(key, [0, 0, 0])
+            totals[0] += int(count[index])
+            totals[1] += int(outstanding_sum[index])
+            totals[2] += int(amount_sum[index])
+
+        open_loans = (status == 2) & (outstanding > 0)
+        if open_loans.any():
+            age_days = (now.timestamp() - timestamps(chunk["taken_at"][open_loans])) / (
+                SECONDS_PER_DAY
+            )
+            buckets = np.searchsorted(AGING_BUCKETS, age_days, side="left")
+            aging_count += np.bincount(buckets, minlength=len(AGING_BUCKETS) + 1)
+            bucket_outstanding = np.zeros(len(AGING_BUCKETS) + 1, dtype=np.int64)
+            np.add.at(bucket_outstanding, buckets, outstanding[open_loans])
+            for index, value in enumerate(bucket_outstanding.tolist()):
+                aging_outstanding[index] += value
+
+    bounds = [0] + AGING_BUCKETS
+    labels = [f"{low}-{high}" for low, high in zip(bounds, AGING_BUCKETS)]
+    labels.append(f"{AGING_BUCKETS[-1]}+")
+    return {
+        "by_status": {
+            str(key): {
+                "loans": count,
+                "outstanding": money(outstanding),
+                "amount": money(amount),
+            }
+            for key, (count, outstanding, amount) in sorted(statuses.items())
+        },
+        "aging": {
+            label: {"loans": int(count), "outstanding": money(outstanding)}
+            for label, count, outstanding in zip(
+                labels, aging_count.tolist(), aging_outstanding
+            )
+        },
+    }
+
+
+def utilization_metrics(chunk_size):
+    # Distribution of debt / score over the customers with a score. The debt comes
+    # from the ledger, aggregated from Loan for customers without a ledger row
+    bins = UTILIZATION_MAX * UTILIZATION_BINS_PER_UNIT
+    histogram = np.zeros(bins + 1, dtype=np.int64)
+    total_debt = total_score = 0
+    utilization_sum = 0.0
+    without_score = 0
+
+    loan_debt = (
+        Loan.objects.filter(customer_id=OuterRef("pk"), status=2)
+        .values("customer_id")
+        .annotate(total=Sum("outstanding"))
+        .values("total")
+    )
+    queryset = Customer.objects.annotate(
+        score_cents=cents("score"),
+        debt_cents=Coalesce(
+            F("customerbalance__total_debt"),
+            Subquery(loan_debt),
+            Value(0),
+            output_field=BigIntegerField(),
+        ),
+    )
+    for chunk in column_chunks(
+        queryset, ["id", "score_cents", "debt_cents"], chunk_size
+    ):
+        score = chunk["score_cents"].astype(np.int64)
+        debt = chunk["debt_cents"].astype(np.int64)
+        total_debt += int(debt.sum())
+        total_score += int(score.sum())
+        scored = score > 0
+        without_score += int((~scored).sum())
+        debt, score = debt[scored], score[scored]
+        utilization_sum += float((debt / score).sum())
+        # Bins in integer arithmetic, a utilization of exactly 0.3 lands in bin 30
+        histogram += np.bincount(
+            np.clip(debt * UTILIZATION_BINS_PER_UNIT // score, 0, bins),
+            minlength=bins + 1,
+        )
+
+    customers = int(histogram.sum())
+    cumulative = np.cumsum(histogram)
+    percentiles = {}
+    for percentile in (50, 90, 99):
+        if not customers:
+            percentiles[f"p{percentile}"] = None
+            continue
+        index = int(np.searchsorted(cumulative, customers * percentile / 100))
+        # Upper edge of the bin holding the percentile, None above UTILIZATION_MAX
+        percentiles[f"p{percentile}"] = (
+            (index + 1) / UTILIZATION_BINS_PER_UNIT if index < bins else None
+        )
+
+    per_tenth = UTILIZATION_BINS_PER_UNIT // 10
+    distribution = {
+        f"{low / 10:.1f}-{(low + 1) / 10:.1f}": int(count)
+        for low, count in enumerate(
+            histogram[:bins].reshape(-1, per_tenth).sum(axis=1).tolist()
+        )
+    }
+    distribution[f"{UTILIZATION_MAX:.1f}+"] = int(histogram[bins])
+    return {
+        "customers": customers,
+        "customers_without_score": without_score,
+        "total_debt": money(total_debt),
+        "total_score": money(total_score),
+        "portfolio": round(total_debt / total_score, 4) if total_score else None,
+        "mean": round(utilization_sum / customers, 4) if customers else None,
+        **percentiles,
+        "distribution": distribution,
+    }
+
+
+def velocity_metrics(now, window, chunk_size):
+    # Money repaid per day over the last window days, from the payment details
+    daily = np.zeros(window, dtype=np.float64)
+    details = 0
+    queryset = PaymentDetail.objects.filter(
+        created_at__gt=now - timedelta(days=window), created_at__lte=now
+    )
+    for chunk in column_chunks(queryset, ["id", "created_at", "amount"], chunk_size):
+        days_ago = (
+            (now.timestamp() - timestamps(chunk["created_at"])) // SECONDS_PER_DAY
+        ).astype(np.int64)
+        days_ago = np.clip(days_ago, 0, window - 1)
+        daily += np.bincount(
+            days_ago, weights=chunk["amount"].astype(np.float64), minlength=window
+        )
+        details += len(days_ago)
+
+    repaid = {
+        f"last_{days}_days": f"{daily[:days].sum():.2f}"
+        for days in (7, 30, window)
+        if days <= window
+    }
+    return {
+        "window_days": window,
+        "payment_details": details,
+        **repaid,
+        "per_day": f"{daily.sum() / window:.2f}",
+    }
+
+
+def compute_portfolio_metrics(now=None, chunk_size=None):
+    # Portfolio-wide metrics, reading Loan, Customer and PaymentDetail in chunks
+    config = analytics_settings()
+    now = now or timezone.now()
+    chunk_size = chunk_size or config["CHUNK_SIZE"]
+    start = time.perf_counter()
+    metrics = {
+        "generated_at": now.isoformat(),
+        "loans": loan_metrics(now, chunk_size),
+        "utilization": utilization_metrics(chunk_size),
+        "repayment_velocity": velocity_metrics(
+            now, config["VELOCITY_WINDOW"], chunk_size
+        ),
+    }
+    metrics["compute_seconds"] = round(time.perf_counter() - start, 3)
+    return metrics
+
+
+class PortfolioCache:
+    """
+    Holds the last portfolio metrics for ANALYTICS["TTL"] seconds. Concurrent misses
+    in a process wait for one computation instead of scanning the tables each.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(max_size=1)
+        self._lock = threading.Lock()
+
+    def get_or_compute(self):
+        config = analytics_settings()
+        if config["CACHE_ALIAS"]:
+            cache = caches[config["CACHE_ALIAS"]]
+            metrics = cache.get(CACHE_KEY)
+            if metrics is None:
+                with self._lock:
+                    metrics = cache.get(CACHE_KEY)
+                    if metrics is None:
+                        metrics = compute_portfolio_metrics()
+                        cache.set(CACHE_KEY, metrics, timeout=config["TTL"])
+            return metrics
+
+        metrics = self.local.get(CACHE_KEY)
+        if metrics is None:
+            with self._lock:
+                metrics = self.local.get(CACHE_KEY)
+                if metrics is None:
+                    metrics = compute_portfolio_metrics()
+                    self.local.set(CACHE_KEY, metrics, ttl=config["TTL"])
+        return metrics
+
+    def clear(self):
+        self.local.clear()
+
+
+portfolio_cache = PortfolioCache()
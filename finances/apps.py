@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class FinancesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "finances"
+
+    def ready(self):
+        # Connect the API key and balance cache invalidation signals, and the SQLite
+        # connection setup
+        from . import db, permissions  # noqa: F401
+        from .business_logic import customer_logic  # noqa: F401
@@ -0,0 +1,118 @@
+# Async versions of the read endpoints, for ASGI deployments (see the README). They
+# answer with the same JSON as their synchronous DRF views, without the DRF request
+# cycle: the API key check, the queries and the rendering are done here, and the
+# queries go through Django's async ORM.
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .business_logic.customer_logic import aget_balance_payload
+from .models import Customer, Loan
+from .pagination import CreatedAtCursorPagination
+from .permissions import CachedHasAPIKey
+from .query_budget import QueryBudget
+from .read_plans import LOAN_READ_PLAN
+from .serializers import loan_read_queryset
+from .streaming import StreamingListMixin
+
+
+def json_response(data, status=200):
+    return HttpResponse(
+        JSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+# Same bodies as the DRF exceptions raised by the synchronous views
+NOT_AUTHENTICATED = {"detail": "Authentication credentials were not provided."}
+
+
+class AsyncAPIKeyView(View):
+    # Checks the API key like CachedHasAPIKey does for the DRF views. A verification
+    # missing from the in-process cache queries the database and hashes the key, it
+    # runs in a worker thread
+    async def dispatch(self, request, *args, **kwargs):
+        permission = CachedHasAPIKey()
+        key = permission.get_key(request)
+        verification = key and permission.get_local_verification(key)
+        if verification:
+            allowed = permission.is_allowed(verification)
+        else:
+            allowed = await sync_to_async(permission.has_permission)(request, self)
+        if not allowed:
+            return json_response(NOT_AUTHENTICATED, status=403)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncCustomerBalanceView(AsyncAPIKeyView):
+    query_budget = {"GET": QueryBudget(1)}
+
+    async def get(self, request, external_id):
+        try:
+            payload = await aget_balance_payload(external_id)
+        except Customer.DoesNotExist:
+            return json_response({"detail": "Not found."}, status=404)
+        return json_response(payload)
+
+
+class AsyncLoansByCustomerView(AsyncAPIKeyView):
+    # Paginated like LoansByCustomerExternalIdView, or streamed with ?stream=true
+    stream_chunk_size = StreamingListMixin.stream_chunk_size
+    query_budget = {"GET": QueryBudget(1)}
+
+    async def get(self, request, external_id):
+        queryset = LOAN_READ_PLAN.queryset(
+            loan_read_queryset(
+                Loan.objects.filter(customer_id__external_id=external_id)
+            )
+        )
+
+        if request.GET.get(StreamingListMixin.stream_query_param) in ("1", "true"):
+            if not await self.customer_exists(external_id):
+                return self.not_found()
+            rows = self.keyset_rows(queryset, self.stream_chunk_size)
+            return StreamingHttpResponse(
+                LOAN_READ_PLAN.arender_stream(rows, self.stream_chunk_size),
+                content_type="application/json",
+            )
+
+        # The cursor pagination builds and reads the page in one call, it runs in a
+        # worker thread, the same way the async ORM runs its queries
+        paginator = CreatedAtCursorPagination()
+        rows = await sync_to_async(paginator.paginate_queryset)(
+            queryset, Request(request)
+        )
+        if not rows and not await self.customer_exists(external_id):
+            return self.not_found()
+        return HttpResponse(
+            LOAN_READ_PLAN.render_page(
+                rows, paginator.get_next_link(), paginator.get_previous_link()
+            ),
+            content_type="application/json",
+        )
+
+    async def keyset_rows(self, queryset, chunk_size):
+        # Rows in (created_at, id) order, read chunk_size at a time after the last row
+        # of the previous chunk. QuerySet.aiterator() runs its query in the event loop
+        # for values_list querysets on Django 5.0, async iteration of a slice does not
+        queryset = queryset.order_by("created_at", "id")
+        chunk = queryset
+        while True:
+            rows = [row async for row in chunk[:chunk_size]]
+            for row in rows:
+                yield row
+            if len(rows) < chunk_size:
+                return
+            created_at, last_id = rows[-1][0], rows[-1][1]
+            chunk = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=last_id)
+            )
+
+    async def customer_exists(self, external_id):
+        return await Customer.objects.filter(external_id=external_id).aexists()
+
+    def not_found(self):
+        return json_response(
+            {"detail": "No Customer matches the given query."}, status=404
+        )
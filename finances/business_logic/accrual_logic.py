@@ -0,0 +1,278 @@
+import multiprocessing
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import django
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery
+from django.utils import timezone
+from ..amortization import EPOCH, amortization_settings
+from ..analytics import cents, column_chunks
+from ..models import Customer, CustomerBalance, Loan, LoanAccrual
+from .concurrency import retry_on_conflict
+from .customer_logic import get_balances, invalidate_balances
+
+# Defaults of the ACCRUAL setting
+ACCRUAL_DEFAULTS = {
+    # Open loans accrued per transaction
+    "BATCH_SIZE": 5000,
+    # Worker processes of a run, each one accrues the loans of a customer id range
+    "WORKERS": 1,
+    # Days an installment can stay unpaid after its due date before it bears late fees
+    "GRACE_DAYS": 5,
+    # Annual rate of the late fees, accrued daily on the overdue installments. The
+    # interest accrues daily on the outstanding at the ANNUAL_RATE of the contract
+    "LATE_FEE_RATE": "0.36",
+}
+
+DAYS_PER_YEAR = 365
+
+
+def accrual_settings():
+    return {**ACCRUAL_DEFAULTS, **getattr(settings, "ACCRUAL", {})}
+
+
+def daily_accrual(amounts, annual_rate):
+    # One day at annual_rate of the amounts in cents, rounded half to even to the
+    # cent like Decimal.quantize. The rate is applied as the exact fraction of its
+    # decimal string, so the integer math gives the same cents as Decimal would
+    numerator, denominator = Decimal(annual_rate).as_integer_ratio()
+    quotient, remainder = np.divmod(
+        np.asarray(amounts, dtype=np.int64) * numerator,
+        denominator * DAYS_PER_YEAR,
+    )
+    twice = 2 * remainder
+    divisor = denominator * DAYS_PER_YEAR
+    round_up = (twice > divisor) | ((twice == divisor) & (quotient % 2 == 1))
+    return quotient + round_up
+
+
+def overdue_amounts(due_days, principal, interest, paid, cutoff):
+    # Money of the installments due on or before the cutoff day number not paid yet,
+    # in cents. The packed arrays of schedules with the same number of installments
+    # are stacked into (loans, installments) matrices
+    due_days = np.frombuffer(b"".join(due_days), dtype="<i4").reshape(len(paid), -1)
+    amounts = np.frombuffer(b"".join(principal), dtype="<i8").reshape(
+        len(paid), -1
+    ) + np.frombuffer(b"".join(interest), dtype="<i8").reshape(len(paid), -1)
+    scheduled = np.where(due_days <= cutoff, amounts, 0).sum(axis=1)
+    return np.maximum(scheduled - paid, 0)
+
+
+def compute_accruals(chunk, date):
+    # Interest and late fee in cents of each loan of a chunk of loan columns. Loans
+    # of an unknown contract version get neither, they are reported as skipped
+    config = accrual_settings()
+    amortization = amortization_settings()
+    versions = np.where(
+        chunk["contract_version"] == "",
+        amortization["DEFAULT_CONTRACT"],
+        chunk["contract_version"],
+    )
+    outstanding = chunk["outstanding_cents"].astype(np.int64)
+    interest = np.zeros(len(outstanding), dtype=np.int64)
+    late_fee = np.zeros(len(outstanding), dtype=np.int64)
+    known = np.zeros(len(outstanding), dtype=bool)
+    for version in np.unique(versions).tolist():
+        terms = amortization["CONTRACTS"].get(version)
+        if terms is None:
+            continue
+        positions = np.flatnonzero(versions == version)
+        known[positions] = True
+        interest[positions] = daily_accrual(
+            outstanding[positions], terms["ANNUAL_RATE"]
+        )
+
+    # Late fees on the installments overdue past the grace days, on at most the
+    # outstanding. Schedules are grouped by their number of installments, which
+    # only differ within a version when its terms changed since they were generated
+    installments = np.array(
+        [len(days or b"") // 4 for days in chunk["loanschedule__due_days"]]
+    )
+    cutoff = (date - EPOCH).days - config["GRACE_DAYS"]
+    for count in np.unique(installments[known]).tolist():
+        if not count:
+            continue
+        positions = np.flatnonzero(known & (installments == count))
+        overdue = overdue_amounts(
+            chunk["loanschedule__due_days"][positions],
+            chunk["loanschedule__principal"][positions],
+            chunk["loanschedule__interest"][positions],
+            chunk["paid_cents"][positions].astype(np.int64),
+            cutoff,
+        )
+        late_fee[positions] = daily_accrual(
+            np.minimum(overdue, outstanding[positions]), config["LATE_FEE_RATE"]
+        )
+    return interest, late_fee, known
+
+
+def accrual_loans(date, customer_range=None):
+    # Open loans to accrue on date: taken by the end of that day, with money
+    # outstanding. customer_range is a (low, high) pair of customer ids, high excluded
+    end = timezone.make_aware(datetime.combine(date + timedelta(days=1), time.min))
+    loans = Loan.objects.filter(status=2, outstanding__gt=0, taken_at__lt=end)
+    if customer_range is not None:
+        low, high = customer_range
+        loans = loans.filter(customer_id__gte=low, customer_id__lt=high)
+    return loans
+
+
+def accrue_loans(date, customer_range=None, batch_size=None):
+    # Accrue one day of interest and late fees on the open loans, batch_size loans
+    # per transaction in primary key order. Returns the totals of accrue_chunk
+    batch_size = batch_size or accrual_settings()["BATCH_SIZE"]
+    loans = accrual_loans(date, customer_range)
+    totals = {"loans": 0, "skipped": 0, "interest": 0, "late_fees": 0}
+    for chunk in column_chunks(loans, ["id", "customer_id"], batch_size):
+        result = accrue_chunk(
+            date,
+            loans.filter(id__gte=chunk["id"][0], id__lte=chunk["id"][-1]),
+            sorted(set(chunk["customer_id"].tolist())),
+        )
+        for name, value in result.items():
+            totals[name] += value
+    return totals
+
+
+# A batch job can wait longer than a request for the workers of the other ranges,
+# which on SQLite all contend for the one write lock
+@retry_on_conflict(attempts=10, backoff=0.05)
+def accrue_chunk(date, loans, customer_ids):
+    # Accrue the loans of one chunk in a transaction: a journal row per loan, the
+    # outstanding of the loans and the balance ledger of their customers
+    with transaction.atomic():
+        # Lock the customers first, in id order like the bulk writes, so the loans
+        # read below cannot be paid or grown before commit
+        external_ids = dict(
+            Customer.objects.select_for_update()
+            .filter(id__in=customer_ids)
+            .order_by("id")
+            .values_list("id", "external_id")
+        )
+        # Loans already in the journal for the date were accrued by an earlier run
+        loans = loans.exclude(
+            id__in=LoanAccrual.objects.filter(date=date, loan_id__in=loans).values(
+                "loan_id"
+            )
+        ).annotate(
+            outstanding_cents=cents("outstanding"),
+            paid_cents=cents("loanschedule__paid"),
+        )
+        fields = [
+            "id",
+            "customer_id",
+            "contract_version",
+            "outstanding_cents",
+            "loanschedule__due_days",
+            "loanschedule__principal",
+            "loanschedule__interest",
+            "paid_cents",
+        ]
+        rows = list(loans.order_by("id").values_list(*fields))
+        if not rows:
+            return {"loans": 0, "skipped": 0, "interest": 0, "late_fees": 0}
+        chunk = {
+            name: np.array(values, dtype=object)
+            for name, values in zip(fields, zip(*rows))
+        }
+        interest, late_fee, known = compute_accruals(chunk, date)
+        accrued = np.flatnonzero(known & (interest + late_fee > 0))
+
+        # The ledger rows are read before the loans change, get_balances builds the
+        # missing ones from the loans
+        customers = chunk["customer_id"][accrued].astype(np.int64)
+        balances = get_balances(np.unique(customers).tolist())
+        LoanAccrual.objects.bulk_create(
+            LoanAccrual(
+                loan_id_id=loan_id,
+                date=date,
+                outstanding=Decimal(int(outstanding)).scaleb(-2),
+                interest=Decimal(int(loan_interest)).scaleb(-2),
+                late_fee=Decimal(int(loan_late_fee)).scaleb(-2),
+            )
+            for loan_id, outstanding, loan_interest, loan_late_fee in zip(
+                chunk["id"][accrued].tolist(),
+                chunk["outstanding_cents"][accrued].tolist(),
+                interest[accrued].tolist(),
+                late_fee[accrued].tolist(),
+            )
+        )
+        # One UPDATE adding each loan's journal row of the date, instead of a
+        # bulk_update whose CASE per loan costs more to build than to run
+        journal = LoanAccrual.objects.filter(loan_id=OuterRef("pk"), date=date)
+        Loan.objects.filter(id__in=chunk["id"][accrued].tolist()).update(
+            outstanding=F("outstanding")
+            + Subquery(journal.values(total=F("interest") + F("late_fee"))),
+            updated_at=timezone.now(),
+        )
+
+        # Per customer totals, exact in int64
+        keys, groups = np.unique(customers, return_inverse=True)
+        debt = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(debt, groups, interest[accrued] + late_fee[accrued])
+        now = timezone.now()
+        for customer_id, customer_debt in zip(keys.tolist(), debt.tolist()):
+            balance = balances[customer_id]
+            balance.total_debt += Decimal(customer_debt).scaleb(-2)
+            balance.updated_at = now
+        CustomerBalance.objects.bulk_update(
+            balances.values(), ["total_debt", "updated_at"]
+        )
+        # Only reaches the API processes through a shared BALANCE_CACHE, their
+        # in-process caches serve the old balances until the TTL expires
+        invalidate_balances(external_ids[customer_id] for customer_id in keys.tolist())
+
+    return {
+        "loans": len(accrued),
+        "skipped": int((~known).sum()),
+        "interest": int(interest[accrued].sum()),
+        "late_fees": int(late_fee[accrued].sum()),
+    }
+
+
+def customer_ranges(workers):
+    # Split the customer ids into workers (low, high) ranges of equal width, high
+    # excluded, for the worker processes
+    bounds = Customer.objects.aggregate(low=Min("id"), high=Max("id"))
+    if bounds["low"] is None:
+        return []
+    low, high = bounds["low"], bounds["high"] + 1
+    edges = np.linspace(low, high, workers + 1).round().astype(np.int64).tolist()
+    return [(start, end) for start, end in zip(edges, edges[1:]) if start < end]
+
+
+def accrue_partition(date, customer_range, batch_size):
+    # Entry point of a worker process
+    try:
+        return accrue_loans(date, customer_range, batch_size)
+    finally:
+        connections.close_all()
+
+
+def accrue(date, workers=None, batch_size=None):
+    # Accrue the open loans on date, in worker processes each handling one customer
+    # id range when workers > 1. The accrual of a date can be run again, or stopped
+    # and resumed: the loans already accrued for it are skipped
+    config = accrual_settings()
+    workers = workers or config["WORKERS"]
+    batch_size = batch_size or config["BATCH_SIZE"]
+    if workers == 1:
+        return accrue_loans(date, batch_size=batch_size)
+
+    ranges = customer_ranges(workers)
+    # The workers open their own connections, none is inherited
+    connections.close_all()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(len(ranges), initializer=django.setup) as pool:
+        results = pool.starmap(
+            accrue_partition,
+            [(date, customer_range, batch_size) for customer_range in ranges],
+        )
+    totals = {"loans": 0, "skipped": 0, "interest": 0, "late_fees": 0}
+    for result in results:
+        for name, value in result.items():
+            totals[name] += value
+    return totals
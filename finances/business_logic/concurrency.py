@@ -0,0 +1,43 @@
+# concurrency.py
+import functools
+import random
+import time
+from django.db import OperationalError, transaction
+
+# PostgreSQL errors that only mean the transaction lost a race and can be run again:
+# serialization_failure, deadlock_detected and lock_not_available (lock timeout)
+RETRYABLE_SQLSTATES = {"40001", "40P01", "55P03"}
+# SQLite reports lock contention only through the error message
+RETRYABLE_MESSAGES = ("database is locked", "database table is locked")
+
+
+def is_retryable(error):
+    cause = error.__cause__
+    sqlstate = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    return any(message in str(error) for message in RETRYABLE_MESSAGES)
+
+
+def retry_on_conflict(attempts=8, backoff=0.01):
+    # Run the decorated transaction again when it fails on a lock or serialization
+    # conflict, with jittered exponential backoff. A call nested in an outer atomic
+    # block is never retried, because the outer transaction is already broken.
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return function(*args, **kwargs)
+                except OperationalError as error:
+                    if (
+                        attempt == attempts - 1
+                        or not is_retryable(error)
+                        or transaction.get_connection().in_atomic_block
+                    ):
+                        raise
+                    time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+
+        return wrapper
+
+    return decorator
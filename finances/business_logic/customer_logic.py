@@ -1,14 +1,232 @@
+import threading
 from decimal import Decimal
-from django.db.models import Sum
-from ..models import Loan
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from ..cache import LRUCache
+from ..fields import MoneyField
+from ..instrumentation import timed
+from ..models import Customer, CustomerBalance, Loan
 
+# Defaults of the BALANCE_CACHE setting
+BALANCE_CACHE_DEFAULTS = {
+    # Seconds a balance payload is reused. Writes through the loan and payment logic
+    # invalidate it on commit, in their own process only unless CACHE_ALIAS is set:
+    # the other processes serve their copy until the TTL expires
+    "TTL": 60,
+    # Balance payloads kept in each process
+    "MAX_SIZE": 10000,
+    # Alias of a Django cache shared by every worker, replacing the in-process cache.
+    # Its generation keys are stored without timeout and must not be evicted
+    "CACHE_ALIAS": None,
+}
 
+# Generation keys of the in-process cache outlive the payloads they guard
+LOCAL_GENERATION_TTL = 24 * 60 * 60
+
+
+def balance_cache_settings():
+    return {**BALANCE_CACHE_DEFAULTS, **getattr(settings, "BALANCE_CACHE", {})}
+
+
+class BalanceCache:
+    """
+    Cache of the balance payload of each customer, keyed on its external id, with
+    hit and miss counters. Every entry carries the generation of its customer read
+    before the balance was, and invalidate bumps the generation, so a payload read
+    before a write committed is never served after it, even when it is stored late.
+    Without CACHE_ALIAS the entries and generations live in this process, and only
+    its own invalidations reach them.
+    """
+
+    def __init__(self):
+        self.local = LRUCache()
+        self.hits = 0
+        self.misses = 0
+        # Last generation handed out by the in-process cache, generations that were
+        # evicted restart from it so they never repeat a value seen before
+        self.counter = 0
+        self._lock = threading.Lock()
+
+    def get(self, external_id):
+        # Returns (payload, generation), payload is None on a miss and generation is
+        # the one to store the freshly read payload with
+        config = balance_cache_settings()
+        generation_key = f"balance_generation:{external_id}"
+        cache_key = f"balance:{external_id}"
+        if config["CACHE_ALIAS"]:
+            cache = caches[config["CACHE_ALIAS"]]
+            cached = cache.get_many([generation_key, cache_key])
+            generation = cached.get(generation_key, 0)
+            entry = cached.get(cache_key)
+        else:
+            with self._lock:
+                generation = self.local.get(generation_key)
+                if generation is None:
+                    generation = self.counter
+                    self.local.set(generation_key, generation, ttl=LOCAL_GENERATION_TTL)
+                entry = self.local.get(cache_key)
+
+        hit = entry is not None and entry[0] == generation
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return (entry[1] if hit else None), generation
+
+    def set(self, external_id, generation, payload):
+        config = balance_cache_settings()
+        cache_key = f"balance:{external_id}"
+        if config["CACHE_ALIAS"]:
+            caches[config["CACHE_ALIAS"]].set(
+                cache_key, (generation, payload), timeout=config["TTL"]
+            )
+        else:
+            self.local.max_size = config["MAX_SIZE"]
+            self.local.set(cache_key, (generation, payload), ttl=config["TTL"])
+
+    def invalidate(self, external_ids):
+        config = balance_cache_settings()
+        if config["CACHE_ALIAS"]:
+            cache = caches[config["CACHE_ALIAS"]]
+            for external_id in external_ids:
+                generation_key = f"balance_generation:{external_id}"
+                cache.add(generation_key, 0, timeout=None)
+                cache.incr(generation_key)
+            cache.delete_many(
+                [f"balance:{external_id}" for external_id in external_ids]
+            )
+            return
+        with self._lock:
+            for external_id in external_ids:
+                self.counter += 1
+                self.local.set(
+                    f"balance_generation:{external_id}",
+                    self.counter,
+                    ttl=LOCAL_GENERATION_TTL,
+                )
+                self.local.delete(f"balance:{external_id}")
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self.local.clear()
+            self.hits = self.misses = 0
+
+
+balance_cache = BalanceCache()
+
+
+def compute_balances(customer_ids):
+    # Aggregate the open loans (status 2) of the given customers straight from Loan
+    rows = (
+        Loan.objects.filter(customer_id__in=customer_ids, status=2)
+        .values("customer_id")
+        .annotate(total_debt=Sum("outstanding"), open_loans=Count("id"))
+    )
+    balances = {customer_id: (Decimal(0), 0) for customer_id in customer_ids}
+    for row in rows:
+        balances[row["customer_id"]] = (row["total_debt"], row["open_loans"])
+    return balances
+
+
+def rebuild_balance(customer_id):
+    # Recompute the ledger row of a customer from its loans
+    total_debt, open_loans = compute_balances([customer_id])[customer_id]
+    balance, _ = CustomerBalance.objects.update_or_create(
+        customer_id_id=customer_id,
+        defaults={"total_debt": total_debt, "open_loans": open_loans},
+    )
+    return balance
+
+
+def get_balance(customer_id):
+    # Single-row lookup of the ledger, built on first use for customers without one
+    try:
+        return CustomerBalance.objects.get(customer_id=customer_id)
+    except CustomerBalance.DoesNotExist:
+        return rebuild_balance(customer_id)
+
+
+def get_balances(customer_ids):
+    # Ledger rows of several customers in one query, building the missing ones in bulk
+    balances = CustomerBalance.objects.in_bulk(customer_ids)
+    missing = [
+        customer_id for customer_id in customer_ids if customer_id not in balances
+    ]
+    if missing:
+        CustomerBalance.objects.bulk_create(
+            CustomerBalance(
+                customer_id_id=customer_id, total_debt=total_debt, open_loans=open_loans
+            )
+            for customer_id, (total_debt, open_loans) in compute_balances(
+                missing
+            ).items()
+        )
+        balances.update(CustomerBalance.objects.in_bulk(missing))
+    return balances
+
+
+def apply_balance_change(customer_id, debt=0, open_loans=0):
+    # Increment the ledger in place, must run in the same transaction as the loan writes.
+    # The debt is stored in cents, the literal is converted by the column's field
+    total_debt_field = CustomerBalance._meta.get_field("total_debt")
+    CustomerBalance.objects.filter(customer_id=customer_id).update(
+        total_debt=F("total_debt") + Value(debt, output_field=total_debt_field),
+        open_loans=F("open_loans") + open_loans,
+    )
+
+
+def invalidate_balances(external_ids):
+    # Drop the cached balances of the customers once the current transaction commits,
+    # call it next to every write changing a ledger row or a score
+    external_ids = list(external_ids)
+    transaction.on_commit(lambda: balance_cache.invalidate(external_ids))
+
+
+@receiver(post_save, sender=Customer)
+def invalidate_saved_customer(sender, instance, created, **kwargs):
+    # The payload carries the score, which can be edited
+    if not created:
+        invalidate_balances([instance.external_id])
+
+
+def create_customers_bulk(rows):
+    # Create a batch of customers with one query for the taken external ids and one
+    # insert. rows is a list of (index, validated_data) pairs. Returns (index, customer)
+    # pairs and (index, validated_data, message) triples for the rejected rows
+    external_ids = [data["external_id"] for _, data in rows]
+    taken_ids = set(
+        Customer.objects.filter(external_id__in=external_ids).values_list(
+            "external_id", flat=True
+        )
+    )
+    accepted = []
+    rejected = []
+    for index, data in rows:
+        if data["external_id"] in taken_ids:
+            rejected.append(
+                (index, data, "customer with this external id already exists.")
+            )
+            continue
+        taken_ids.add(data["external_id"])
+        accepted.append((index, Customer(**data, status=1)))
+    Customer.objects.bulk_create([customer for _, customer in accepted])
+    return accepted, rejected
+
+
+@timed("get_total_debt")
 def get_total_debt(customer_id):
     # Calculate the total debt for the customer
-    total_debt = Loan.objects.filter(customer_id=customer_id, status=1).aggregate(
-        total_debt=Sum("outstanding")
-    )["total_debt"]
-    return total_debt if total_debt is not None else Decimal(0)
+    return get_balance(customer_id).total_debt
 
 
 def get_available_amount(customer):
@@ -16,3 +234,66 @@ def get_available_amount(customer):
     total_debt = get_total_debt(customer.id)
     available_amount = customer.score - total_debt
     return available_amount
+
+
+def get_balance_payload(external_id):
+    # Balance payload of a customer (external_id, score, total_debt, available_amount)
+    # served from balance_cache. Raises Customer.DoesNotExist for unknown customers
+    payload, generation = balance_cache.get(external_id)
+    if payload is None:
+        customer = Customer.objects.get(external_id=external_id)
+        total_debt = get_total_debt(customer.id)
+        payload = {
+            "external_id": customer.external_id,
+            "score": customer.score,
+            "total_debt": total_debt,
+            "available_amount": customer.score - total_debt,
+        }
+        balance_cache.set(external_id, generation, payload)
+    return payload
+
+
+async def aget_balance_payload(external_id):
+    # get_balance_payload for async views, with the async ORM. A customer without a
+    # ledger row gets its debt aggregated from the loans, the row is left to the
+    # next synchronous read or write
+    payload, generation = balance_cache.get(external_id)
+    if payload is None:
+        customer = await Customer.objects.select_related("customerbalance").aget(
+            external_id=external_id
+        )
+        try:
+            total_debt = customer.customerbalance.total_debt
+        except CustomerBalance.DoesNotExist:
+            total_debt = (
+                await Loan.objects.filter(customer_id=customer, status=2).aaggregate(
+                    total=Sum("outstanding")
+                )
+            )["total"] or Decimal(0)
+        payload = {
+            "external_id": customer.external_id,
+            "score": customer.score,
+            "total_debt": total_debt,
+            "available_amount": customer.score - total_debt,
+        }
+        balance_cache.set(external_id, generation, payload)
+    return payload
+
+
+def with_total_debt(queryset):
+    # Annotate each customer with its total debt in the same query as the customers,
+    # read from the ledger and aggregated from Loan for customers without a ledger row
+    total_debt = (
+        Loan.objects.filter(customer_id=OuterRef("pk"), status=2)
+        .values("customer_id")
+        .annotate(total=Sum("outstanding"))
+        .values("total")
+    )
+    return queryset.annotate(
+        total_debt=Coalesce(
+            F("customerbalance__total_debt"),
+            Subquery(total_debt),
+            Value(0),
+            output_field=MoneyField(max_digits=12, decimal_places=2),
+        )
+    )
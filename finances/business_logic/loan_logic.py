@@ -1,38 +1,139 @@
 # loan_logic.py
+from django.db import transaction
 from django.utils import timezone
-from django.db.models import Sum
 from rest_framework import serializers
-from ..models import Customer, Loan
+from ..amortization import amortization_settings, schedule_loans
+from ..instrumentation import timed
+from ..models import Customer, CustomerBalance, Loan, LoanSchedule
+from .concurrency import retry_on_conflict
+from .customer_logic import (
+    apply_balance_change,
+    get_balance,
+    get_balances,
+    invalidate_balances,
+)
 
 
+@timed("create_loan")
+@retry_on_conflict()
 def create_loan(validated_data):
+    validated_data = dict(validated_data)
     # Obtain Customer_external_id
     customer_external_id = validated_data.pop("customer_external_id")
-    # Get customer instance based on customer_external_id
-    try:
-        customer = Customer.objects.get(external_id=customer_external_id)
-    except Customer.DoesNotExist:
-        raise serializers.ValidationError("Customer not found")
-
-    outstanding_loans = Loan.objects.filter(
-        customer_id=customer.id, status=2
-    ).aggregate(Sum("outstanding"))
-
-    # Validate total outstanding loans against customer's credit score
-    if (outstanding_loans["outstanding__sum"] or 0) + validated_data[
-        "amount"
-    ] > customer.score:
-        raise serializers.ValidationError(
-            "Total outstanding loans exceed customer's credit score"
-        )
 
-    # Create loan instance
-    loan = Loan.objects.create(
-        customer_id=customer,
-        status=2,
-        taken_at=timezone.now(),
-        **validated_data,
-        outstanding=validated_data.get("amount")
-    )
+    with transaction.atomic():
+        # Get customer instance based on customer_external_id. The customer row stays
+        # locked until commit, so concurrent loans and payments of the same customer
+        # run their credit check and ledger update one after the other
+        try:
+            customer = Customer.objects.select_for_update().get(
+                external_id=customer_external_id
+            )
+        except Customer.DoesNotExist:
+            raise serializers.ValidationError("Customer not found")
+
+        # The credit check reads the customer's balance ledger instead of aggregating loans
+        balance = get_balance(customer.id)
+
+        # Validate total outstanding loans against customer's credit score
+        if balance.total_debt + validated_data["amount"] > customer.score:
+            raise serializers.ValidationError(
+                "Total outstanding loans exceed customer's credit score"
+            )
+
+        # Create loan instance, on the default contract terms
+        loan = Loan(
+            customer_id=customer,
+            status=2,
+            taken_at=timezone.now(),
+            contract_version=amortization_settings()["DEFAULT_CONTRACT"],
+            **validated_data,
+            outstanding=validated_data.get("amount")
+        )
+        # The schedule sets the loan's maximum_payment_date before the insert
+        schedules = schedule_loans([loan])
+        loan.save(force_insert=True)
+        LoanSchedule.objects.bulk_create(schedules)
+        apply_balance_change(customer.id, debt=loan.outstanding, open_loans=1)
+        invalidate_balances([customer.external_id])
 
     return loan
+
+
+@retry_on_conflict()
+def create_loans_bulk(rows):
+    # Originate a batch of loans with a fixed number of queries. rows is a list of
+    # (index, validated_data) pairs. Returns (index, loan) pairs for the created loans
+    # and (index, validated_data, message) triples for the rejected rows
+    customer_external_ids = {data["customer_external_id"] for _, data in rows}
+    external_ids = [data["external_id"] for _, data in rows]
+    accepted = []
+    rejected = []
+
+    with transaction.atomic():
+        # Resolve and lock every customer of the batch in one query, in id order so
+        # concurrent batches sharing customers cannot deadlock
+        customers = {
+            customer.external_id: customer
+            for customer in Customer.objects.select_for_update()
+            .filter(external_id__in=customer_external_ids)
+            .order_by("id")
+        }
+        taken_ids = set(
+            Loan.objects.filter(external_id__in=external_ids).values_list(
+                "external_id", flat=True
+            )
+        )
+        balances = get_balances([customer.id for customer in customers.values()])
+        now = timezone.now()
+        contract_version = amortization_settings()["DEFAULT_CONTRACT"]
+
+        for index, data in rows:
+            customer = customers.get(data["customer_external_id"])
+            if customer is None:
+                rejected.append((index, data, "Customer not found"))
+                continue
+            if data["external_id"] in taken_ids:
+                rejected.append(
+                    (index, data, "loan with this external id already exists.")
+                )
+                continue
+
+            # Running total, so several loans of one customer share the credit check
+            balance = balances[customer.id]
+            if balance.total_debt + data["amount"] > customer.score:
+                rejected.append(
+                    (
+                        index,
+                        data,
+                        "Total outstanding loans exceed customer's credit score",
+                    )
+                )
+                continue
+            balance.total_debt += data["amount"]
+            balance.open_loans += 1
+            balance.updated_at = now
+            taken_ids.add(data["external_id"])
+
+            loan = Loan(
+                customer_id=customer,
+                status=2,
+                taken_at=now,
+                contract_version=contract_version,
+                external_id=data["external_id"],
+                amount=data["amount"],
+                outstanding=data["amount"],
+            )
+            accepted.append((index, loan))
+
+        loans = [loan for _, loan in accepted]
+        schedules = schedule_loans(loans, now)
+        Loan.objects.bulk_create(loans)
+        LoanSchedule.objects.bulk_create(schedules)
+        # The customers are locked, so the new totals can be written as plain values
+        CustomerBalance.objects.bulk_update(
+            balances.values(), ["total_debt", "open_loans", "updated_at"]
+        )
+        invalidate_balances(customers)
+
+    return accepted, rejected
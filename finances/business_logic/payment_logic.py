@@ -1,55 +1,269 @@
 # payment_logic.py
 from django.db import transaction
-from django.db.models import Sum
-from ..models import Customer, Loan, Payment, PaymentDetail
+from ..amortization import amounts_due, loan_schedules, record_payments
+from ..fields import round_money
+from ..models import (
+    Customer,
+    CustomerBalance,
+    Loan,
+    LoanSchedule,
+    Payment,
+    PaymentDetail,
+)
 from django.utils import timezone
 from rest_framework import serializers
+from ..instrumentation import timed
+from .concurrency import retry_on_conflict
+from .customer_logic import (
+    apply_balance_change,
+    get_balance,
+    get_balances,
+    invalidate_balances,
+)
 
-def create_payment(validated_data):
-    customer_external_id = validated_data.pop("customer_external_id", None)
-    customer = Customer.objects.get(external_id=customer_external_id)
 
-    validated_data["customer_id"] = customer
-    validated_data["status"] = 1
+def allocate_payment(loans, total_amount, now, due=None):
+    # Apply the payment to the loans in the given order (oldest first), in memory.
+    # due optionally maps loan ids to the money of their installments already due,
+    # which is paid first, see amortization.amounts_due. Returns the (loan, amount)
+    # allocations plus the debt paid and the loans closed among the customer's open
+    # loans (status 2), for the balance ledger
+    amounts = {}
+    for targets in (due, None) if due else (None,):
+        for loan in loans:
+            if total_amount <= 0:
+                break
+            left = loan.outstanding - amounts.get(loan.id, 0)
+            if targets is not None:
+                left = min(left, targets.get(loan.id, 0))
+            if left <= 0:
+                continue
+            payment_amount = min(total_amount, left)
+            amounts[loan.id] = amounts.get(loan.id, 0) + payment_amount
+            total_amount -= payment_amount
+
+    allocations = []
+    debt_paid = 0
+    loans_closed = 0
+    for loan in loans:
+        payment_amount = amounts.get(loan.id)
+        if not payment_amount:
+            continue
+        # Payments can have more decimals than the loan column keeps. The new
+        # outstanding is rounded like the column saves it, and the ledger moves by
+        # the same rounded difference, so the two stay equal
+        outstanding = round_money(loan.outstanding - payment_amount)
+        if loan.status == 2:
+            debt_paid += loan.outstanding - outstanding
+        loan.outstanding = outstanding
 
-    total_amount = validated_data["total_amount"]
-    # Obtain Loans
-    loans = Loan.objects.filter(
-        customer_id=customer.id, outstanding__gt=0
-    ).order_by("created_at")
+        # check if the outstanding its 0, in case change the status of the loan to paid
+        if loan.outstanding <= 0:
+            if loan.status == 2:
+                loans_closed += 1
+            loan.status = 4
+        # bulk_update does not apply auto_now, so updated_at is set here
+        loan.updated_at = now
+        allocations.append((loan, payment_amount))
 
-    # Total pending of outstanding
-    total_outstanding = loans.aggregate(total=Sum("outstanding"))["total"]
-    if total_outstanding is None:
-        total_outstanding = 0
+    return allocations, debt_paid, loans_closed
 
-    # Check if the amount in the request exceeds the total of the loans
-    if total_amount > total_outstanding:
-        raise serializers.ValidationError(
-            "Total payment amount exceeds outstanding loan values"
-        )
+
+@timed("create_payment")
+@retry_on_conflict()
+def create_payment(validated_data):
+    validated_data = dict(validated_data)
+    customer_external_id = validated_data.pop("customer_external_id", None)
 
     # Ensures that all database operations within the block are atomic, meaning they either all succeed or all fail.
     with transaction.atomic():
+        # Lock the customer row first, so the loans read below cannot be allocated
+        # by a concurrent payment or grown by a concurrent loan before commit
+        customer = Customer.objects.select_for_update().get(
+            external_id=customer_external_id
+        )
+
+        validated_data["customer_id"] = customer
+        validated_data["status"] = 1
+
+        total_amount = validated_data["total_amount"]
+        # Obtain Loans, with their schedules
+        loans = list(
+            Loan.objects.filter(customer_id=customer.id, outstanding__gt=0)
+            .select_related("loanschedule")
+            .order_by("created_at")
+        )
+
+        # Total pending of outstanding
+        total_outstanding = sum(loan.outstanding for loan in loans)
+
+        # Check if the amount in the request exceeds the total of the loans
+        if total_amount > total_outstanding:
+            raise serializers.ValidationError(
+                "Total payment amount exceeds outstanding loan values"
+            )
+
         payment = Payment.objects.create(**validated_data)
 
-        payment_details = []
+        # Make sure the balance ledger row exists before the loans change
+        get_balance(customer.id)
 
-        for loan in loans:
-            payment_amount = min(total_amount, loan.outstanding)
-            loan.outstanding -= payment_amount
+        # Installments already due are paid before the rest of the debt
+        schedules = loan_schedules(loans)
+        allocations, debt_paid, loans_closed = allocate_payment(
+            loans,
+            total_amount,
+            timezone.now(),
+            due=amounts_due(schedules, timezone.localdate()),
+        )
+
+        # One UPDATE for all the loans settled by the payment, instead of a save() per loan
+        Loan.objects.bulk_update(
+            [loan for loan, _ in allocations], ["outstanding", "status", "updated_at"]
+        )
+        PaymentDetail.objects.bulk_create(
+            [
+                PaymentDetail(amount=amount, loand_id=loan, payment_id=payment)
+                for loan, amount in allocations
+            ]
+        )
+        LoanSchedule.objects.bulk_update(
+            record_payments(schedules, allocations), ["paid"]
+        )
+        apply_balance_change(customer.id, debt=-debt_paid, open_loans=-loans_closed)
+        invalidate_balances([customer.external_id])
+
+    return payment
 
-            # check if the outstanding its 0, in case change the status of the loan to paid
-            if loan.outstanding <= 0:
-                loan.status = 4
-            loan.save()
 
-            payment_detail = PaymentDetail(
-                amount=payment_amount, loand_id=loan, payment_id=payment
+def create_payments_bulk(rows, chunk_size=1000):
+    # Apply a batch of payments with the create_payment rules. rows is a list of
+    # (index, validated_data) pairs, processed in order in chunks of chunk_size rows,
+    # each chunk in its own transaction. Returns (index, payment) pairs for the
+    # applied payments and (index, validated_data, message) triples for the rejected
+    accepted = []
+    rejected = []
+    for start in range(0, len(rows), chunk_size):
+        chunk_accepted, chunk_rejected = _create_payments_chunk(
+            rows[start : start + chunk_size]
+        )
+        accepted += chunk_accepted
+        rejected += chunk_rejected
+    return accepted, rejected
+
+
+@retry_on_conflict()
+def _create_payments_chunk(rows):
+    customer_external_ids = {data["customer_external_id"] for _, data in rows}
+    external_ids = [data["external_id"] for _, data in rows]
+    accepted = []
+    rejected = []
+
+    with transaction.atomic():
+        # Lock every customer of the chunk in one query, in id order to avoid deadlocks
+        customers = {
+            customer.external_id: customer
+            for customer in Customer.objects.select_for_update()
+            .filter(external_id__in=customer_external_ids)
+            .order_by("id")
+        }
+        taken_ids = set(
+            Payment.objects.filter(external_id__in=external_ids).values_list(
+                "external_id", flat=True
             )
-            payment_details.append(payment_detail)
-            total_amount -= payment_amount
+        )
+        # Open loans of all the customers and their schedules in one query, oldest
+        # first per customer
+        loans_by_customer = {customer.id: [] for customer in customers.values()}
+        for loan in (
+            Loan.objects.filter(customer_id__in=loans_by_customer, outstanding__gt=0)
+            .select_related("loanschedule")
+            .order_by("customer_id", "created_at", "id")
+        ):
+            loans_by_customer[loan.customer_id_id].append(loan)
+        outstanding = {
+            customer_id: sum(loan.outstanding for loan in loans)
+            for customer_id, loans in loans_by_customer.items()
+        }
+        balances = get_balances(list(loans_by_customer))
+        schedules = loan_schedules(
+            loan for loans in loans_by_customer.values() for loan in loans
+        )
+        now = timezone.now()
+        today = timezone.localdate()
+
+        changed_loans = {}
+        changed_schedules = {}
+        payment_details = []
+        for index, data in rows:
+            customer = customers.get(data["customer_external_id"])
+            if customer is None:
+                rejected.append((index, data, "Customer not found"))
+                continue
+            if data["external_id"] in taken_ids:
+                rejected.append(
+                    (index, data, "payment with this external id already exists.")
+                )
+                continue
+            total_amount = data["total_amount"]
+            # Earlier payments of the same customer in the batch are already applied
+            if total_amount > outstanding[customer.id]:
+                rejected.append(
+                    (
+                        index,
+                        data,
+                        "Total payment amount exceeds outstanding loan values",
+                    )
+                )
+                continue
+
+            payment = Payment(
+                customer_id=customer,
+                status=1,
+                external_id=data["external_id"],
+                total_amount=total_amount,
+                paid_at=data.get("paid_at"),
+            )
+            # Due amounts are computed per payment, after the earlier ones recorded
+            # theirs in the schedules
+            loans = loans_by_customer[customer.id]
+            allocations, debt_paid, loans_closed = allocate_payment(
+                loans,
+                total_amount,
+                now,
+                due=amounts_due(
+                    {
+                        loan.id: schedules[loan.id]
+                        for loan in loans
+                        if loan.id in schedules
+                    },
+                    today,
+                ),
+            )
+            for schedule in record_payments(schedules, allocations):
+                changed_schedules[schedule.pk] = schedule
+            for loan, amount in allocations:
+                changed_loans[loan.id] = loan
+                payment_details.append(
+                    PaymentDetail(amount=amount, loand_id=loan, payment_id=payment)
+                )
+            outstanding[customer.id] -= total_amount
+            balance = balances[customer.id]
+            balance.total_debt -= debt_paid
+            balance.open_loans -= loans_closed
+            balance.updated_at = now
+            taken_ids.add(data["external_id"])
+            accepted.append((index, payment))
 
+        Payment.objects.bulk_create([payment for _, payment in accepted])
+        Loan.objects.bulk_update(
+            changed_loans.values(), ["outstanding", "status", "updated_at"]
+        )
+        LoanSchedule.objects.bulk_update(changed_schedules.values(), ["paid"])
         PaymentDetail.objects.bulk_create(payment_details)
+        CustomerBalance.objects.bulk_update(
+            balances.values(), ["total_debt", "open_loans", "updated_at"]
+        )
+        invalidate_balances(customers)
 
-    return payment
+    return accepted, rejected
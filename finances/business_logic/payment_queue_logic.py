@@ -0,0 +1,126 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from ..models import Customer, QueuedPayment
+from .concurrency import retry_on_conflict
+from .payment_logic import create_payments_bulk
+
+# Defaults of the PAYMENT_QUEUE setting
+PAYMENT_QUEUE_DEFAULTS = {
+    # Queue every payment of /make_payment/, not only the requests sending
+    # "Prefer: respond-async"
+    "ASYNC": False,
+    # Payments claimed by the worker in one transaction
+    "BATCH_SIZE": 1000,
+    # Seconds of processed payments the throughput is measured over
+    "THROUGHPUT_WINDOW": 60,
+}
+
+
+def payment_queue_settings():
+    return {**PAYMENT_QUEUE_DEFAULTS, **getattr(settings, "PAYMENT_QUEUE", {})}
+
+
+def enqueue_payment(validated_data):
+    # Store the payment for the worker, the only write of an async /make_payment/
+    try:
+        with transaction.atomic():
+            return QueuedPayment.objects.create(
+                external_id=validated_data["external_id"],
+                customer_external_id=validated_data["customer_external_id"],
+                total_amount=validated_data["total_amount"],
+                paid_at=validated_data.get("paid_at"),
+            )
+    except IntegrityError:
+        raise serializers.ValidationError(
+            {"external_id": ["payment with this external id already exists."]}
+        )
+
+
+@retry_on_conflict()
+def apply_queued_payments(batch_size=None):
+    # Apply a batch of pending payments with create_payments_bulk in one transaction.
+    # The worker claims whole customers: their rows are locked until commit and all
+    # their pending payments are taken in arrival order, so concurrent workers never
+    # apply the payments of one customer out of order. Returns (applied, rejected)
+    batch_size = batch_size or payment_queue_settings()["BATCH_SIZE"]
+    with transaction.atomic():
+        candidates = list(
+            dict.fromkeys(
+                QueuedPayment.objects.filter(status=1)
+                .order_by("id")
+                .values_list("customer_external_id", flat=True)[:batch_size]
+            )
+        )
+        if not candidates:
+            return 0, 0
+        known = set(
+            Customer.objects.filter(external_id__in=candidates).values_list(
+                "external_id", flat=True
+            )
+        )
+        # Customers claimed by another worker are skipped, unknown customers are
+        # taken to reject their payments
+        claimed = set(
+            Customer.objects.select_for_update(skip_locked=True)
+            .filter(external_id__in=known)
+            .values_list("external_id", flat=True)
+        ) | (set(candidates) - known)
+        queued = list(
+            QueuedPayment.objects.filter(
+                status=1, customer_external_id__in=claimed
+            ).order_by("id")[:batch_size]
+        )
+        if not queued:
+            return 0, 0
+
+        accepted, rejected = create_payments_bulk(
+            [
+                (
+                    item.id,
+                    {
+                        "external_id": item.external_id,
+                        "customer_external_id": item.customer_external_id,
+                        "total_amount": item.total_amount,
+                        "paid_at": item.paid_at,
+                    },
+                )
+                for item in queued
+            ]
+        )
+
+        now = timezone.now()
+        items = {item.id: item for item in queued}
+        for item_id, payment in accepted:
+            items[item_id].status = 2
+            items[item_id].payment = payment
+        for item_id, _, message in rejected:
+            items[item_id].status = 3
+            items[item_id].error = message[:255]
+        for item in queued:
+            item.processed_at = now
+            item.updated_at = now
+        QueuedPayment.objects.bulk_update(
+            queued, ["status", "payment", "error", "processed_at", "updated_at"]
+        )
+    return len(accepted), len(rejected)
+
+
+def queue_metrics():
+    # depth: pending payments. lag_seconds: age of the oldest pending payment.
+    # throughput: payments processed per second over the last THROUGHPUT_WINDOW
+    window = payment_queue_settings()["THROUGHPUT_WINDOW"]
+    now = timezone.now()
+    pending = QueuedPayment.objects.filter(status=1)
+    # The oldest pending payment is the first one by id, read through the index
+    oldest = pending.order_by("id").values_list("created_at", flat=True).first()
+    processed = QueuedPayment.objects.filter(
+        processed_at__gte=now - timedelta(seconds=window)
+    ).count()
+    return {
+        "depth": pending.count(),
+        "lag_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+        "throughput": processed / window,
+    }
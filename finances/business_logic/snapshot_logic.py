@@ -0,0 +1,202 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from ..models import (
+    DailyCustomerSnapshot,
+    DailyStatusSnapshot,
+    Loan,
+    Payment,
+    Watermark,
+)
+
+# Defaults of the SNAPSHOTS setting
+SNAPSHOTS_DEFAULTS = {
+    # Changed loans or payments handled per transaction
+    "BATCH_SIZE": 1000,
+    # Seconds a row has to be older than to be processed. updated_at is set before
+    # the writing transaction commits, rows of transactions still running when a
+    # build starts are left to the next build
+    "LAG": 60,
+}
+
+WATERMARK = "daily_snapshots"
+
+
+def snapshots_settings():
+    return {**SNAPSHOTS_DEFAULTS, **getattr(settings, "SNAPSHOTS", {})}
+
+
+def day_filter(field, days):
+    # Rows whose field falls on one of the days in the current time zone, as ranges
+    # of consecutive days so the filter can use an index on field
+    ranges = []
+    for day in sorted(days):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    condition = Q(pk__in=[])
+    for start, end in ranges:
+        condition |= Q(
+            **{
+                f"{field}__gte": timezone.make_aware(datetime.combine(start, time.min)),
+                f"{field}__lt": timezone.make_aware(datetime.combine(end, time.min)),
+            }
+        )
+    return condition
+
+
+def rebuild_customer_days(customer_ids, days):
+    # Recompute the customer snapshots of every (customer, day) pair of the given
+    # customers and days from Loan and Payment
+    period = day_filter("created_at", days)
+    rows = {}
+    for row in (
+        Loan.objects.filter(period, customer_id__in=customer_ids)
+        .annotate(date=TruncDate("created_at"))
+        .values("customer_id", "date")
+        .annotate(
+            loans=Count("id"),
+            originated_amount=Sum("amount"),
+            outstanding=Sum("outstanding"),
+        )
+    ):
+        rows[(row.pop("customer_id"), row.pop("date"))] = row
+    for row in (
+        Payment.objects.filter(period, customer_id__in=customer_ids, status=1)
+        .annotate(date=TruncDate("created_at"))
+        .values("customer_id", "date")
+        .annotate(payments=Count("id"), paid_amount=Sum("total_amount"))
+    ):
+        rows.setdefault((row.pop("customer_id"), row.pop("date")), {}).update(row)
+
+    DailyCustomerSnapshot.objects.filter(
+        customer_id__in=customer_ids, date__in=days
+    ).delete()
+    DailyCustomerSnapshot.objects.bulk_create(
+        DailyCustomerSnapshot(customer_id_id=customer_id, date=date, **values)
+        for (customer_id, date), values in rows.items()
+    )
+
+
+def rebuild_status_days(days):
+    # Recompute the status snapshots of the given days, a loan changing status moves
+    # between two rows of the day it was created
+    rows = (
+        Loan.objects.filter(day_filter("created_at", days))
+        .annotate(date=TruncDate("created_at"))
+        .values("date", "status")
+        .annotate(
+            loans=Count("id"), amount=Sum("amount"), outstanding=Sum("outstanding")
+        )
+    )
+    DailyStatusSnapshot.objects.filter(date__in=days).delete()
+    DailyStatusSnapshot.objects.bulk_create(DailyStatusSnapshot(**row) for row in rows)
+
+
+def changed_rows(model, low, high, batch_size):
+    # (customer_id, created_at) of the rows updated in (low, high], batch_size at a
+    # time in (updated_at, id) order
+    queryset = model.objects.filter(updated_at__lte=high).order_by("updated_at", "id")
+    if low is not None:
+        queryset = queryset.filter(updated_at__gt=low)
+    chunk = queryset
+    while True:
+        rows = list(
+            chunk.values_list("updated_at", "id", "customer_id", "created_at")[
+                :batch_size
+            ]
+        )
+        if rows:
+            yield [(customer_id, created_at) for _, _, customer_id, created_at in rows]
+        if len(rows) < batch_size:
+            return
+        updated_at, last_id = rows[-1][0], rows[-1][1]
+        chunk = queryset.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=last_id)
+        )
+
+
+def build_snapshots(full=False, batch_size=None, lag=None, now=None):
+    # Bring the snapshot tables up to date with the loans and payments updated since
+    # the watermark, or rebuild them from scratch with full. Every batch recomputes
+    # whole snapshot rows from the source tables in its own transaction, so a build
+    # interrupted before moving the watermark is simply redone by the next one.
+    # Deleted loans and payments are only removed from the snapshots by a full build.
+    # Returns the number of loans and payments processed
+    config = snapshots_settings()
+    batch_size = batch_size or config["BATCH_SIZE"]
+    lag = config["LAG"] if lag is None else lag
+    high = (now or timezone.now()) - timedelta(seconds=lag)
+    watermark, _ = Watermark.objects.get_or_create(name=WATERMARK)
+    low = None if full else watermark.value
+    if low is not None and low >= high:
+        return 0, 0
+
+    if full:
+        DailyCustomerSnapshot.objects.all().delete()
+        DailyStatusSnapshot.objects.all().delete()
+
+    processed = {Loan: 0, Payment: 0}
+    for model in (Loan, Payment):
+        for rows in changed_rows(model, low, high, batch_size):
+            customer_ids = {customer_id for customer_id, _ in rows}
+            days = {timezone.localdate(created_at) for _, created_at in rows}
+            with transaction.atomic():
+                rebuild_customer_days(customer_ids, days)
+                if model is Loan:
+                    rebuild_status_days(days)
+            processed[model] += len(rows)
+
+    watermark.value = high
+    watermark.save(update_fields=["value"])
+    return processed[Loan], processed[Payment]
+
+
+def daily_report(start=None, end=None):
+    # Totals of every day in [start, end] with their loans by status, read from the
+    # snapshots only
+    customer_days = DailyCustomerSnapshot.objects.all()
+    status_days = DailyStatusSnapshot.objects.all()
+    if start:
+        customer_days = customer_days.filter(date__gte=start)
+        status_days = status_days.filter(date__gte=start)
+    if end:
+        customer_days = customer_days.filter(date__lte=end)
+        status_days = status_days.filter(date__lte=end)
+
+    days = {
+        row["date"]: {**row, "by_status": []}
+        for row in customer_days.values("date")
+        .annotate(
+            loans=Sum("loans"),
+            originated_amount=Sum("originated_amount"),
+            outstanding=Sum("outstanding"),
+            payments=Sum("payments"),
+            paid_amount=Sum("paid_amount"),
+        )
+        .order_by("date")
+    }
+    for row in status_days.order_by("date", "status").values(
+        "date", "status", "loans", "amount", "outstanding"
+    ):
+        # Deleting a customer deletes its customer days, the status days keep its
+        # loans until a full build. A day left with status rows only has zero totals
+        day = row.pop("date")
+        days.setdefault(
+            day,
+            {
+                "date": day,
+                "loans": 0,
+                "originated_amount": Decimal(0),
+                "outstanding": Decimal(0),
+                "payments": 0,
+                "paid_amount": Decimal(0),
+                "by_status": [],
+            },
+        )["by_status"].append(row)
+    return [days[day] for day in sorted(days)]
@@ -0,0 +1,40 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+from django.db import models
+
+
+def round_money(value, decimal_places=2):
+    # value rounded the way a MoneyField with decimal_places saves it
+    quantum = Decimal(1).scaleb(-decimal_places)
+    return value.quantize(quantum, rounding=ROUND_HALF_EVEN)
+
+
+class MoneyField(models.DecimalField):
+    """
+    Decimal amount stored in a BIGINT column as a whole number of its smallest unit,
+    cents with decimal_places=2. Models, serializers and the API see Decimal values
+    validated like a DecimalField; the database compares and sums plain integers.
+
+    Values are rounded half to even to decimal_places when saved, as DecimalField
+    does. Expressions mixing the column with a literal amount must give the literal
+    this field as output_field, Value(amount, output_field=MoneyField(...)), so it
+    is converted to the same unit.
+    """
+
+    def get_internal_type(self):
+        return "BigIntegerField"
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        return int(round_money(value, self.decimal_places).scaleb(self.decimal_places))
+
+    def get_db_prep_save(self, value, connection):
+        if hasattr(value, "as_sql"):
+            return value
+        return self.get_db_prep_value(value, connection)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return Decimal(int(value)).scaleb(-self.decimal_places)
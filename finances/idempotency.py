@@ -0,0 +1,144 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+from .models import IdempotencyKey
+from .permissions import CachedHasAPIKey
+
+# Defaults of the IDEMPOTENCY setting
+IDEMPOTENCY_DEFAULTS = {
+    # Seconds the response of a completed request is replayed to its retries
+    "TTL": 24 * 60 * 60,
+    # Seconds a request in flight holds its key. A key left by a crashed worker is
+    # released after this long
+    "LOCK_TIMEOUT": 60,
+}
+
+
+def idempotency_settings():
+    return {**IDEMPOTENCY_DEFAULTS, **getattr(settings, "IDEMPOTENCY", {})}
+
+
+def request_fingerprint(request):
+    # Digest of what the request asks for, a key reused for another body is refused
+    body = json.dumps(
+        request.data, sort_keys=True, separators=(",", ":"), cls=DjangoJSONEncoder
+    )
+    return hashlib.sha256(
+        f"{request.method}\n{request.path}\n{body}".encode()
+    ).hexdigest()
+
+
+def claim_key(owner, scope, key, fingerprint):
+    # Returns (record, claimed). claimed is True when this request holds the key and
+    # must run, otherwise record is the entry of the earlier request with that key,
+    # or None when that entry kept disappearing under the claim
+    for _ in range(2):
+        now = timezone.now()
+        record = IdempotencyKey.objects.filter(
+            owner=owner, scope=scope, key=key
+        ).first()
+        if record is not None and record.expires_at > now:
+            return record, False
+        if record is not None:
+            IdempotencyKey.objects.filter(id=record.id, expires_at__lte=now).delete()
+        expires_at = now + timedelta(seconds=idempotency_settings()["LOCK_TIMEOUT"])
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    owner=owner,
+                    scope=scope,
+                    key=key,
+                    fingerprint=fingerprint,
+                    expires_at=expires_at,
+                )
+        except IntegrityError:
+            # A concurrent request with the same key claimed it first. If it has
+            # released the key since, the claim is tried again
+            record = IdempotencyKey.objects.filter(
+                owner=owner, scope=scope, key=key
+            ).first()
+            if record is not None:
+                return record, False
+            continue
+        return record, True
+    return None, False
+
+
+class IdempotentCreateMixin:
+    """
+    Makes the create of a view idempotent on the Idempotency-Key header. The first
+    request with a key runs and its successful response is stored, retries with the
+    same key and body get that response back without running the business logic.
+    A retry arriving while the first request is still running is answered with 409,
+    a key reused with a different body with 422. Failed requests release their key,
+    nothing was created so they can be retried as new. A request still running after
+    LOCK_TIMEOUT loses its key, a retry sent after that runs a second time.
+    """
+
+    idempotency_header = "Idempotency-Key"
+    idempotency_scope = None
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > 255:
+            return Response(
+                {"detail": f"{self.idempotency_header} is longer than 255 characters."},
+                status=400,
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, claimed = claim_key(
+            self.idempotency_owner(request), self.idempotency_scope, key, fingerprint
+        )
+        if not claimed:
+            return self.replay(record, fingerprint)
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if not 200 <= response.status_code < 300:
+            record.delete()
+            return response
+
+        IdempotencyKey.objects.filter(id=record.id).update(
+            status_code=response.status_code,
+            response_body=response.data,
+            expires_at=timezone.now()
+            + timedelta(seconds=idempotency_settings()["TTL"]),
+        )
+        return response
+
+    def idempotency_owner(self, request):
+        # The prefix of the API key, keys are scoped to the client sending them
+        key = CachedHasAPIKey().get_key(request) or ""
+        return key.partition(".")[0]
+
+    def replay(self, record, fingerprint):
+        if record is not None and record.fingerprint != fingerprint:
+            return Response(
+                {
+                    "detail": f"{self.idempotency_header} was already used "
+                    "with a different request."
+                },
+                status=422,
+            )
+        if record is None or record.status_code is None:
+            return Response(
+                {"detail": "A request with this idempotency key is in progress."},
+                status=409,
+                headers={"Retry-After": "1"},
+            )
+        return Response(
+            record.response_body,
+            status=record.status_code,
+            headers={"Idempotent-Replayed": "true"},
+        )
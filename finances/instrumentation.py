@@ -0,0 +1,314 @@
+# Request instrumentation: InstrumentationMiddleware times every request and, for a
+# sampled share of them, the database queries, the serializers and the business
+# logic functions decorated with timed. The totals are kept per endpoint in this
+# process and rendered as Prometheus text by /metrics, the sampled requests also
+# get a Server-Timing header.
+import functools
+import random
+import threading
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+# Defaults of the INSTRUMENTATION setting
+INSTRUMENTATION_DEFAULTS = {
+    "ENABLED": True,
+    # Share of the requests timed in detail (queries, serializers, business logic).
+    # Every request is counted and its wall time recorded
+    "SAMPLE_RATE": 0.1,
+    # Add a Server-Timing header to the sampled responses
+    "SERVER_TIMING": True,
+}
+
+# Upper bounds in seconds of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Timings of the sampled request being handled, None outside of one
+current_timings = ContextVar("current_timings", default=None)
+
+
+def instrumentation_settings():
+    return {**INSTRUMENTATION_DEFAULTS, **getattr(settings, "INSTRUMENTATION", {})}
+
+
+class RequestTimings:
+    """
+    Time spent by one request in its database queries and in each timed section.
+    A section entered again while it is running (a serializer nested in another one)
+    is only counted once.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.sections = {}
+        self.running = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Runs around every query of the request, called by time_query
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.queries += 1
+
+    def add(self, name, seconds):
+        self.sections[name] = self.sections.get(name, 0.0) + seconds
+
+    def server_timing(self, total_seconds):
+        entries = [
+            f"total;dur={total_seconds * 1000:.2f}",
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries"',
+        ]
+        entries += [
+            f"{name};dur={seconds * 1000:.2f}"
+            for name, seconds in self.sections.items()
+        ]
+        return ", ".join(entries)
+
+
+def timed(name):
+    # Decorator adding the time spent in the function to the timings of the sampled
+    # request running it. Outside of a sampled request it only costs a lookup
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            timings = current_timings.get()
+            if timings is None or name in timings.running:
+                return function(*args, **kwargs)
+            timings.running.add(name)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.running.discard(name)
+                timings.add(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class TimedSerializerMixin:
+    """
+    Counts the validation and representation of a serializer, and of its subclasses,
+    as serializer time. Overrides of to_representation and run_validation in the
+    subclasses are timed too. With many=True the items are timed one by one.
+    """
+
+    timed_methods = ("to_representation", "run_validation")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls.timed_methods:
+            if name in cls.__dict__:
+                setattr(cls, name, timed("serializer")(cls.__dict__[name]))
+
+    @timed("serializer")
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+    @timed("serializer")
+    def run_validation(self, *args, **kwargs):
+        return super().run_validation(*args, **kwargs)
+
+
+class MetricsRegistry:
+    """
+    Totals of the requests handled by this process, per endpoint (URL name), method
+    and status code, plus the detailed timings of the sampled requests per endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # (endpoint, method, status) -> count
+            self.requests = {}
+            # endpoint -> [bucket counts..., +Inf count, sum of seconds]
+            self.durations = {}
+            # endpoint -> [sampled requests, queries, db seconds]
+            self.sampled = {}
+            # (endpoint, section) -> seconds
+            self.sections = {}
+
+    def record(self, endpoint, method, status, seconds, timings=None):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(
+                endpoint, [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            )
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[len(DURATION_BUCKETS)] += 1
+            histogram[-1] += seconds
+            if timings is None:
+                return
+            sampled = self.sampled.setdefault(endpoint, [0, 0, 0.0])
+            sampled[0] += 1
+            sampled[1] += timings.queries
+            sampled[2] += timings.db_seconds
+            for name, section_seconds in timings.sections.items():
+                key = (endpoint, name)
+                self.sections[key] = self.sections.get(key, 0.0) + section_seconds
+
+    def prometheus(self, gauges=None):
+        # Metrics in the Prometheus text exposition format. gauges maps metric names
+        # to (help, value) pairs added as they are
+        with self._lock:
+            lines = [
+                "# HELP finances_http_requests_total Requests handled.",
+                "# TYPE finances_http_requests_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'finances_http_requests_total{{endpoint="{endpoint}",'
+                    f'method="{method}",status="{status}"}} {count}'
+                )
+            lines += [
+                "# HELP finances_http_request_duration_seconds Wall time of the "
+                "requests.",
+                "# TYPE finances_http_request_duration_seconds histogram",
+            ]
+            for endpoint, histogram in sorted(self.durations.items()):
+                name = "finances_http_request_duration_seconds"
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(
+                        f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}'
+                    )
+                count = histogram[len(DURATION_BUCKETS)]
+                lines.append(
+                    f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {count}'
+                )
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram[-1]}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {count}')
+
+            sampled_metrics = (
+                ("sampled_requests_total", "Requests timed in detail.", 0),
+                ("db_queries_total", "Queries of the sampled requests.", 1),
+                (
+                    "db_duration_seconds_total",
+                    "Query time of the sampled requests.",
+                    2,
+                ),
+            )
+            for name, help_text, index in sampled_metrics:
+                lines += [
+                    f"# HELP finances_{name} {help_text}",
+                    f"# TYPE finances_{name} counter",
+                ]
+                lines += [
+                    f'finances_{name}{{endpoint="{endpoint}"}} {values[index]}'
+                    for endpoint, values in sorted(self.sampled.items())
+                ]
+            lines += [
+                "# HELP finances_section_duration_seconds_total Time of the sampled "
+                "requests in the serializers and business logic functions.",
+                "# TYPE finances_section_duration_seconds_total counter",
+            ]
+            lines += [
+                f'finances_section_duration_seconds_total{{endpoint="{endpoint}",'
+                f'section="{section}"}} {seconds}'
+                for (endpoint, section), seconds in sorted(self.sections.items())
+            ]
+
+        for name, (help_text, value) in (gauges or {}).items():
+            lines += [
+                f"# HELP {name} {help_text}",
+                f"# TYPE {name} gauge",
+                f"{name} {value}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def time_query(execute, sql, params, many, context):
+    # connection.execute_wrapper hook of install_query_timer, times the query in the
+    # timings of the sampled request running it
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def install_query_timer():
+    # Adds time_query to the connection of this thread, once. It stays installed, so
+    # concurrent requests sharing a connection through sync_to_async are told apart
+    # by current_timings rather than by the wrappers of the connection
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = instrumentation_settings()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+
+        timings = None
+        start = time.perf_counter()
+        if random.random() < config["SAMPLE_RATE"]:
+            timings = RequestTimings()
+            install_query_timer()
+            token = current_timings.set(timings)
+            try:
+                response = self.get_response(request)
+            finally:
+                current_timings.reset(token)
+        else:
+            response = self.get_response(request)
+        return self.record(
+            request, response, time.perf_counter() - start, timings, config
+        )
+
+    async def __acall__(self, request):
+        config = instrumentation_settings()
+        if not config["ENABLED"]:
+            return await self.get_response(request)
+
+        timings = None
+        start = time.perf_counter()
+        if random.random() < config["SAMPLE_RATE"]:
+            timings = RequestTimings()
+            # The queries run in the thread of the request's sync_to_async calls,
+            # which is the one whose connection needs the hook
+            await sync_to_async(install_query_timer)()
+            token = current_timings.set(timings)
+            try:
+                response = await self.get_response(request)
+            finally:
+                current_timings.reset(token)
+        else:
+            response = await self.get_response(request)
+        return self.record(
+            request, response, time.perf_counter() - start, timings, config
+        )
+
+    def record(self, request, response, seconds, timings, config):
+        match = request.resolver_match
+        endpoint = (match.url_name or match.route) if match else "unmatched"
+        registry.record(
+            endpoint, request.method, response.status_code, seconds, timings
+        )
+        if timings is not None and config["SERVER_TIMING"]:
+            response["Server-Timing"] = timings.server_timing(seconds)
+        return response
@@ -0,0 +1,63 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from finances.analytics import money
+from finances.business_logic.accrual_logic import accrue, accrue_loans
+
+
+class Command(BaseCommand):
+    help = "Accrue one day of interest and late fees on the open loans"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            type=date.fromisoformat,
+            help="Accrual date (YYYY-MM-DD), today by default. A date already "
+            "accrued can be run again, its accrued loans are skipped",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Worker processes, each accruing a customer id range, "
+            "ACCRUAL['WORKERS'] by default",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Loans accrued per transaction, ACCRUAL['BATCH_SIZE'] by default",
+        )
+        parser.add_argument(
+            "--customer-range",
+            type=int,
+            nargs=2,
+            metavar=("LOW", "HIGH"),
+            help="Only the customers with LOW <= id < HIGH, to split a run "
+            "across machines",
+        )
+
+    def handle(self, *args, **options):
+        accrual_date = options["date"] or timezone.localdate()
+        start = time.perf_counter()
+        if options["customer_range"]:
+            if options["workers"] not in (None, 1):
+                raise CommandError("--customer-range runs in a single process")
+            totals = accrue_loans(
+                accrual_date, options["customer_range"], options["batch_size"]
+            )
+        else:
+            totals = accrue(accrual_date, options["workers"], options["batch_size"])
+        seconds = time.perf_counter() - start
+
+        if totals["skipped"]:
+            self.stderr.write(
+                f"{totals['skipped']} loans skipped, unknown contract version"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Accrued {totals['loans']} loans for {accrual_date} in "
+                f"{seconds:.1f}s: {money(totals['interest'])} interest, "
+                f"{money(totals['late_fees'])} late fees"
+            )
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from finances.business_logic.snapshot_logic import build_snapshots
+
+
+class Command(BaseCommand):
+    help = "Update the daily snapshot tables read by the reporting endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild the snapshots from every loan and payment, not only the "
+            "ones updated since the last build",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Changed rows handled per transaction, SNAPSHOTS['BATCH_SIZE'] "
+            "by default",
+        )
+        parser.add_argument(
+            "--lag",
+            type=float,
+            help="Seconds a row has to be older than to be processed, "
+            "SNAPSHOTS['LAG'] by default",
+        )
+
+    def handle(self, *args, **options):
+        loans, payments = build_snapshots(
+            full=options["full"],
+            batch_size=options["batch_size"],
+            lag=options["lag"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Snapshots updated from {loans} loans and {payments} payments"
+            )
+        )
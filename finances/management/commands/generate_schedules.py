@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from finances.amortization import generate_schedules
+from finances.models import Loan
+
+
+class Command(BaseCommand):
+    help = "Generate or regenerate the amortization schedules of the open loans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int)
+        parser.add_argument(
+            "--contract",
+            action="append",
+            help="Only the loans of this contract version, can be repeated",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Also the paid loans, not only the open ones",
+        )
+
+    def handle(self, *args, **options):
+        queryset = (
+            Loan.objects.all() if options["all"] else Loan.objects.filter(status=2)
+        )
+        if options["contract"]:
+            queryset = queryset.filter(contract_version__in=options["contract"])
+
+        start = time.perf_counter()
+        written, skipped = generate_schedules(queryset, options["batch_size"])
+        seconds = time.perf_counter() - start
+        if skipped:
+            self.stderr.write(f"{skipped} loans skipped, unknown contract version")
+        self.stdout.write(
+            self.style.SUCCESS(f"Generated {written} schedules in {seconds:.1f}s")
+        )
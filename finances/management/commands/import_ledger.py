@@ -0,0 +1,159 @@
+import csv
+import functools
+import json
+import os
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from finances.business_logic.customer_logic import create_customers_bulk
+from finances.business_logic.loan_logic import create_loans_bulk
+from finances.business_logic.payment_logic import create_payments_bulk
+from finances.serializers import (
+    CustomerSerializer,
+    LoanBulkItemSerializer,
+    PaymentBulkItemSerializer,
+    validate_rows,
+)
+
+# For each kind of record, the serializer validating a row and the bulk function
+# writing a batch of validated rows
+IMPORTERS = {
+    "customers": (CustomerSerializer, create_customers_bulk),
+    "loans": (LoanBulkItemSerializer, create_loans_bulk),
+    "payments": (PaymentBulkItemSerializer, create_payments_bulk),
+}
+
+
+def read_rows(path, file_format, position=0):
+    # Stream the rows of a CSV or JSONL file one at a time, starting at the byte
+    # position of a checkpoint. Yields (row, position) pairs, position being the
+    # byte offset just after the row, where a resumed import can seek to
+    with open(path, "rb") as source:
+        header = source.readline() if file_format == "csv" else b""
+        source.seek(max(position, len(header)))
+        consumed = source.tell()
+
+        def lines():
+            # csv.reader pulls the lines of a row, quoted newlines included, and
+            # no more, so consumed is the end of the row it last returned
+            nonlocal consumed
+            for line in iter(source.readline, b""):
+                consumed += len(line)
+                yield line.decode("utf-8")
+
+        if file_format == "csv":
+            fieldnames = next(csv.reader([header.decode("utf-8")]), [])
+            for values in csv.reader(lines()):
+                if values:
+                    # Empty CSV cells are missing values, like absent keys in JSONL
+                    row = dict(zip(fieldnames, values))
+                    row = {key: value for key, value in row.items() if value != ""}
+                    yield row, consumed
+        else:
+            for line in lines():
+                if line.strip():
+                    yield json.loads(line), consumed
+
+
+def batched(rows, batch_size):
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_checkpoint(path):
+    # The number of rows already imported and the byte position after the last one
+    try:
+        with open(path) as checkpoint:
+            saved = json.load(checkpoint)
+    except FileNotFoundError:
+        return 0, 0
+    return saved["offset"], saved["position"]
+
+
+def write_checkpoint(path, offset, position):
+    # Replace the checkpoint atomically, a crash never leaves it half written
+    with open(f"{path}.tmp", "w") as checkpoint:
+        json.dump({"offset": offset, "position": position}, checkpoint)
+    os.replace(f"{path}.tmp", path)
+
+
+class Command(BaseCommand):
+    help = "Import customers, loans or payments from a large CSV or JSONL file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--kind", choices=sorted(IMPORTERS), required=True)
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl"],
+            help="File format, taken from the file extension by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording the offset and byte position of the next row to "
+            "import, defaults to <path>.checkpoint",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue from the position stored in the checkpoint",
+        )
+        parser.add_argument(
+            "--rejects", help="Write the rejected rows and their errors to this file"
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or os.path.splitext(path)[1].lstrip(".")
+        if file_format not in ("csv", "jsonl"):
+            raise CommandError("Unknown file format, use --format csv or jsonl")
+        serializer_class, create_rows = IMPORTERS[options["kind"]]
+        batch_size = options["batch_size"]
+        if options["kind"] == "payments":
+            # One transaction per batch: a chunk committed before the checkpoint is
+            # written would be imported again by a resume
+            create_rows = functools.partial(create_payments_bulk, chunk_size=batch_size)
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        offset, position = read_checkpoint(checkpoint) if options["resume"] else (0, 0)
+
+        rows = read_rows(path, file_format, position)
+        rejects = open(options["rejects"], "a") if options["rejects"] else None
+        imported = rejected_count = 0
+        start = time.perf_counter()
+        try:
+            for batch in batched(rows, batch_size):
+                position = batch[-1][1]
+                batch = [row for row, _ in batch]
+                valid_rows, rejected = validate_rows(serializer_class, batch, offset)
+                created, refused = create_rows(valid_rows)
+                rejected += [
+                    {"index": index, "errors": {"non_field_errors": [message]}}
+                    for index, _, message in refused
+                ]
+                # The batch is committed, the next run can start after it
+                offset += len(batch)
+                write_checkpoint(checkpoint, offset, position)
+
+                imported += len(created)
+                rejected_count += len(rejected)
+                if rejects:
+                    for row in sorted(rejected, key=lambda row: row["index"]):
+                        rejects.write(json.dumps(row) + "\n")
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"offset {offset}: {imported} imported, {rejected_count} rejected,"
+                    f" {(imported + rejected_count) / elapsed:,.0f} rows/s"
+                )
+        finally:
+            if rejects:
+                rejects.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {imported} {options['kind']}, rejected {rejected_count}"
+            )
+        )
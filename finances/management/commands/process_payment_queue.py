@@ -0,0 +1,75 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from finances.business_logic.payment_queue_logic import (
+    apply_queued_payments,
+    payment_queue_settings,
+    queue_metrics,
+)
+
+
+class Command(BaseCommand):
+    help = "Apply the payments queued by /make_payment/ in async mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Payments applied per transaction, PAYMENT_QUEUE['BATCH_SIZE'] "
+            "by default",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for more payments",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or payment_queue_settings()["BATCH_SIZE"]
+        self.stopping = False
+        # Finish the current batch on SIGTERM or Ctrl-C, then exit
+        handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            applied_total, rejected_total = self.drain(batch_size, options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Applied {applied_total} payments, rejected {rejected_total}"
+            )
+        )
+
+    def drain(self, batch_size, options):
+        applied_total = rejected_total = 0
+        start = time.perf_counter()
+        while not self.stopping:
+            applied, rejected = apply_queued_payments(batch_size)
+            if not applied and not rejected:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+            applied_total += applied
+            rejected_total += rejected
+            metrics = queue_metrics()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{applied} applied, {rejected} rejected,"
+                f" {(applied_total + rejected_total) / elapsed:,.0f} payments/s,"
+                f" depth {metrics['depth']}, lag {metrics['lag_seconds']:.1f}s"
+            )
+        return applied_total, rejected_total
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,92 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from finances.business_logic.customer_logic import (
+    compute_balances,
+    invalidate_balances,
+)
+from finances.models import Customer, CustomerBalance
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the customer balance ledger from the loans, or verify it with --verify"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only compare the ledger with the loans and report the differences",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        verify = options["verify"]
+        batch_size = options["batch_size"]
+        checked = mismatched = 0
+        last_id = 0
+
+        while True:
+            # Walk the customers by primary key so each batch is a bounded range scan
+            external_ids = dict(
+                Customer.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "external_id")[:batch_size]
+            )
+            customer_ids = list(external_ids)
+            if not customer_ids:
+                break
+            last_id = customer_ids[-1]
+
+            with transaction.atomic():
+                expected = compute_balances(customer_ids)
+                ledger = CustomerBalance.objects.select_for_update().in_bulk(
+                    customer_ids
+                )
+                missing = []
+                stale = []
+                # (customer id, problem) of the customers whose ledger is wrong
+                differing = []
+                for customer_id, (total_debt, open_loans) in expected.items():
+                    balance = ledger.get(customer_id)
+                    if balance is None:
+                        missing.append(
+                            CustomerBalance(
+                                customer_id_id=customer_id,
+                                total_debt=total_debt,
+                                open_loans=open_loans,
+                            )
+                        )
+                        # Rows are built on first use, a customer without open
+                        # loans can do without one
+                        if (total_debt, open_loans) != (0, 0):
+                            differing.append((customer_id, "ledger row missing"))
+                    elif (balance.total_debt, balance.open_loans) != (
+                        total_debt,
+                        open_loans,
+                    ):
+                        balance.total_debt = total_debt
+                        balance.open_loans = open_loans
+                        stale.append(balance)
+                        differing.append((customer_id, "ledger differs from loans"))
+
+                checked += len(customer_ids)
+                mismatched += len(differing)
+                if verify:
+                    for customer_id, problem in differing:
+                        self.stdout.write(f"Customer {customer_id}: {problem}")
+                    continue
+                CustomerBalance.objects.bulk_create(missing)
+                CustomerBalance.objects.bulk_update(stale, ["total_debt", "open_loans"])
+                invalidate_balances(
+                    external_ids[balance.customer_id_id] for balance in stale
+                )
+
+        if verify and mismatched:
+            raise CommandError(f"{mismatched} of {checked} customer balances differ")
+        action = "Verified" if verify else "Rebuilt"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {checked} customer balances, {mismatched} were out of date"
+            )
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("finances", "0004_paymentdetail"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerBalance",
+            fields=[
+                (
+                    "customer_id",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="finances.customer",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "total_debt",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("open_loans", models.IntegerField(default=0)),
+            ],
+        ),
+    ]
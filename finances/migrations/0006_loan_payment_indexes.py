@@ -0,0 +1,38 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("finances", "0005_customerbalance"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                fields=["customer_id", "status"], name="loan_customer_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                fields=["customer_id", "created_at"], name="loan_customer_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("outstanding__gt", 0)),
+                fields=["customer_id", "created_at"],
+                name="loan_open_customer_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["customer_id", "paid_at"], name="payment_customer_paid_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finances", "0007_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueuedPayment",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("external_id", models.CharField(max_length=60, unique=True)),
+                ("customer_external_id", models.CharField(max_length=60)),
+                ("total_amount", models.DecimalField(decimal_places=10, max_digits=20)),
+                ("paid_at", models.DateTimeField(blank=True, null=True)),
+                ("status", models.SmallIntegerField(default=1)),
+                ("error", models.CharField(blank=True, max_length=255)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="finances.payment",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "id"], name="queued_payment_status_idx"
+                    ),
+                    models.Index(
+                        fields=["customer_external_id", "status"],
+                        name="queued_payment_customer_idx",
+                    ),
+                    models.Index(
+                        fields=["processed_at"], name="queued_payment_processed_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Store the cent amounts as integer cents (MoneyField). Each column is copied to a
+# new BIGINT column in exact Decimal arithmetic, then the new column replaces it
+
+from decimal import Decimal
+
+import finances.fields
+from django.db import migrations, models
+
+# (model, field, default) of the converted columns, all max_digits=12 decimal_places=2
+MONEY_COLUMNS = [
+    ("customer", "score", None),
+    ("loan", "amount", None),
+    ("loan", "outstanding", None),
+    ("customerbalance", "total_debt", 0),
+]
+
+BATCH_SIZE = 2000
+
+
+def copy_column(apps, source, target, convert):
+    for model_name, name, _ in MONEY_COLUMNS:
+        model = apps.get_model("finances", model_name)
+        source_name, target_name = source.format(name), target.format(name)
+        rows = []
+        for row in model.objects.only("pk", source_name).iterator(
+            chunk_size=BATCH_SIZE
+        ):
+            setattr(row, target_name, convert(getattr(row, source_name)))
+            rows.append(row)
+            if len(rows) == BATCH_SIZE:
+                model.objects.bulk_update(rows, [target_name])
+                rows = []
+        model.objects.bulk_update(rows, [target_name])
+
+
+def to_cents(apps, schema_editor):
+    copy_column(
+        apps,
+        "{}",
+        "{}_cents",
+        lambda value: int(value.quantize(Decimal("0.01")).scaleb(2)),
+    )
+
+
+def from_cents(apps, schema_editor):
+    copy_column(apps, "{}_cents", "{}", lambda value: Decimal(value).scaleb(-2))
+
+
+def field_options(default):
+    options = {"max_digits": 12, "decimal_places": 2}
+    if default is not None:
+        options["default"] = default
+    return options
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finances", "0008_queuedpayment"),
+    ]
+
+    operations = [
+        # The partial index filters on outstanding, recreated on the new column
+        migrations.RemoveIndex(
+            model_name="loan",
+            name="loan_open_customer_idx",
+        ),
+        # Nullable decimals, so that the reverse migration can add them back
+        *(
+            migrations.AlterField(
+                model_name=model_name,
+                name=name,
+                field=models.DecimalField(null=True, **field_options(default)),
+            )
+            for model_name, name, default in MONEY_COLUMNS
+        ),
+        *(
+            migrations.AddField(
+                model_name=model_name,
+                name=f"{name}_cents",
+                field=models.BigIntegerField(null=True),
+            )
+            for model_name, name, _ in MONEY_COLUMNS
+        ),
+        migrations.RunPython(to_cents, from_cents),
+        *(
+            operation
+            for model_name, name, default in MONEY_COLUMNS
+            for operation in (
+                migrations.RemoveField(model_name=model_name, name=name),
+                migrations.RenameField(
+                    model_name=model_name, old_name=f"{name}_cents", new_name=name
+                ),
+                migrations.AlterField(
+                    model_name=model_name,
+                    name=name,
+                    field=finances.fields.MoneyField(**field_options(default)),
+                ),
+            )
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("outstanding__gt", 0)),
+                fields=["customer_id", "created_at"],
+                name="loan_open_customer_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 5.0.6 on 2026-10-18 13:50
+
+import django.db.models.deletion
+import finances.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finances", "0009_money_fields_minor_units"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyCustomerSnapshot",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("date", models.DateField()),
+                ("loans", models.IntegerField(default=0)),
+                (
+                    "originated_amount",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=16
+                    ),
+                ),
+                (
+                    "outstanding",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=16
+                    ),
+                ),
+                ("payments", models.IntegerField(default=0)),
+                (
+                    "paid_amount",
+                    models.DecimalField(decimal_places=10, default=0, max_digits=24),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailyStatusSnapshot",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("date", models.DateField()),
+                ("status", models.SmallIntegerField()),
+                ("loans", models.IntegerField(default=0)),
+                (
+                    "amount",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=16
+                    ),
+                ),
+                (
+                    "outstanding",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=16
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Watermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=60, primary_key=True, serialize=False),
+                ),
+                ("value", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(fields=["updated_at", "id"], name="loan_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(fields=["created_at"], name="loan_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["updated_at", "id"], name="payment_updated_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(fields=["created_at"], name="payment_created_idx"),
+        ),
+        migrations.AddField(
+            model_name="dailycustomersnapshot",
+            name="customer_id",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="finances.customer"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailystatussnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("date", "status"), name="daily_status_snapshot_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dailycustomersnapshot",
+            index=models.Index(fields=["date"], name="daily_customer_date_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="dailycustomersnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("customer_id", "date"), name="daily_customer_snapshot_unique"
+            ),
+        ),
+    ]
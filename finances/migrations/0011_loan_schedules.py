@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:06
+
+import django.db.models.deletion
+import django.utils.timezone
+import finances.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finances", "0010_daily_snapshots"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoanSchedule",
+            fields=[
+                (
+                    "loan_id",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="finances.loan",
+                    ),
+                ),
+                ("contract_version", models.CharField(max_length=30)),
+                ("method", models.CharField(max_length=10)),
+                ("due_days", models.BinaryField()),
+                ("principal", models.BinaryField()),
+                ("interest", models.BinaryField()),
+                (
+                    "paid",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=12
+                    ),
+                ),
+                ("generated_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="loan",
+            name="maximum_payment_date",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name="loan",
+            name="taken_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 14:13
+
+import django.db.models.deletion
+import finances.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("finances", "0011_loan_schedules"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoanAccrual",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "outstanding",
+                    finances.fields.MoneyField(decimal_places=2, max_digits=12),
+                ),
+                (
+                    "interest",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=12
+                    ),
+                ),
+                (
+                    "late_fee",
+                    finances.fields.MoneyField(
+                        decimal_places=2, default=0, max_digits=12
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "loan_id",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="finances.loan"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="loanaccrual",
+            constraint=models.UniqueConstraint(
+                fields=("date", "loan_id"), name="loan_accrual_unique"
+            ),
+        ),
+    ]
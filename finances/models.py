@@ -1,4 +1,7 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
+from .fields import MoneyField
 
 
 # Model for customer
@@ -8,7 +11,7 @@ class Customer(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     external_id = models.CharField(max_length=60, unique=True)
     status = models.SmallIntegerField()
-    score = models.DecimalField(max_digits=12, decimal_places=2)
+    score = MoneyField(max_digits=12, decimal_places=2)
     preapproved_at = models.DateTimeField(null=True, blank=True)
 
 
@@ -23,6 +26,18 @@ class Payment(models.Model):
     paid_at = models.DateTimeField(null=True, blank=True)
     customer_id = models.ForeignKey(Customer, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Payments of a customer by payment date
+            models.Index(
+                fields=["customer_id", "paid_at"], name="payment_customer_paid_idx"
+            ),
+            # Payments updated since the snapshot watermark
+            models.Index(fields=["updated_at", "id"], name="payment_updated_idx"),
+            # Payments of a day (snapshot rebuilds)
+            models.Index(fields=["created_at"], name="payment_created_idx"),
+        ]
+
 
 # Model for loands
 class Loan(models.Model):
@@ -30,13 +45,37 @@ class Loan(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     external_id = models.CharField(max_length=60, unique=True)
-    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    amount = MoneyField(max_digits=12, decimal_places=2)
     status = models.SmallIntegerField()
     contract_version = models.CharField(max_length=30)
-    maximum_payment_date = models.DateTimeField(auto_now=True)
-    taken_at = models.DateTimeField(auto_now=True)
+    # Last due date of the loan's schedule (see finances/amortization.py)
+    maximum_payment_date = models.DateTimeField(default=timezone.now)
+    taken_at = models.DateTimeField(default=timezone.now)
     customer_id = models.ForeignKey(Customer, on_delete=models.CASCADE)
-    outstanding = models.DecimalField(max_digits=12, decimal_places=2)
+    outstanding = MoneyField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            # Loans of a customer by status (balance rebuilds, credit checks)
+            models.Index(
+                fields=["customer_id", "status"], name="loan_customer_status_idx"
+            ),
+            # Loans of a customer in creation order (loan listing pages)
+            models.Index(
+                fields=["customer_id", "created_at"], name="loan_customer_created_idx"
+            ),
+            # Open loans of a customer, oldest first (payment allocation). Partial
+            # index, skipped on backends without support for them
+            models.Index(
+                fields=["customer_id", "created_at"],
+                condition=models.Q(outstanding__gt=0),
+                name="loan_open_customer_idx",
+            ),
+            # Loans updated since the snapshot watermark
+            models.Index(fields=["updated_at", "id"], name="loan_updated_idx"),
+            # Loans of a day (snapshot rebuilds)
+            models.Index(fields=["created_at"], name="loan_created_idx"),
+        ]
 
 
 # Model for paymentDetail
@@ -48,3 +87,154 @@ class PaymentDetail(models.Model):
     loand_id = models.ForeignKey(Loan, on_delete=models.CASCADE)
     payment_id = models.ForeignKey(Payment, on_delete=models.CASCADE)
 
+
+# Model for the customer balance ledger, a denormalized copy of the customer's
+# open loans (status 2) kept up to date by create_loan and create_payment
+class CustomerBalance(models.Model):
+    customer_id = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    total_debt = MoneyField(max_digits=12, decimal_places=2, default=0)
+    open_loans = models.IntegerField(default=0)
+
+
+# Model for the amortization schedules, one row per loan. The installments are packed
+# as little-endian arrays: due dates in days since 1970-01-01 (int32), principal and
+# interest parts in cents (int64). See finances/amortization.py
+class LoanSchedule(models.Model):
+    loan_id = models.OneToOneField(Loan, on_delete=models.CASCADE, primary_key=True)
+    contract_version = models.CharField(max_length=30)
+    method = models.CharField(max_length=10)
+    due_days = models.BinaryField()
+    principal = models.BinaryField()
+    interest = models.BinaryField()
+    # Money allocated to the installments so far, they are paid in due order
+    paid = MoneyField(max_digits=12, decimal_places=2, default=0)
+    generated_at = models.DateTimeField()
+
+
+# Model for the accrual journal, the interest and late fee added to the outstanding
+# of an open loan on each accrual date. One row per loan and date, so running the
+# accrual of a date again skips the loans already accrued
+class LoanAccrual(models.Model):
+    loan_id = models.ForeignKey(Loan, on_delete=models.CASCADE)
+    date = models.DateField()
+    # Outstanding the accrual was computed on
+    outstanding = MoneyField(max_digits=12, decimal_places=2)
+    interest = MoneyField(max_digits=12, decimal_places=2, default=0)
+    late_fee = MoneyField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # date first: the accrual looks up the loans of a chunk within one date
+            models.UniqueConstraint(
+                fields=["date", "loan_id"], name="loan_accrual_unique"
+            ),
+        ]
+
+
+# Model for idempotency keys, the outcome of a create request replayed to the
+# retries sending the same Idempotency-Key header. status_code is null while the
+# first request is still running
+class IdempotencyKey(models.Model):
+    id = models.AutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # Prefix of the API key sending the request, keys of different clients never clash
+    owner = models.CharField(max_length=8)
+    scope = models.CharField(max_length=60)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.SmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "scope", "key"], name="idempotency_key_unique"
+            ),
+        ]
+
+
+# Model for the payment queue, payments accepted by /make_payment/ in async mode and
+# applied later by the process_payment_queue worker. status is 1 pending, 2 applied
+# or 3 rejected, error holds the reason of a rejection
+class QueuedPayment(models.Model):
+    id = models.AutoField(primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    external_id = models.CharField(max_length=60, unique=True)
+    customer_external_id = models.CharField(max_length=60)
+    total_amount = models.DecimalField(max_digits=20, decimal_places=10)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    status = models.SmallIntegerField(default=1)
+    error = models.CharField(max_length=255, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    payment = models.ForeignKey(
+        Payment, on_delete=models.SET_NULL, null=True, blank=True
+    )
+
+    class Meta:
+        indexes = [
+            # Pending payments in arrival order (draining, depth and lag)
+            models.Index(fields=["status", "id"], name="queued_payment_status_idx"),
+            # Pending payments of the customers claimed by a worker
+            models.Index(
+                fields=["customer_external_id", "status"],
+                name="queued_payment_customer_idx",
+            ),
+            # Payments processed recently (throughput)
+            models.Index(fields=["processed_at"], name="queued_payment_processed_idx"),
+        ]
+
+
+# Models for the daily snapshots read by the reporting endpoints, maintained by the
+# build_snapshots command from the loans and payments updated since its watermark.
+# Loans and payments count on the day they were created, outstanding is the current
+# outstanding of the loans created that day
+class DailyCustomerSnapshot(models.Model):
+    id = models.AutoField(primary_key=True)
+    date = models.DateField()
+    customer_id = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    loans = models.IntegerField(default=0)
+    originated_amount = MoneyField(max_digits=16, decimal_places=2, default=0)
+    outstanding = MoneyField(max_digits=16, decimal_places=2, default=0)
+    # Payments applied (status 1)
+    payments = models.IntegerField(default=0)
+    paid_amount = models.DecimalField(max_digits=24, decimal_places=10, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["customer_id", "date"], name="daily_customer_snapshot_unique"
+            ),
+        ]
+        indexes = [
+            # Whole days rebuilt by build_snapshots and read by the daily reports
+            models.Index(fields=["date"], name="daily_customer_date_idx"),
+        ]
+
+
+class DailyStatusSnapshot(models.Model):
+    id = models.AutoField(primary_key=True)
+    date = models.DateField()
+    status = models.SmallIntegerField()
+    loans = models.IntegerField(default=0)
+    amount = MoneyField(max_digits=16, decimal_places=2, default=0)
+    outstanding = MoneyField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "status"], name="daily_status_snapshot_unique"
+            ),
+        ]
+
+
+# Model for the watermarks of incremental jobs, value is the updated_at up to which
+# the source rows have been processed
+class Watermark(models.Model):
+    name = models.CharField(max_length=60, primary_key=True)
+    value = models.DateTimeField(null=True, blank=True)
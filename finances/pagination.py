@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+# Keyset pagination on (created_at, id), pages are fetched with an indexed range
+# scan instead of OFFSET, so the cost of a page does not grow with the table size
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ("created_at", "id")
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def _get_position_from_instance(self, instance, ordering):
+        # Rows of a ReadPlan are values_list tuples starting with created_at
+        if isinstance(instance, tuple):
+            return str(instance[0])
+        return super()._get_position_from_instance(instance, ordering)
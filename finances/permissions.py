@@ -0,0 +1,109 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework_api_key.models import APIKey
+from rest_framework_api_key.permissions import HasAPIKey
+from .cache import LRUCache
+
+# Defaults of the API_KEY_CACHE setting
+API_KEY_CACHE_DEFAULTS = {
+    # Seconds a verification result is reused, also the longest a revoked key stays
+    # usable on other processes when there is no shared cache
+    "TTL": 30,
+    # Verification results kept in each process
+    "MAX_SIZE": 10000,
+    # Alias of a Django cache shared by every worker. When set, it replaces the
+    # in-process cache and revocations apply to all workers at once
+    "CACHE_ALIAS": None,
+}
+
+
+def api_key_cache_settings():
+    return {**API_KEY_CACHE_DEFAULTS, **getattr(settings, "API_KEY_CACHE", {})}
+
+
+local_cache = LRUCache()
+
+
+class CachedHasAPIKey(HasAPIKey):
+    """
+    HasAPIKey that caches the result of verifying a presented key, keyed on a SHA-256
+    digest of the key, so the password hash check only runs once per TTL instead of
+    once per request. Saving or deleting an APIKey invalidates the cached results
+    of its prefix; revocations through QuerySet.update() do not send signals and
+    are only picked up when the entries expire.
+    """
+
+    def has_permission(self, request, view):
+        key = self.get_key(request)
+        if not key:
+            return False
+        return self.is_allowed(self.get_verification(key))
+
+    def is_allowed(self, verification):
+        valid, expiry_date = verification
+        return valid and (expiry_date is None or timezone.now() < expiry_date)
+
+    def get_local_verification(self, key):
+        # The result cached in this process, or None. Never does any I/O, so async
+        # views can call it from the event loop
+        if api_key_cache_settings()["CACHE_ALIAS"]:
+            return None
+        prefix = key.partition(".")[0]
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return local_cache.get(f"{prefix}:{digest}")
+
+    def get_verification(self, key):
+        config = api_key_cache_settings()
+        prefix = key.partition(".")[0]
+        digest = hashlib.sha256(key.encode()).hexdigest()
+
+        if not config["CACHE_ALIAS"]:
+            local_cache.max_size = config["MAX_SIZE"]
+            cache_key = f"{prefix}:{digest}"
+            result = local_cache.get(cache_key)
+            if result is None:
+                result = self.verify(key)
+                local_cache.set(cache_key, result, ttl=config["TTL"])
+            return result
+
+        # Shared entries carry the generation of their prefix, invalidate_api_key
+        # bumps it so every worker stops using them at once
+        cache = caches[config["CACHE_ALIAS"]]
+        generation_key = f"api_key_generation:{prefix}"
+        cache_key = f"api_key:{prefix}:{digest}"
+        cached = cache.get_many([generation_key, cache_key])
+        generation = cached.get(generation_key, 0)
+        entry = cached.get(cache_key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        result = self.verify(key)
+        cache.set(cache_key, (generation, result), timeout=config["TTL"])
+        return result
+
+    def verify(self, key):
+        # The expensive check, returns whether the key is valid and when it expires
+        try:
+            api_key = self.model.objects.get_from_key(key)
+        except self.model.DoesNotExist:
+            return False, None
+        return True, api_key.expiry_date
+
+
+def invalidate_api_key(prefix):
+    config = api_key_cache_settings()
+    local_cache.delete_prefix(f"{prefix}:")
+    if config["CACHE_ALIAS"]:
+        cache = caches[config["CACHE_ALIAS"]]
+        generation_key = f"api_key_generation:{prefix}"
+        cache.add(generation_key, 0, timeout=None)
+        cache.incr(generation_key)
+
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def invalidate_saved_api_key(sender, instance, **kwargs):
+    invalidate_api_key(instance.prefix)
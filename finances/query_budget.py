@@ -0,0 +1,75 @@
+import difflib
+import re
+
+# Statements counted as writes by QueryBudget.writes
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE")
+
+# Savepoints of nested atomic blocks are not counted: the tests run every request
+# inside a transaction, where each atomic block adds them
+SAVEPOINT_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class QueryBudget:
+    """
+    Most queries, and optionally writes, one request to a view may issue, whatever
+    the number of rows involved. Views declare one per HTTP method:
+
+        query_budget = {"GET": QueryBudget(1), "POST": QueryBudget(10, writes=4)}
+
+    The tests check every declared budget at growing data volumes, see
+    QueryBudgetTestMixin in tests.py.
+    """
+
+    def __init__(self, queries, writes=None):
+        self.queries = queries
+        self.writes = writes
+
+    def __repr__(self):
+        return f"QueryBudget({self.queries}, writes={self.writes})"
+
+    def check(self, statements):
+        # Messages for each bound the statements go over, empty when within budget
+        problems = []
+        if len(statements) > self.queries:
+            problems.append(f"{len(statements)} queries, budget {self.queries}")
+        writes = len([sql for sql in statements if is_write(sql)])
+        if self.writes is not None and writes > self.writes:
+            problems.append(f"{writes} writes, budget {self.writes}")
+        return problems
+
+
+def counted_statements(captured_queries):
+    # SQL of the queries captured by CaptureQueriesContext, without the savepoints
+    return [
+        query["sql"]
+        for query in captured_queries
+        if not query["sql"].lstrip().upper().startswith(SAVEPOINT_STATEMENTS)
+    ]
+
+
+def is_write(sql):
+    return sql.lstrip().upper().startswith(WRITE_STATEMENTS)
+
+
+def normalize_sql(sql):
+    # The statement without its literal values, so that the same query run with
+    # other ids, a longer IN list or more rows to insert compares equal
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\?(?:, \?)*\)", "(...)", sql)
+    # Multi-row VALUES of bulk inserts
+    return re.sub(r"\(\.\.\.\)(?:, \(\.\.\.\))+", "(...)", sql)
+
+
+def sql_diff(expected, actual, expected_label, actual_label):
+    # Unified diff of two lists of captured statements, or the numbered statements
+    # when they are the same
+    expected = [normalize_sql(sql) for sql in expected]
+    actual = [normalize_sql(sql) for sql in actual]
+    if expected == actual:
+        return "\n".join(f"{number:>3}. {sql}" for number, sql in enumerate(actual, 1))
+    return "\n".join(
+        difflib.unified_diff(
+            expected, actual, expected_label, actual_label, lineterm="", n=1
+        )
+    )
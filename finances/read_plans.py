@@ -0,0 +1,204 @@
+import decimal
+import json
+from json.encoder import encode_basestring
+from operator import itemgetter
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from .instrumentation import timed
+from .streaming import StreamingListMixin
+
+
+# Encoders turning one column value into its JSON text, each one matching what the
+# serializer and JSONRenderer of the endpoint produce for that field
+def encode_string(value):
+    return "null" if value is None else encode_basestring(value)
+
+
+def encode_integer(value):
+    return "null" if value is None else str(int(value))
+
+
+def encode_number(value):
+    # Decimals returned as-is by a serializer are rendered as floats by JSONRenderer
+    return "null" if value is None else float.__repr__(float(value))
+
+
+def encode_datetime(value):
+    # DateTimeField output: ISO 8601 in the current time zone, with Z for UTC
+    if not value:
+        return "null"
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return f'"{value}"'
+
+
+def decimal_string(max_digits, decimal_places):
+    # DecimalField output: the value quantized to decimal_places, as a string
+    exponent = decimal.Decimal(1).scaleb(-decimal_places)
+    context = decimal.Context(prec=max_digits, rounding=decimal.ROUND_HALF_EVEN)
+
+    def encode(value):
+        if value is None:
+            return '""'
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f'"{value.quantize(exponent, context=context):f}"'
+
+    return encode
+
+
+class ReadPlan:
+    """
+    Compiled read path of a list endpoint. It fetches the columns as values_list
+    tuples and renders them straight to JSON bytes with a precomputed template,
+    producing the same output as the endpoint's serializer and JSONRenderer.
+
+    columns are the values_list names and must start with created_at, the cursor
+    pagination position. fields are the (name, value, encoder) triples of the
+    output, where value is a column name or a function of the row.
+    """
+
+    def __init__(self, columns, fields):
+        self.columns = columns
+        positions = {column: position for position, column in enumerate(columns)}
+        self.getters = [
+            itemgetter(positions[value]) if isinstance(value, str) else value
+            for _, value, _ in fields
+        ]
+        self.encoders = [encoder for _, _, encoder in fields]
+        self.template = (
+            "{"
+            + ",".join(f"{encode_basestring(name)}:%s" for name, _, _ in fields)
+            + "}"
+        )
+
+    def queryset(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def render_row(self, row):
+        return self.template % tuple(
+            encode(get(row)) for get, encode in zip(self.getters, self.encoders)
+        )
+
+    def render(self, text):
+        # JSONRenderer escapes these two separators, valid in JSON but not in JavaScript
+        return text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
+
+    @timed("serializer")
+    def render_list(self, rows):
+        return self.render("[" + ",".join(map(self.render_row, rows)) + "]")
+
+    @timed("serializer")
+    def render_page(self, rows, next_link, previous_link):
+        # Same envelope as CursorPagination.get_paginated_response
+        return self.render(
+            '{"next":%s,"previous":%s,"results":[%s]}'
+            % (
+                json.dumps(next_link, ensure_ascii=False),
+                json.dumps(previous_link, ensure_ascii=False),
+                ",".join(map(self.render_row, rows)),
+            )
+        )
+
+    def render_stream(self, rows, chunk_size):
+        # Render the rows of an iterator as one JSON array, chunk_size rows at a time
+        separator = b"["
+        chunk = []
+        for row in rows:
+            chunk.append(self.render_row(row))
+            if len(chunk) == chunk_size:
+                yield separator + self.render(",".join(chunk))
+                separator = b","
+                chunk = []
+        if chunk:
+            yield separator + self.render(",".join(chunk))
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+
+    async def arender_stream(self, rows, chunk_size):
+        # render_stream over an async iterator of rows
+        separator = b"["
+        chunk = []
+        async for row in rows:
+            chunk.append(self.render_row(row))
+            if len(chunk) == chunk_size:
+                yield separator + self.render(",".join(chunk))
+                separator = b","
+                chunk = []
+        if chunk:
+            yield separator + self.render(",".join(chunk))
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+
+
+CUSTOMER_READ_PLAN = ReadPlan(
+    columns=("created_at", "id", "external_id", "score", "total_debt"),
+    fields=[
+        ("external_id", "external_id", encode_string),
+        ("score", "score", encode_number),
+        ("total_debt", "total_debt", encode_number),
+        # score - total_debt, by position in columns
+        ("available_amount", lambda row: row[3] - row[4], encode_number),
+    ],
+)
+
+LOAN_READ_PLAN = ReadPlan(
+    columns=(
+        "created_at",
+        "id",
+        "external_id",
+        "amount",
+        "outstanding",
+        "status",
+        "customer_external_id",
+    ),
+    fields=[
+        ("external_id", "external_id", encode_string),
+        ("amount", "amount", decimal_string(12, 2)),
+        ("outstanding", "outstanding", decimal_string(12, 2)),
+        ("status", "status", encode_integer),
+        ("customer_external_id", "customer_external_id", encode_string),
+    ],
+)
+
+PAYMENT_READ_PLAN = ReadPlan(
+    columns=("created_at", "id", "external_id", "total_amount", "paid_at"),
+    fields=[
+        ("external_id", "external_id", encode_string),
+        ("total_amount", "total_amount", decimal_string(20, 10)),
+        ("paid_at", "paid_at", encode_datetime),
+    ],
+)
+
+
+class ReadPlanListMixin(StreamingListMixin):
+    """
+    Serves JSON list responses of the view with its read_plan, paginated or streamed
+    like the serializer path. Other formats (the browsable API) use the serializer.
+    """
+
+    read_plan = None
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != "json":
+            return super().list(request, *args, **kwargs)
+        queryset = self.read_plan.queryset(self.filter_queryset(self.get_queryset()))
+
+        if self.is_streaming(request):
+            rows = queryset.order_by("created_at", "id").iterator(
+                chunk_size=self.stream_chunk_size
+            )
+            return StreamingHttpResponse(
+                self.read_plan.render_stream(rows, self.stream_chunk_size),
+                content_type="application/json",
+            )
+
+        rows = self.paginate_queryset(queryset)
+        if rows is None:
+            content = self.read_plan.render_list(queryset)
+        else:
+            content = self.read_plan.render_page(
+                rows, self.paginator.get_next_link(), self.paginator.get_previous_link()
+            )
+        return HttpResponse(content, content_type="application/json")
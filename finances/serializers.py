@@ -1,13 +1,22 @@
+from django.db.models import F
 from rest_framework import serializers
-from finances.business_logic.customer_logic import get_available_amount, get_total_debt
+from finances.business_logic.customer_logic import get_total_debt
 from finances.business_logic.loan_logic import create_loan
 from finances.business_logic.payment_logic import create_payment
-from .models import Customer, Loan, Payment, PaymentDetail
-
+from finances.business_logic.payment_queue_logic import enqueue_payment
+from finances.instrumentation import TimedSerializerMixin
+from .models import (
+    Customer,
+    DailyCustomerSnapshot,
+    Loan,
+    Payment,
+    PaymentDetail,
+    QueuedPayment,
+)
 
 
 # serializer for Customer model
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     external_id = serializers.CharField(write_only=True)
     total_debt = serializers.SerializerMethodField(read_only=True)
     available_amount = serializers.SerializerMethodField(read_only=True)
@@ -16,35 +25,42 @@ class CustomerSerializer(serializers.ModelSerializer):
         model = Customer
         fields = "__all__"
         read_only_fields = ["status"]
-    
+
     def create(self, validated_data):
         validated_data["status"] = 1
         return super().create(validated_data)
 
     def get_total_debt(self, obj):
-        return get_total_debt(obj.id)
+        # Use the total_debt annotation when the queryset provides it (see with_total_debt)
+        total_debt = getattr(obj, "total_debt", None)
+        if total_debt is None:
+            total_debt = get_total_debt(obj.id)
+        return total_debt
 
     def get_available_amount(self, obj):
-        return get_available_amount(obj)
+        return obj.score - self.get_total_debt(obj)
 
-    def to_representation(self, instance):  
+    def to_representation(self, instance):
+        total_debt = self.get_total_debt(instance)
         data = {
             "external_id": instance.external_id,
             "score": instance.score,
-            "total_debt": self.get_total_debt(instance),
-            "available_amount": self.get_available_amount(instance),
+            "total_debt": total_debt,
+            "available_amount": instance.score - total_debt,
         }
         return data
 
 
 # Response custom fields
-class CustomerCreateResponseSerializer(serializers.ModelSerializer):
+class CustomerCreateResponseSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = Customer
         fields = ["external_id", "status", "score", "preapproved_at"]
 
 
-class LoanCreateSerializer(serializers.ModelSerializer):
+class LoanCreateSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Obtain Customer_external_id
     customer_external_id = serializers.CharField(write_only=True)
 
@@ -56,7 +72,28 @@ class LoanCreateSerializer(serializers.ModelSerializer):
         return create_loan(validated_data)
 
 
-class LoanSerializer(serializers.ModelSerializer):
+class LoanBulkItemSerializer(LoanCreateSerializer):
+    # Same validation as LoanCreateSerializer, without the per-row query of the unique
+    # validator on external_id, create_loans_bulk checks that for the whole batch
+    class Meta(LoanCreateSerializer.Meta):
+        extra_kwargs = {"external_id": {"validators": []}}
+
+
+def validate_rows(serializer_class, rows, start=0):
+    # Validate each row of a batch on its own, returns the (index, validated_data)
+    # pairs of the valid rows and the errors of the invalid ones
+    valid = []
+    rejected = []
+    for index, row in enumerate(rows, start):
+        serializer = serializer_class(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            rejected.append({"index": index, "errors": serializer.errors})
+    return valid, rejected
+
+
+class LoanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     customer_external_id = serializers.SerializerMethodField()
 
     class Meta:
@@ -70,11 +107,42 @@ class LoanSerializer(serializers.ModelSerializer):
         ]
 
     def get_customer_external_id(self, obj):
+        # Select the customer with the loans (select_related("customer_id")) to avoid
+        # one query per loan
         return obj.customer_id.external_id
 
 
+class LoanReadSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    # Read-only LoanSerializer for large lists. It renders the rows of
+    # loan_read_queryset, plain dicts, without the per-field work of a ModelSerializer
+    amount_field = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+    def to_representation(self, row):
+        to_decimal = self.amount_field.to_representation
+        return {
+            "external_id": row["external_id"],
+            "amount": to_decimal(row["amount"]),
+            "outstanding": to_decimal(row["outstanding"]),
+            "status": row["status"],
+            "customer_external_id": row["customer_external_id"],
+        }
+
+
+def loan_read_queryset(queryset):
+    # Projection of the loans for LoanReadSerializer, with the customer's external_id
+    # joined in the same query. created_at and id are kept for cursor pagination
+    return queryset.values(
+        "id",
+        "created_at",
+        "external_id",
+        "amount",
+        "outstanding",
+        "status",
+        customer_external_id=F("customer_id__external_id"),
+    )
 
-class PaymentSerializer(serializers.ModelSerializer):
+
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Obtain Customer_external_id
     customer_external_id = serializers.CharField(write_only=True)
 
@@ -91,7 +159,73 @@ class PaymentSerializer(serializers.ModelSerializer):
         return create_payment(validated_data)
 
 
-class PaymentDetailSerializer(serializers.ModelSerializer):
+class PaymentBulkItemSerializer(PaymentSerializer):
+    # Same validation as PaymentSerializer, without the per-row query of the unique
+    # validator on external_id, create_payments_bulk checks that for the whole batch
+    class Meta(PaymentSerializer.Meta):
+        extra_kwargs = {"external_id": {"validators": []}}
+
+
+class PaymentEnqueueSerializer(PaymentSerializer):
+    # Same validation as PaymentSerializer, the payment is queued for the worker
+    def create(self, validated_data):
+        return enqueue_payment(validated_data)
+
+
+class QueuedPaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+
+    class Meta:
+        model = QueuedPayment
+        fields = [
+            "external_id",
+            "customer_external_id",
+            "total_amount",
+            "paid_at",
+            "status",
+            "error",
+            "created_at",
+            "processed_at",
+        ]
+
+    def get_status(self, obj):
+        return {1: "pending", 2: "applied", 3: "rejected"}[obj.status]
+
+
+class DailyCustomerSnapshotSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
+    class Meta:
+        model = DailyCustomerSnapshot
+        fields = [
+            "date",
+            "loans",
+            "originated_amount",
+            "outstanding",
+            "payments",
+            "paid_amount",
+        ]
+
+
+class DailyStatusSerializer(TimedSerializerMixin, serializers.Serializer):
+    status = serializers.IntegerField()
+    loans = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=16, decimal_places=2)
+    outstanding = serializers.DecimalField(max_digits=16, decimal_places=2)
+
+
+class DailyReportSerializer(TimedSerializerMixin, serializers.Serializer):
+    # Rows of snapshot_logic.daily_report, amounts summed over every customer
+    date = serializers.DateField()
+    loans = serializers.IntegerField()
+    originated_amount = serializers.DecimalField(max_digits=18, decimal_places=2)
+    outstanding = serializers.DecimalField(max_digits=18, decimal_places=2)
+    payments = serializers.IntegerField()
+    paid_amount = serializers.DecimalField(max_digits=30, decimal_places=10)
+    by_status = DailyStatusSerializer(many=True)
+
+
+class PaymentDetailSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = PaymentDetail
         fields = ["id", "created_at", "updated_at", "amount", "loand_id", "payment_id"]
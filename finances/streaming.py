@@ -0,0 +1,36 @@
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+class StreamingListMixin:
+    """
+    Opt-in streaming for list views: with ?stream=1 the rows are read from a
+    server-side iterator and written as one JSON array, chunk by chunk, instead
+    of being paginated.
+    """
+
+    stream_query_param = "stream"
+    stream_chunk_size = 2000
+
+    def is_streaming(self, request):
+        return request.query_params.get(self.stream_query_param) in ("1", "true")
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            "created_at", "id"
+        )
+        return StreamingHttpResponse(
+            self.stream_rows(queryset), content_type="application/json"
+        )
+
+    def stream_rows(self, queryset):
+        # A single serializer instance is reused for every row
+        serializer = self.get_serializer()
+        renderer = JSONRenderer()
+        separator = b"["
+        for instance in queryset.iterator(chunk_size=self.stream_chunk_size):
+            yield separator + renderer.render(serializer.to_representation(instance))
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
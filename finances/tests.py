@@ -1,11 +1,84 @@
-from decimal import Decimal
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import ROUND_HALF_EVEN, Decimal
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from base_app.settings import database_from_environment
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from rest_framework.exceptions import ValidationError
 from django.test import TestCase
-from finances.business_logic.customer_logic import get_available_amount, get_total_debt
-from finances.business_logic.loan_logic import create_loan
-from finances.business_logic.payment_logic import create_payment
-from finances.models import Customer, Loan, Payment, PaymentDetail
+from finances.business_logic.customer_logic import (
+    BalanceCache,
+    balance_cache,
+    get_available_amount,
+    get_balance_payload,
+    get_total_debt,
+    rebuild_balance,
+    with_total_debt,
+)
+from finances.business_logic.loan_logic import create_loan, create_loans_bulk
+from finances.business_logic import payment_logic
+from finances.business_logic.snapshot_logic import build_snapshots, daily_report
+from finances.business_logic.payment_logic import (
+    create_payment,
+    create_payments_bulk,
+)
+from finances.amortization import (
+    amount_due,
+    generate_schedules,
+    installment_plan,
+    installments,
+)
+from finances.analytics import compute_portfolio_metrics, portfolio_cache
+from finances.business_logic.accrual_logic import (
+    accrue_loans,
+    customer_ranges,
+    daily_accrual,
+)
+from finances.instrumentation import (
+    InstrumentationMiddleware,
+    RequestTimings,
+    current_timings,
+    registry,
+    timed,
+)
+from finances.query_budget import QueryBudget, counted_statements, sql_diff
+from finances.async_views import AsyncLoansByCustomerView
+from finances.idempotency import claim_key
+from finances.models import (
+    Customer,
+    CustomerBalance,
+    DailyCustomerSnapshot,
+    DailyStatusSnapshot,
+    IdempotencyKey,
+    Loan,
+    LoanAccrual,
+    LoanSchedule,
+    Payment,
+    PaymentDetail,
+    QueuedPayment,
+)
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_api_key.models import APIKey
+from django.db import IntegrityError, connection
+from django.db.backends.utils import format_number
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, Sum
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from base_app.urls import urlpatterns
 
 # Create your tests here.
 
@@ -18,7 +91,10 @@ from django.utils import timezone
 from finances.serializers import (
     CustomerSerializer,
     LoanCreateSerializer,
+    LoanSerializer,
+    PaymentBulkItemSerializer,
     PaymentSerializer,
+    validate_rows,
 )
 
 
@@ -247,7 +323,7 @@ class CustomerLogicTests(TestCase):
         Loan.objects.create(
             customer_id=self.customer,
             amount=Decimal("500.00"),
-            status=1,
+            status=2,
             outstanding=Decimal("500.00"),
         )
 
@@ -357,3 +433,2700 @@ class PaymentLogicTests(TestCase):
         self.assertEqual(
             str(error_detail), "Total payment amount exceeds outstanding loan values"
         )
+
+
+class CustomerListViewTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+
+    def create_customer_with_debt(self, index):
+        customer = Customer.objects.create(
+            external_id=f"customer_{index}", score=Decimal("1000.00"), status=1
+        )
+        Loan.objects.create(
+            external_id=f"loan_{index}",
+            customer_id=customer,
+            amount=Decimal("300.00"),
+            status=2,
+            outstanding=Decimal("250.00"),
+        )
+        return customer
+
+    def test_list_customers_balances(self):
+        self.create_customer_with_debt(1)
+        Customer.objects.create(
+            external_id="customer_no_loans", score=Decimal("500.00"), status=1
+        )
+        response = self.client.get(reverse("customer_list"))
+        self.assertEqual(response.status_code, 200)
+        balances = {row["external_id"]: row for row in response.json()["results"]}
+        self.assertEqual(balances["customer_1"]["total_debt"], 250.0)
+        self.assertEqual(balances["customer_1"]["available_amount"], 750.0)
+        self.assertEqual(balances["customer_no_loans"]["total_debt"], 0.0)
+        self.assertEqual(balances["customer_no_loans"]["available_amount"], 500.0)
+
+    def test_list_customers_query_count_is_flat(self):
+        self.create_customer_with_debt(1)
+        # The first request caches the API key verification
+        self.client.get(reverse("customer_list"))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse("customer_list"))
+        for index in range(2, 30):
+            self.create_customer_with_debt(index)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse("customer_list"))
+        self.assertEqual(len(response.json()["results"]), 29)
+        self.assertEqual(len(few), len(many))
+
+
+class ListPaginationTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("10000.00"), status=1
+        )
+        for index in range(5):
+            Loan.objects.create(
+                external_id=f"loan_{index}",
+                customer_id=self.customer,
+                amount=Decimal("100.00"),
+                status=2,
+                outstanding=Decimal("100.00"),
+            )
+
+    def test_loans_are_paginated_by_cursor(self):
+        url = reverse("get_loans_by_customer_external_id", args=["customer_1"])
+        response = self.client.get(url, {"page_size": 2})
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 2)
+            seen.extend(row["external_id"] for row in page["results"])
+            if page["next"] is None:
+                break
+            response = self.client.get(page["next"])
+        self.assertEqual(seen, [f"loan_{index}" for index in range(5)])
+
+    def test_loans_stream(self):
+        url = reverse("get_loans_by_customer_external_id", args=["customer_1"])
+        response = self.client.get(url, {"stream": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = json.loads(b"".join(response.streaming_content))
+        paginated = self.client.get(url).json()["results"]
+        self.assertEqual(rows, paginated)
+
+    def test_stream_empty_list(self):
+        response = self.client.get(reverse("make_payment"), {"stream": "true"})
+        self.assertEqual(json.loads(b"".join(response.streaming_content)), [])
+
+    def test_stream_requires_api_key(self):
+        response = APIClient().get(reverse("customer_list"), {"stream": 1})
+        self.assertEqual(response.status_code, 403)
+
+
+class CustomerBalanceLedgerTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            external_id="test_customer", score=Decimal("1000.00"), status=1
+        )
+
+    def assertLedger(self, total_debt, open_loans):
+        balance = CustomerBalance.objects.get(customer_id=self.customer)
+        self.assertEqual(balance.total_debt, total_debt)
+        self.assertEqual(balance.open_loans, open_loans)
+
+    def test_ledger_follows_loans_and_payments(self):
+        create_loan(
+            {
+                "external_id": "loan_1",
+                "customer_external_id": "test_customer",
+                "amount": Decimal("300.00"),
+            }
+        )
+        create_loan(
+            {
+                "external_id": "loan_2",
+                "customer_external_id": "test_customer",
+                "amount": Decimal("200.00"),
+            }
+        )
+        self.assertLedger(Decimal("500.00"), 2)
+
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "test_customer",
+                "total_amount": Decimal("350.00"),
+            }
+        )
+        self.assertLedger(Decimal("150.00"), 1)
+        self.assertEqual(get_total_debt(self.customer.id), Decimal("150.00"))
+
+    def test_credit_check_uses_ledger(self):
+        create_loan(
+            {
+                "external_id": "loan_1",
+                "customer_external_id": "test_customer",
+                "amount": Decimal("900.00"),
+            }
+        )
+        with self.assertRaises(ValidationError):
+            create_loan(
+                {
+                    "external_id": "loan_2",
+                    "customer_external_id": "test_customer",
+                    "amount": Decimal("200.00"),
+                }
+            )
+        self.assertLedger(Decimal("900.00"), 1)
+
+    def test_rebuild_balances_command(self):
+        create_loan(
+            {
+                "external_id": "loan_1",
+                "customer_external_id": "test_customer",
+                "amount": Decimal("300.00"),
+            }
+        )
+        # Write a loan behind the ledger's back
+        Loan.objects.create(
+            external_id="loan_2",
+            customer_id=self.customer,
+            amount=Decimal("100.00"),
+            status=2,
+            outstanding=Decimal("100.00"),
+        )
+        with self.assertRaises(CommandError):
+            call_command("rebuild_balances", "--verify", stdout=StringIO())
+        self.assertLedger(Decimal("300.00"), 1)
+
+        call_command("rebuild_balances", stdout=StringIO())
+        self.assertLedger(Decimal("400.00"), 2)
+        call_command("rebuild_balances", "--verify", stdout=StringIO())
+
+    def test_verify_reports_missing_ledger_rows(self):
+        Customer.objects.create(external_id="no_loans", score=Decimal("10"), status=1)
+        Loan.objects.create(
+            external_id="loan_1",
+            customer_id=self.customer,
+            amount=Decimal("100.00"),
+            status=2,
+            outstanding=Decimal("100.00"),
+        )
+        self.assertFalse(CustomerBalance.objects.exists())
+        output = StringIO()
+        with self.assertRaisesMessage(CommandError, "1 of 2 customer balances differ"):
+            call_command("rebuild_balances", "--verify", stdout=output)
+        self.assertEqual(
+            output.getvalue(), f"Customer {self.customer.id}: ledger row missing\n"
+        )
+
+        call_command("rebuild_balances", stdout=StringIO())
+        self.assertLedger(Decimal("100.00"), 1)
+        call_command("rebuild_balances", "--verify", stdout=StringIO())
+
+    def test_sub_cent_payments_keep_ledger_and_loans_equal(self):
+        for external_id, amount in (("loan_1", "10.01"), ("loan_2", "10.00")):
+            Loan.objects.create(
+                external_id=external_id,
+                customer_id=self.customer,
+                amount=Decimal(amount),
+                status=2,
+                outstanding=Decimal(amount),
+            )
+        call_command("rebuild_balances", stdout=StringIO())
+
+        # 10.01 - 0.005 is saved as 10.00, the ledger follows
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "test_customer",
+                "total_amount": Decimal("0.005"),
+            }
+        )
+        self.assertEqual(Loan.objects.get(external_id="loan_1").outstanding, 10)
+        self.assertLedger(Decimal("20.00"), 2)
+        # 10.00 - 9.996 is saved as 0.00, so the loan is closed
+        create_payment(
+            {
+                "external_id": "payment_2",
+                "customer_external_id": "test_customer",
+                "total_amount": Decimal("19.996"),
+            }
+        )
+        self.assertEqual(
+            list(Loan.objects.values_list("status", "outstanding")),
+            [(4, Decimal("0.00")), (4, Decimal("0.00"))],
+        )
+        self.assertLedger(Decimal("0.00"), 0)
+        call_command("rebuild_balances", "--verify", stdout=StringIO())
+
+
+class PaymentAllocationTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            external_id="test_customer", score=Decimal("100000.00"), status=1
+        )
+
+    def create_loans(self, count, amount=Decimal("10.00")):
+        for index in range(count):
+            create_loan(
+                {
+                    "external_id": f"loan_{Loan.objects.count()}",
+                    "customer_external_id": "test_customer",
+                    "amount": amount,
+                }
+            )
+
+    def pay(self, external_id, total_amount):
+        return create_payment(
+            {
+                "external_id": external_id,
+                "customer_external_id": "test_customer",
+                "total_amount": total_amount,
+            }
+        )
+
+    def test_waterfall_oldest_first(self):
+        self.create_loans(3)
+        taken_at = dict(Loan.objects.values_list("external_id", "taken_at"))
+        payment = self.pay("payment_1", Decimal("15.00"))
+
+        loans = {loan.external_id: loan for loan in Loan.objects.all()}
+        self.assertEqual(loans["loan_0"].outstanding, Decimal("0.00"))
+        self.assertEqual(loans["loan_0"].status, 4)
+        self.assertEqual(loans["loan_1"].outstanding, Decimal("5.00"))
+        self.assertEqual(loans["loan_1"].status, 2)
+        self.assertEqual(loans["loan_2"].outstanding, Decimal("10.00"))
+        # Only the loans that received money get a payment detail
+        self.assertEqual(
+            sorted(
+                PaymentDetail.objects.filter(payment_id=payment).values_list(
+                    "loand_id__external_id", flat=True
+                )
+            ),
+            ["loan_0", "loan_1"],
+        )
+        # The allocation no longer rewrites the loans' dates
+        for external_id, loan in loans.items():
+            self.assertEqual(loan.taken_at, taken_at[external_id])
+
+    def test_query_count_does_not_grow_with_loans(self):
+        self.create_loans(2)
+        with CaptureQueriesContext(connection) as few:
+            self.pay("payment_1", Decimal("20.00"))
+        self.create_loans(50)
+        with CaptureQueriesContext(connection) as many:
+            self.pay("payment_2", Decimal("500.00"))
+        self.assertEqual(len(few), len(many))
+        self.assertFalse(
+            Loan.objects.filter(customer_id=self.customer, outstanding__gt=0).exists()
+        )
+
+
+class AmortizationTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            external_id="test_customer", score=Decimal("100000.00"), status=1
+        )
+
+    def create_loan(self, external_id, amount=Decimal("1000.00")):
+        return create_loan(
+            {
+                "external_id": external_id,
+                "customer_external_id": "test_customer",
+                "amount": amount,
+            }
+        )
+
+    def pay(self, external_id, total_amount):
+        return create_payment(
+            {
+                "external_id": external_id,
+                "customer_external_id": "test_customer",
+                "total_amount": total_amount,
+            }
+        )
+
+    def take_back(self, loan, days):
+        # Move the loan's start into the past and regenerate its schedule
+        Loan.objects.filter(id=loan.id).update(
+            taken_at=loan.taken_at - timedelta(days=days)
+        )
+        generate_schedules(Loan.objects.filter(id=loan.id))
+
+    def test_installment_plans(self):
+        parts, interest = installment_plan("annuity", [100000, 55555], 0.01, 12)
+        # Equal installments of 88.85 for 1000.00 at 1% a period, the last one
+        # takes the rounding difference
+        self.assertEqual(set((parts + interest)[0, :-1].tolist()), {8885})
+        self.assertEqual(interest[0, 0], 1000)
+        self.assertEqual(parts.sum(axis=1).tolist(), [100000, 55555])
+
+        parts, interest = installment_plan("flat", [55555], 0.01, 12)
+        self.assertEqual(parts.sum(), 55555)
+        self.assertEqual(set(interest[0].tolist()), {556})
+
+        parts, interest = installment_plan("bullet", [100000], 0.01, 3)
+        self.assertEqual(parts.tolist(), [[0, 0, 100000]])
+        self.assertEqual(interest.tolist(), [[1000, 1000, 1000]])
+
+        with self.assertRaises(ValueError):
+            installment_plan("balloon", [100000], 0.01, 12)
+
+    def test_create_loan_builds_its_schedule(self):
+        loan = self.create_loan("loan_1")
+        schedule = LoanSchedule.objects.get(loan_id=loan)
+        self.assertEqual(loan.contract_version, "v1.0")
+        self.assertEqual(schedule.method, "annuity")
+        due_days, amounts = installments(schedule)
+        self.assertEqual(len(due_days), 12)
+        self.assertEqual(loan.maximum_payment_date, loan.taken_at + timedelta(days=360))
+        # Nothing is due the day the loan is taken
+        self.assertEqual(amount_due(schedule, timezone.localdate()), 0)
+
+        # Saving the loan no longer moves its dates
+        taken_at = loan.taken_at
+        loan.refresh_from_db()
+        loan.save()
+        loan.refresh_from_db()
+        self.assertEqual(loan.taken_at, taken_at)
+        self.assertEqual(loan.maximum_payment_date, taken_at + timedelta(days=360))
+
+    def test_payment_pays_due_installments_first(self):
+        older = self.create_loan("loan_1")
+        newer = self.create_loan("loan_2")
+        # Two installments of the newer loan are due
+        self.take_back(newer, 61)
+        schedule = LoanSchedule.objects.get(loan_id=newer)
+        due = amount_due(schedule, timezone.localdate())
+        self.assertEqual(due, Decimal(int(installments(schedule)[1][:2].sum())) / 100)
+
+        self.pay("payment_1", Decimal("500.00"))
+        older.refresh_from_db()
+        newer.refresh_from_db()
+        self.assertEqual(newer.outstanding, Decimal("1000.00") - due)
+        self.assertEqual(older.outstanding, Decimal("500.00") + due)
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.paid, due)
+        self.assertEqual(amount_due(schedule, timezone.localdate()), 0)
+
+        # With nothing due, the payments go to the oldest loan again
+        self.pay("payment_2", Decimal("100.00"))
+        older.refresh_from_db()
+        self.assertEqual(older.outstanding, Decimal("400.00") + due)
+
+    def test_bulk_payments_pay_due_installments_first(self):
+        older = self.create_loan("loan_1")
+        newer = self.create_loan("loan_2")
+        self.take_back(newer, 31)
+        due = amount_due(LoanSchedule.objects.get(loan_id=newer), timezone.localdate())
+        accepted, rejected = create_payments_bulk(
+            [
+                (
+                    index,
+                    {
+                        "external_id": f"payment_{index}",
+                        "customer_external_id": "test_customer",
+                        "total_amount": Decimal("60.00"),
+                    },
+                )
+                for index in range(2)
+            ]
+        )
+        self.assertEqual((len(accepted), rejected), (2, []))
+        newer.refresh_from_db()
+        older.refresh_from_db()
+        # The first payment covers part of the due installment, the second the rest
+        # of it before going to the older loan
+        self.assertEqual(newer.outstanding, Decimal("1000.00") - due)
+        self.assertEqual(older.outstanding, Decimal("880.00") + due)
+        self.assertEqual(LoanSchedule.objects.get(loan_id=newer).paid, due)
+
+    def test_generate_schedules_command(self):
+        loan = self.create_loan("loan_1")
+        other = self.create_loan("loan_2")
+        self.pay("payment_1", Decimal("1100.00"))
+        Loan.objects.filter(id=other.id).update(contract_version="v2.0")
+        Loan.objects.filter(id=loan.id).update(contract_version="v0.9")
+
+        contracts = {
+            "v2.0": {
+                "METHOD": "flat",
+                "INSTALLMENTS": 6,
+                "PERIOD_DAYS": 30,
+                "ANNUAL_RATE": "0.12",
+            }
+        }
+        out, err = StringIO(), StringIO()
+        with override_settings(AMORTIZATION={"CONTRACTS": contracts}):
+            # loan_1 is paid, so only the open loan_2 is regenerated
+            call_command("generate_schedules", stdout=out, stderr=err)
+            self.assertIn("Generated 1 schedules", out.getvalue())
+            call_command("generate_schedules", "--all", stdout=out, stderr=err)
+        self.assertIn("1 loans skipped, unknown contract version", err.getvalue())
+
+        schedule = LoanSchedule.objects.get(loan_id=other)
+        self.assertEqual((schedule.contract_version, schedule.method), ("v2.0", "flat"))
+        self.assertEqual(len(installments(schedule)[0]), 6)
+        # The money already paid is kept
+        self.assertEqual(schedule.paid, Decimal("100.00"))
+        other.refresh_from_db()
+        self.assertEqual(
+            other.maximum_payment_date, other.taken_at + timedelta(days=180)
+        )
+
+
+class AccrualTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            external_id="test_customer", score=Decimal("100000.00"), status=1
+        )
+        self.today = timezone.localdate()
+
+    def create_loan(self, external_id, amount=Decimal("1000.00"), customer=None):
+        return create_loan(
+            {
+                "external_id": external_id,
+                "customer_external_id": customer or "test_customer",
+                "amount": amount,
+            }
+        )
+
+    def accrue(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command("accrue", *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_daily_accrual_rounds_like_decimal(self):
+        generator = random.Random(25)
+        amounts = [generator.randrange(1, 10**11) for _ in range(1000)]
+        for rate in ("0.24", "0.3599", "0.365"):
+            expected = [
+                int(
+                    (Decimal(amount) * Decimal(rate) / 365).quantize(
+                        Decimal(1), rounding=ROUND_HALF_EVEN
+                    )
+                )
+                for amount in amounts
+            ]
+            self.assertEqual(daily_accrual(amounts, rate).tolist(), expected)
+        # Exact halves go to the even cent
+        self.assertEqual(daily_accrual([1500, 2500], "0.365").tolist(), [2, 2])
+
+    def test_accrue_adds_interest_once_per_date(self):
+        paid = self.create_loan("loan_1", Decimal("10.00"))
+        loan = self.create_loan("loan_2")
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "test_customer",
+                "total_amount": Decimal("10.00"),
+            }
+        )
+        paid.refresh_from_db()
+        self.assertEqual(paid.status, 4)
+        other = self.create_loan("loan_3")
+        Loan.objects.filter(id=other.id).update(contract_version="v0.9")
+
+        out, err = self.accrue("--date", self.today.isoformat())
+        # 1000.00 a day at 24% a year is 0.6575, rounded to 0.66
+        self.assertIn("Accrued 1 loans", out)
+        self.assertIn("0.66 interest, 0.00 late fees", out)
+        self.assertIn("1 loans skipped, unknown contract version", err)
+        loan.refresh_from_db()
+        self.assertEqual(loan.outstanding, Decimal("1000.66"))
+        accrual = LoanAccrual.objects.get(loan_id=loan)
+        self.assertEqual(
+            (accrual.date, accrual.outstanding, accrual.interest, accrual.late_fee),
+            (self.today, Decimal("1000.00"), Decimal("0.66"), Decimal("0.00")),
+        )
+        self.assertEqual(get_total_debt(self.customer.id), Decimal("2000.66"))
+
+        # The same date again changes nothing, the next day accrues again
+        out, _ = self.accrue("--date", self.today.isoformat())
+        self.assertIn("Accrued 0 loans", out)
+        self.accrue("--date", (self.today + timedelta(days=1)).isoformat())
+        loan.refresh_from_db()
+        self.assertEqual(loan.outstanding, Decimal("1001.32"))
+        self.assertEqual(LoanAccrual.objects.filter(loan_id=paid).count(), 0)
+        self.assertEqual(get_total_debt(self.customer.id), Decimal("2001.32"))
+
+    def test_late_fees_on_overdue_installments(self):
+        loan = self.create_loan("loan_1")
+        Loan.objects.filter(id=loan.id).update(
+            taken_at=loan.taken_at - timedelta(days=40)
+        )
+        generate_schedules(Loan.objects.filter(id=loan.id))
+        schedule = LoanSchedule.objects.get(loan_id=loan)
+        installment = int(installments(schedule)[1][0])
+
+        self.accrue("--date", self.today.isoformat())
+        accrual = LoanAccrual.objects.get(loan_id=loan)
+        self.assertEqual(
+            accrual.late_fee,
+            Decimal(int(daily_accrual([installment], "0.36")[0])).scaleb(-2),
+        )
+
+        # Once the installment is paid, the next day bears interest only
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "test_customer",
+                "total_amount": Decimal(installment).scaleb(-2),
+            }
+        )
+        self.accrue("--date", (self.today + timedelta(days=1)).isoformat())
+        accrual = LoanAccrual.objects.get(
+            loan_id=loan, date=self.today + timedelta(days=1)
+        )
+        self.assertEqual(accrual.late_fee, Decimal("0.00"))
+        self.assertGreater(accrual.interest, 0)
+
+    def test_customer_ranges_split_the_accrual(self):
+        for index in range(5):
+            Customer.objects.create(
+                external_id=f"customer_{index}", score=Decimal("1000.00"), status=1
+            )
+            self.create_loan(f"loan_{index}", Decimal("100.00"), f"customer_{index}")
+
+        ranges = customer_ranges(3)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0][0], Customer.objects.order_by("id").first().id)
+        self.assertEqual(ranges[-1][1], Customer.objects.order_by("id").last().id + 1)
+        for (_, high), (low, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(high, low)
+
+        totals = [
+            accrue_loans(self.today, customer_range, batch_size=2)
+            for customer_range in ranges
+        ]
+        self.assertEqual(sum(result["loans"] for result in totals), 5)
+        self.assertEqual(
+            LoanAccrual.objects.filter(date=self.today).count(),
+            Loan.objects.count(),
+        )
+        # 100.00 a day at 24% a year is 0.0658, rounded to 0.07
+        self.assertEqual(
+            set(Loan.objects.values_list("outstanding", flat=True)),
+            {Decimal("100.07")},
+        )
+
+
+class ConcurrentLoanPaymentTests(TransactionTestCase):
+    threads = 8
+    operations_per_thread = 6
+
+    def setUp(self):
+        self.customer = Customer.objects.create(
+            external_id="test_customer", score=Decimal("1000.00"), status=1
+        )
+
+    def run_in_threads(self, work):
+        errors = []
+
+        def target(thread):
+            try:
+                for operation in range(self.operations_per_thread):
+                    try:
+                        work(thread, operation)
+                    except ValidationError:
+                        # Rejected by the credit or outstanding check, that is expected
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=target, args=(thread,))
+            for thread in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+    def assertInvariants(self):
+        open_loans = Loan.objects.filter(customer_id=self.customer, status=2)
+        total_debt = sum(loan.outstanding for loan in open_loans)
+        balance = CustomerBalance.objects.get(customer_id=self.customer)
+        self.assertLessEqual(total_debt, self.customer.score)
+        self.assertEqual(balance.total_debt, total_debt)
+        self.assertEqual(balance.open_loans, len(open_loans))
+        self.assertFalse(Loan.objects.filter(outstanding__lt=0).exists())
+        for payment in Payment.objects.all():
+            allocated = PaymentDetail.objects.filter(payment_id=payment).aggregate(
+                total=Sum("amount")
+            )["total"]
+            self.assertEqual(allocated, payment.total_amount)
+
+    def test_parallel_loans_never_exceed_score(self):
+        def take_loan(thread, operation):
+            create_loan(
+                {
+                    "external_id": f"loan_{thread}_{operation}",
+                    "customer_external_id": "test_customer",
+                    "amount": Decimal("30.00"),
+                }
+            )
+
+        self.run_in_threads(take_loan)
+        # 48 loans of 30 were requested against a score of 1000
+        self.assertEqual(Loan.objects.count(), 33)
+        self.assertInvariants()
+
+    def test_parallel_loans_and_payments(self):
+        def take_loan_or_pay(thread, operation):
+            if thread % 2:
+                create_loan(
+                    {
+                        "external_id": f"loan_{thread}_{operation}",
+                        "customer_external_id": "test_customer",
+                        "amount": Decimal("40.00"),
+                    }
+                )
+            else:
+                create_payment(
+                    {
+                        "external_id": f"payment_{thread}_{operation}",
+                        "customer_external_id": "test_customer",
+                        "total_amount": Decimal("25.00"),
+                    }
+                )
+
+        self.run_in_threads(take_loan_or_pay)
+        self.assertInvariants()
+
+
+class LoanBulkCreateTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("1000.00"), status=1
+        )
+        Customer.objects.create(
+            external_id="customer_2", score=Decimal("100.00"), status=1
+        )
+        create_loan(
+            {
+                "external_id": "existing_loan",
+                "customer_external_id": "customer_1",
+                "amount": Decimal("200.00"),
+            }
+        )
+
+    def post(self, rows):
+        return self.client.post(reverse("loan-bulk-create"), rows, format="json")
+
+    def test_bulk_create_reports_each_row(self):
+        response = self.post(
+            [
+                {
+                    "external_id": "l1",
+                    "customer_external_id": "customer_1",
+                    "amount": 500,
+                },
+                {
+                    "external_id": "l2",
+                    "customer_external_id": "customer_2",
+                    "amount": 60,
+                },
+                # Running total of customer_1 reaches 1100 > 1000
+                {
+                    "external_id": "l3",
+                    "customer_external_id": "customer_1",
+                    "amount": 400,
+                },
+                {"external_id": "l4", "customer_external_id": "missing", "amount": 10},
+                {
+                    "external_id": "existing_loan",
+                    "customer_external_id": "customer_1",
+                    "amount": 10,
+                },
+                {
+                    "external_id": "l2",
+                    "customer_external_id": "customer_2",
+                    "amount": 10,
+                },
+                {
+                    "external_id": "l6",
+                    "customer_external_id": "customer_1",
+                    "amount": "abc",
+                },
+                {
+                    "external_id": "l7",
+                    "customer_external_id": "customer_1",
+                    "amount": 300,
+                },
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(
+            body["accepted"],
+            [
+                {"index": 0, "external_id": "l1", "amount": "500.00"},
+                {"index": 1, "external_id": "l2", "amount": "60.00"},
+                {"index": 7, "external_id": "l7", "amount": "300.00"},
+            ],
+        )
+        self.assertEqual([row["index"] for row in body["rejected"]], [2, 3, 4, 5, 6])
+        self.assertEqual(
+            body["rejected"][0]["errors"]["non_field_errors"],
+            ["Total outstanding loans exceed customer's credit score"],
+        )
+        self.assertEqual(
+            body["rejected"][1]["errors"]["non_field_errors"], ["Customer not found"]
+        )
+        self.assertIn("amount", body["rejected"][4]["errors"])
+
+        balance = CustomerBalance.objects.get(customer_id=self.customer)
+        self.assertEqual(balance.total_debt, Decimal("1000.00"))
+        self.assertEqual(balance.open_loans, 3)
+        self.assertEqual(Loan.objects.filter(status=2).count(), 4)
+
+    def test_bulk_create_query_count_is_flat(self):
+        def rows(prefix, count):
+            return [
+                {
+                    "external_id": f"{prefix}_{index}",
+                    "customer_external_id": f"customer_{index % 2 + 1}",
+                    "amount": 1,
+                }
+                for index in range(count)
+            ]
+
+        # The first batch builds the ledger row of customer_2
+        self.post(rows("warmup", 2))
+        with CaptureQueriesContext(connection) as few:
+            self.post(rows("a", 2))
+        with CaptureQueriesContext(connection) as many:
+            response = self.post(rows("b", 60))
+        self.assertEqual(len(response.json()["accepted"]), 60)
+        self.assertEqual(len(few), len(many))
+
+    def test_bulk_create_requires_a_list(self):
+        response = self.post({"external_id": "l1"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_with_every_row_rejected(self):
+        response = self.post(
+            [
+                {"external_id": "l1", "customer_external_id": "missing", "amount": 1},
+                {"external_id": "existing_loan", "customer_external_id": "customer_1"},
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["accepted"], [])
+        self.assertEqual([row["index"] for row in response.json()["rejected"]], [0, 1])
+        self.assertEqual(Loan.objects.count(), 1)
+
+
+class PaymentBulkCreateTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        for customer in ("customer_1", "customer_2"):
+            Customer.objects.create(
+                external_id=customer, score=Decimal("1000.00"), status=1
+            )
+            for index in range(3):
+                create_loan(
+                    {
+                        "external_id": f"{customer}_loan_{index}",
+                        "customer_external_id": customer,
+                        "amount": Decimal("100.00"),
+                    }
+                )
+
+    def post(self, rows):
+        return self.client.post(reverse("payment-bulk-create"), rows, format="json")
+
+    def test_bulk_payments_match_sequential_allocation(self):
+        rows = [
+            {
+                "external_id": "p1",
+                "customer_external_id": "customer_1",
+                "total_amount": 150,
+            },
+            {
+                "external_id": "p2",
+                "customer_external_id": "customer_2",
+                "total_amount": 100,
+            },
+            {
+                "external_id": "p3",
+                "customer_external_id": "customer_1",
+                "total_amount": 100,
+            },
+            # customer_1 only owes 50 after p1 and p3
+            {
+                "external_id": "p4",
+                "customer_external_id": "customer_1",
+                "total_amount": 60,
+            },
+            {"external_id": "p5", "customer_external_id": "missing", "total_amount": 1},
+            {
+                "external_id": "p1",
+                "customer_external_id": "customer_2",
+                "total_amount": 1,
+            },
+        ]
+        with mock.patch(
+            "finances.business_logic.payment_logic._create_payments_chunk",
+            wraps=payment_logic._create_payments_chunk,
+        ) as chunk:
+            accepted, rejected = payment_logic.create_payments_bulk(
+                validate_rows(PaymentBulkItemSerializer, rows)[0], chunk_size=2
+            )
+        self.assertEqual(chunk.call_count, 3)
+        self.assertEqual([index for index, _ in accepted], [0, 1, 2])
+        self.assertEqual(
+            [(index, message) for index, _, message in rejected],
+            [
+                (3, "Total payment amount exceeds outstanding loan values"),
+                (4, "Customer not found"),
+                (5, "payment with this external id already exists."),
+            ],
+        )
+        outstanding = dict(Loan.objects.values_list("external_id", "outstanding"))
+        self.assertEqual(outstanding["customer_1_loan_0"], Decimal("0.00"))
+        self.assertEqual(outstanding["customer_1_loan_1"], Decimal("0.00"))
+        self.assertEqual(outstanding["customer_1_loan_2"], Decimal("50.00"))
+        self.assertEqual(outstanding["customer_2_loan_0"], Decimal("0.00"))
+        self.assertEqual(
+            PaymentDetail.objects.filter(payment_id__external_id="p3").count(), 2
+        )
+        balance = CustomerBalance.objects.get(customer_id__external_id="customer_1")
+        self.assertEqual(balance.total_debt, Decimal("50.00"))
+        self.assertEqual(balance.open_loans, 1)
+        call_command("rebuild_balances", "--verify", stdout=StringIO())
+
+    def test_bulk_payment_endpoint(self):
+        response = self.post(
+            [
+                {
+                    "external_id": "p1",
+                    "customer_external_id": "customer_1",
+                    "total_amount": 100,
+                },
+                {"external_id": "p2", "customer_external_id": "customer_1"},
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["accepted"][0]["external_id"], "p1")
+        self.assertEqual(response.json()["rejected"][0]["index"], 1)
+        self.assertIn("total_amount", response.json()["rejected"][0]["errors"])
+
+    def test_bulk_payment_query_count_is_flat(self):
+        def rows(prefix, count):
+            return [
+                {
+                    "external_id": f"{prefix}_{index}",
+                    "customer_external_id": f"customer_{index % 2 + 1}",
+                    "total_amount": "0.50",
+                }
+                for index in range(count)
+            ]
+
+        # The first request caches the API key verification
+        self.post(rows("warmup", 2))
+        with CaptureQueriesContext(connection) as few:
+            self.post(rows("a", 2))
+        with CaptureQueriesContext(connection) as many:
+            response = self.post(rows("b", 100))
+        self.assertEqual(len(response.json()["accepted"]), 100)
+        self.assertEqual(len(few), len(many))
+
+
+class ImportLedgerCommandTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def import_file(self, path, kind, *args):
+        call_command("import_ledger", path, "--kind", kind, *args, stdout=StringIO())
+
+    def test_import_customers_loans_and_payments(self):
+        customers = self.write(
+            "customers.csv",
+            "external_id,score,preapproved_at\n"
+            "c1,1000,2024-05-20T22:15:54Z\n"
+            "c2,500,\n"
+            "c1,700,\n"
+            "c3,not-a-number,\n",
+        )
+        loans = self.write(
+            "loans.jsonl",
+            '{"external_id": "l1", "customer_external_id": "c1", "amount": "300"}\n'
+            "\n"
+            '{"external_id": "l2", "customer_external_id": "c2", "amount": "600"}\n'
+            '{"external_id": "l3", "customer_external_id": "c1", "amount": "200"}\n',
+        )
+        payments = self.write(
+            "payments.jsonl",
+            '{"external_id": "p1", "customer_external_id": "c1", "total_amount": "350"}\n',
+        )
+        rejects = os.path.join(self.directory.name, "rejects.jsonl")
+
+        self.import_file(customers, "customers", "--rejects", rejects)
+        self.import_file(loans, "loans", "--batch-size", "2")
+        self.import_file(payments, "payments")
+
+        self.assertEqual(
+            dict(Customer.objects.values_list("external_id", "score")),
+            {"c1": Decimal("1000.00"), "c2": Decimal("500.00")},
+        )
+        with open(rejects) as file:
+            self.assertEqual([json.loads(line)["index"] for line in file], [2, 3])
+        self.assertEqual(
+            dict(Loan.objects.values_list("external_id", "outstanding")),
+            {"l1": Decimal("0.00"), "l3": Decimal("150.00")},
+        )
+        self.assertEqual(get_total_debt(Customer.objects.get(external_id="c1").id), 150)
+
+    def test_resume_from_checkpoint(self):
+        # The rows before the checkpoint are not read again, not even parsed
+        imported = "not json\n" * 3
+        customers = self.write(
+            "customers.jsonl",
+            imported
+            + "".join(
+                json.dumps({"external_id": f"c{index}", "score": 100}) + "\n"
+                for index in range(3, 5)
+            ),
+        )
+        checkpoint = os.path.join(self.directory.name, "customers.checkpoint")
+        with open(checkpoint, "w") as file:
+            json.dump({"offset": 3, "position": len(imported)}, file)
+
+        self.import_file(customers, "customers", "--checkpoint", checkpoint, "--resume")
+        self.assertEqual(
+            sorted(Customer.objects.values_list("external_id", flat=True)), ["c3", "c4"]
+        )
+        with open(checkpoint) as file:
+            self.assertEqual(
+                json.load(file), {"offset": 5, "position": os.path.getsize(customers)}
+            )
+
+    def test_resume_csv_after_a_multiline_row(self):
+        imported = 'external_id,score\nc0,100\n"c\n1",100\n'
+        customers = self.write("customers.csv", imported + "c2,100\nc3,100\n")
+        self.import_file(customers, "customers", "--batch-size", "2")
+        with open(f"{customers}.checkpoint") as file:
+            self.assertEqual(
+                json.load(file), {"offset": 4, "position": os.path.getsize(customers)}
+            )
+
+        Customer.objects.all().delete()
+        with open(f"{customers}.checkpoint", "w") as file:
+            json.dump({"offset": 2, "position": len(imported)}, file)
+        self.import_file(customers, "customers", "--resume")
+        self.assertEqual(
+            sorted(Customer.objects.values_list("external_id", flat=True)), ["c2", "c3"]
+        )
+
+    def test_payment_batches_are_one_transaction(self):
+        # Larger than the chunks of create_payments_bulk, still written at once
+        Customer.objects.create(external_id="c1", score=Decimal("1000.00"), status=1)
+        Loan.objects.create(
+            external_id="l1",
+            customer_id=Customer.objects.get(),
+            amount=Decimal("100.00"),
+            status=2,
+            outstanding=Decimal("100.00"),
+        )
+        payments = self.write(
+            "payments.jsonl",
+            "".join(
+                json.dumps(
+                    {
+                        "external_id": f"p{index}",
+                        "customer_external_id": "c1",
+                        "total_amount": "0.01",
+                    }
+                )
+                + "\n"
+                for index in range(1001)
+            ),
+        )
+        with mock.patch.object(
+            payment_logic,
+            "_create_payments_chunk",
+            wraps=payment_logic._create_payments_chunk,
+        ) as create_chunk:
+            self.import_file(payments, "payments", "--batch-size", "1001")
+        self.assertEqual(create_chunk.call_count, 1)
+        self.assertEqual(Payment.objects.count(), 1001)
+
+
+class CachedHasAPIKeyTests(TestCase):
+    def setUp(self):
+        self.api_key, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.url = reverse("make_payment")
+
+    def test_verification_is_cached(self):
+        with mock.patch.object(
+            APIKey.objects, "get_from_key", wraps=APIKey.objects.get_from_key
+        ) as verify:
+            for _ in range(3):
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+
+    def test_revocation_invalidates_cache(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.api_key.revoked = True
+        self.api_key.save()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_expired_key_is_rejected_from_cache(self):
+        self.api_key.expiry_date = timezone.now() + timezone.timedelta(seconds=1)
+        self.api_key.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=timezone.now() + timezone.timedelta(seconds=2),
+        ):
+            self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_invalid_key_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Api-Key wrong.key")
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    @override_settings(
+        API_KEY_CACHE={"CACHE_ALIAS": "default"},
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    def test_shared_cache_revocation(self):
+        with mock.patch.object(
+            APIKey.objects, "get_from_key", wraps=APIKey.objects.get_from_key
+        ) as verify:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            self.assertEqual(verify.call_count, 1)
+            self.api_key.revoked = True
+            self.api_key.save()
+            self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class LoansByCustomerViewTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("100000.00"), status=1
+        )
+        Customer.objects.create(
+            external_id="no_loans", score=Decimal("100.00"), status=1
+        )
+        self.url = reverse("get_loans_by_customer_external_id", args=["customer_1"])
+
+    def create_loans(self, count):
+        start = Loan.objects.count()
+        for index in range(start, start + count):
+            Loan.objects.create(
+                external_id=f"loan_{index}",
+                customer_id=self.customer,
+                amount=Decimal("100.50"),
+                status=2,
+                outstanding=Decimal("7.1"),
+            )
+
+    def test_read_serializer_matches_loan_serializer(self):
+        self.create_loans(3)
+        loans = Loan.objects.order_by("created_at", "id")
+        self.assertEqual(
+            self.client.get(self.url).json()["results"],
+            LoanSerializer(loans, many=True).data,
+        )
+        self.assertEqual(
+            json.loads(b"".join(self.client.get(self.url, {"stream": 1}))),
+            LoanSerializer(loans, many=True).data,
+        )
+
+    def test_query_count_is_flat(self):
+        self.create_loans(1)
+        # The first request caches the API key verification
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self.create_loans(50)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.json()["results"]), 51)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(many), 1)
+
+    def test_unknown_customer_is_not_found(self):
+        url = reverse("get_loans_by_customer_external_id", args=["missing"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {"stream": 1}).status_code, 404)
+
+    def test_customer_without_loans(self):
+        url = reverse("get_loans_by_customer_external_id", args=["no_loans"])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [])
+
+
+class ReadPlanTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.customer = Customer.objects.create(
+            external_id="cliente_ñ_\u2028", score=Decimal("200000.50"), status=1
+        )
+        Customer.objects.create(external_id='quote"d', score=Decimal("0.10"), status=1)
+        for index, amount in enumerate(["100.00", "0.01", "99999.99"]):
+            create_loan(
+                {
+                    "external_id": f"loan_{index}",
+                    "customer_external_id": self.customer.external_id,
+                    "amount": Decimal(amount),
+                }
+            )
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": self.customer.external_id,
+                "total_amount": Decimal("50.1234567891"),
+                "paid_at": timezone.now(),
+            }
+        )
+        create_payment(
+            {
+                "external_id": "payment_2",
+                "customer_external_id": self.customer.external_id,
+                "total_amount": Decimal("1"),
+            }
+        )
+
+    def expected(self, serializer_class, queryset):
+        rows = serializer_class(queryset.order_by("created_at", "id"), many=True).data
+        return JSONRenderer().render({"next": None, "previous": None, "results": rows})
+
+    def test_pages_match_serializers_byte_for_byte(self):
+        cases = [
+            (
+                reverse("customer_list"),
+                CustomerSerializer,
+                with_total_debt(Customer.objects.all()),
+            ),
+            (
+                reverse(
+                    "get_loans_by_customer_external_id",
+                    args=[self.customer.external_id],
+                ),
+                LoanSerializer,
+                Loan.objects.all(),
+            ),
+            (reverse("make_payment"), PaymentSerializer, Payment.objects.all()),
+        ]
+        for url, serializer_class, queryset in cases:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response.content, self.expected(serializer_class, queryset)
+                )
+                streamed = b"".join(self.client.get(url, {"stream": 1}))
+                self.assertEqual(
+                    json.loads(streamed), json.loads(response.content)["results"]
+                )
+
+    def test_cursor_pages_over_read_plan(self):
+        url = reverse("make_payment")
+        page = self.client.get(url, {"page_size": 1}).json()
+        second = self.client.get(page["next"]).json()
+        self.assertEqual(
+            [page["results"][0]["external_id"], second["results"][0]["external_id"]],
+            ["payment_1", "payment_2"],
+        )
+        self.assertIsNone(second["next"])
+
+
+class BalanceCacheTests(TestCase):
+    def setUp(self):
+        balance_cache.clear()
+        self.addCleanup(balance_cache.clear)
+        self.customer = Customer.objects.create(
+            external_id="cached_customer", score=Decimal("1000.00"), status=1
+        )
+        create_loan(
+            {
+                "external_id": "loan_1",
+                "customer_external_id": "cached_customer",
+                "amount": Decimal("300.00"),
+            }
+        )
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.url = reverse("customer-detail", args=["cached_customer"])
+
+    def assertBalance(self, total_debt):
+        # Reads the payload through the cache and compares it with the loans
+        payload = get_balance_payload("cached_customer")
+        expected = Loan.objects.filter(
+            customer_id=self.customer, status=2
+        ).aggregate(total=Sum("outstanding"))["total"] or Decimal(0)
+        self.assertEqual(payload["total_debt"], expected)
+        self.assertEqual(payload["total_debt"], total_debt)
+        self.assertEqual(payload["available_amount"], self.customer.score - total_debt)
+
+    def test_hits_and_misses_are_counted(self):
+        self.assertBalance(Decimal("300.00"))
+        with self.assertNumQueries(0):
+            get_balance_payload("cached_customer")
+        self.assertEqual(balance_cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_writes_invalidate_on_commit(self):
+        self.assertBalance(Decimal("300.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_loan(
+                {
+                    "external_id": "loan_2",
+                    "customer_external_id": "cached_customer",
+                    "amount": Decimal("200.00"),
+                }
+            )
+        self.assertBalance(Decimal("500.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_payment(
+                {
+                    "external_id": "payment_1",
+                    "customer_external_id": "cached_customer",
+                    "total_amount": Decimal("350.00"),
+                }
+            )
+        self.assertBalance(Decimal("150.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_loans_bulk(
+                [
+                    (
+                        0,
+                        {
+                            "external_id": "loan_3",
+                            "customer_external_id": "cached_customer",
+                            "amount": Decimal("50.00"),
+                        },
+                    )
+                ]
+            )
+        self.assertBalance(Decimal("200.00"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_payments_bulk(
+                [
+                    (
+                        0,
+                        {
+                            "external_id": "payment_2",
+                            "customer_external_id": "cached_customer",
+                            "total_amount": Decimal("200.00"),
+                        },
+                    )
+                ]
+            )
+        self.assertBalance(Decimal("0.00"))
+
+    def test_failed_write_keeps_cache(self):
+        self.assertBalance(Decimal("300.00"))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValidationError):
+                create_loan(
+                    {
+                        "external_id": "loan_2",
+                        "customer_external_id": "cached_customer",
+                        "amount": Decimal("900.00"),
+                    }
+                )
+        self.assertEqual(callbacks, [])
+        self.assertBalance(Decimal("300.00"))
+        self.assertEqual(balance_cache.stats()["hits"], 1)
+
+    def test_payload_read_before_a_write_is_not_served_after_it(self):
+        # A reader misses and reads the balance, then a write commits before the
+        # reader stores what it read
+        stale, generation = balance_cache.get("cached_customer")
+        self.assertIsNone(stale)
+        stale = {"total_debt": Decimal("300.00")}
+        with self.captureOnCommitCallbacks(execute=True):
+            create_loan(
+                {
+                    "external_id": "loan_2",
+                    "customer_external_id": "cached_customer",
+                    "amount": Decimal("200.00"),
+                }
+            )
+        balance_cache.set("cached_customer", generation, stale)
+        self.assertBalance(Decimal("500.00"))
+
+    @override_settings(BALANCE_CACHE={"CACHE_ALIAS": "default"})
+    def test_shared_cache(self):
+        self.test_payload_read_before_a_write_is_not_served_after_it()
+        with self.assertNumQueries(0):
+            payload = get_balance_payload("cached_customer")
+        self.assertEqual(payload["total_debt"], Decimal("500.00"))
+
+    def test_invalidation_from_another_process(self):
+        # Another process, such as a management command, has its own BalanceCache
+        other_process = BalanceCache()
+        self.addCleanup(caches["default"].clear)
+        customers = Customer.objects.filter(external_id="cached_customer")
+        for config, score in (
+            ({}, Decimal("1000.00")),
+            ({"CACHE_ALIAS": "default"}, Decimal("2000.00")),
+        ):
+            with self.subTest(**config), override_settings(BALANCE_CACHE=config):
+                customers.update(score=Decimal("1000.00"))
+                get_balance_payload("cached_customer")
+                # update() sends no signal, only the other process invalidates
+                customers.update(score=Decimal("2000.00"))
+                other_process.invalidate(["cached_customer"])
+                # The in-process cache keeps the old payload until the TTL expires
+                payload = get_balance_payload("cached_customer")
+                self.assertEqual(payload["score"], score)
+
+    def test_endpoint_after_loan(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()["total_debt"], 300.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("loan-create"),
+                {
+                    "external_id": "loan_2",
+                    "customer_external_id": "cached_customer",
+                    "amount": "200.00",
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response.json(),
+            {
+                "external_id": "cached_customer",
+                "score": 1000.0,
+                "total_debt": 500.0,
+                "available_amount": 500.0,
+            },
+        )
+        self.assertEqual(
+            self.client.get(reverse("customer-detail", args=["nobody"])).status_code,
+            404,
+        )
+
+    def test_score_change_invalidates(self):
+        self.assertBalance(Decimal("300.00"))
+        self.customer.score = Decimal("2000.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.save()
+        self.assertBalance(Decimal("300.00"))
+        self.assertEqual(
+            get_balance_payload("cached_customer")["available_amount"],
+            Decimal("1700.00"),
+        )
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        self.owner = key.partition(".")[0]
+        Customer.objects.create(
+            external_id="customer_1", score=Decimal("1000.00"), status=1
+        )
+        self.loan = {
+            "external_id": "loan_1",
+            "customer_external_id": "customer_1",
+            "amount": "300.00",
+        }
+
+    def post(self, name, data, key="key-1"):
+        return self.client.post(
+            reverse(name), data, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_response(self):
+        first = self.post("loan-create", self.loan)
+        self.assertEqual(first.status_code, 201)
+        # The retry is answered from the stored response with a single lookup
+        with self.assertNumQueries(1):
+            retry = self.post("loan-create", self.loan)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_payment_retry_replays_response(self):
+        self.post("loan-create", self.loan)
+        payment = {
+            "external_id": "payment_1",
+            "customer_external_id": "customer_1",
+            "total_amount": "100.00",
+        }
+        with mock.patch(
+            "finances.serializers.create_payment", wraps=payment_logic.create_payment
+        ) as create:
+            first = self.post("make_payment", payment)
+            retry = self.post("make_payment", payment)
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_key_reused_with_other_body_is_refused(self):
+        self.post("loan-create", self.loan)
+        response = self.post("loan-create", {**self.loan, "amount": "10.00"})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Loan.objects.count(), 1)
+
+    def test_duplicate_in_flight_gets_conflict(self):
+        response = self.post("loan-create", self.loan)
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+        response = self.post("loan-create", self.loan)
+        self.assertEqual(response.status_code, 409)
+
+    def test_failed_request_releases_key(self):
+        response = self.post("loan-create", {**self.loan, "amount": "5000.00"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = self.post("loan-create", self.loan)
+        self.assertEqual(response.status_code, 201)
+
+    def test_expired_key_is_reclaimed(self):
+        self.post("loan-create", self.loan)
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        response = self.post("loan-create", {**self.loan, "external_id": "loan_2"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Loan.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_keys_are_scoped(self):
+        # The same key on another endpoint or from another client is another request
+        record, claimed = claim_key(self.owner, "create_loan", "key-1", "a")
+        self.assertTrue(claimed)
+        self.assertEqual(
+            claim_key(self.owner, "create_loan", "key-1", "a"), (record, False)
+        )
+        self.assertTrue(claim_key(self.owner, "make_payment", "key-1", "a")[1])
+        self.assertTrue(claim_key("other", "create_loan", "key-1", "a")[1])
+
+    def test_key_released_during_claim(self):
+        # The competing request releases the key between our insert and our read
+        create = IdempotencyKey.objects.create
+        attempts = []
+
+        def create_once_taken(**fields):
+            attempts.append(fields)
+            if len(attempts) == 1:
+                raise IntegrityError
+            return create(**fields)
+
+        with mock.patch.object(
+            IdempotencyKey.objects, "create", side_effect=create_once_taken
+        ):
+            record, claimed = claim_key(self.owner, "create_loan", "key-1", "a")
+        self.assertTrue(claimed)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(record, IdempotencyKey.objects.get())
+
+        # Released again on the retry, the request is answered as in progress
+        IdempotencyKey.objects.all().delete()
+        with mock.patch.object(
+            IdempotencyKey.objects, "create", side_effect=IntegrityError
+        ):
+            self.assertEqual(
+                claim_key(self.owner, "create_loan", "key-1", "a"), (None, False)
+            )
+            response = self.post("loan-create", self.loan)
+        self.assertEqual(response.status_code, 409)
+
+    def test_without_key(self):
+        self.assertEqual(
+            self.client.post(
+                reverse("loan-create"), self.loan, format="json"
+            ).status_code,
+            201,
+        )
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_purge_command(self):
+        self.post("loan-create", self.loan)
+        self.post("loan-create", {**self.loan, "external_id": "loan_2"}, key="key-2")
+        IdempotencyKey.objects.filter(key="key-1").update(expires_at=timezone.now())
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list("key", flat=True)), ["key-2"]
+        )
+
+
+class PaymentQueueTests(TestCase):
+    def setUp(self):
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        Customer.objects.create(
+            external_id="customer_1", score=Decimal("1000.00"), status=1
+        )
+        for index in range(3):
+            create_loan(
+                {
+                    "external_id": f"loan_{index}",
+                    "customer_external_id": "customer_1",
+                    "amount": Decimal("100.00"),
+                }
+            )
+
+    def enqueue(self, external_id, total_amount, customer="customer_1"):
+        return self.client.post(
+            reverse("make_payment"),
+            {
+                "external_id": external_id,
+                "customer_external_id": customer,
+                "total_amount": total_amount,
+            },
+            format="json",
+            HTTP_PREFER="respond-async",
+        )
+
+    def drain(self):
+        call_command("process_payment_queue", "--once", stdout=StringIO())
+
+    def test_async_payment_is_queued_and_applied(self):
+        response = self.enqueue("payment_1", "150.00")
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()["status_url"]
+        self.assertEqual(response["Location"], status_url)
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(self.client.get(status_url).json()["status"], "pending")
+
+        self.drain()
+        status = self.client.get(status_url).json()
+        self.assertEqual(status["status"], "applied")
+        self.assertIsNotNone(status["processed_at"])
+        self.assertEqual(
+            list(Loan.objects.order_by("id").values_list("outstanding", flat=True)),
+            [Decimal("0.00"), Decimal("50.00"), Decimal("100.00")],
+        )
+        self.assertEqual(
+            CustomerBalance.objects.get(
+                customer_id__external_id="customer_1"
+            ).total_debt,
+            Decimal("150.00"),
+        )
+
+    def test_payments_of_a_customer_apply_in_order(self):
+        self.enqueue("payment_1", "250.00")
+        # Only 50 left once payment_1 is applied
+        self.enqueue("payment_2", "100.00")
+        self.enqueue("payment_3", "50.00")
+        self.enqueue("payment_4", "10.00", customer="nobody")
+        self.drain()
+        self.assertEqual(
+            dict(QueuedPayment.objects.values_list("external_id", "status")),
+            {"payment_1": 2, "payment_2": 3, "payment_3": 2, "payment_4": 3},
+        )
+        self.assertEqual(
+            QueuedPayment.objects.get(external_id="payment_4").error,
+            "Customer not found",
+        )
+        self.assertEqual(Loan.objects.filter(status=2).count(), 0)
+
+    def test_duplicate_payment_is_refused(self):
+        self.assertEqual(self.enqueue("payment_1", "10.00").status_code, 202)
+        self.assertEqual(self.enqueue("payment_1", "10.00").status_code, 400)
+
+    @override_settings(PAYMENT_QUEUE={"ASYNC": True})
+    def test_async_setting(self):
+        response = self.client.post(
+            reverse("make_payment"),
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "customer_1",
+                "total_amount": "10.00",
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 202)
+
+    def test_metrics(self):
+        self.enqueue("payment_1", "10.00")
+        self.enqueue("payment_2", "10.00")
+        metrics = self.client.get(reverse("payment-queue-metrics")).json()
+        self.assertEqual(metrics["depth"], 2)
+        self.assertGreaterEqual(metrics["lag_seconds"], 0)
+        self.assertEqual(metrics["throughput"], 0)
+
+        self.drain()
+        metrics = self.client.get(reverse("payment-queue-metrics")).json()
+        self.assertEqual(metrics["depth"], 0)
+        self.assertEqual(metrics["lag_seconds"], 0)
+        self.assertGreater(metrics["throughput"], 0)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        balance_cache.clear()
+        self.addCleanup(balance_cache.clear)
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("100000.00"), status=1
+        )
+        Customer.objects.create(external_id="no_loans", score=Decimal("5.5"), status=1)
+        for index in range(5):
+            Loan.objects.create(
+                external_id=f"loan_{index}",
+                customer_id=customer,
+                amount=Decimal("100.50"),
+                status=2,
+                outstanding=Decimal("7.10"),
+            )
+
+    def content(self, response):
+        if not response.streaming:
+            return response.content
+        if response.is_async:
+            return async_to_sync(self.acontent)(response)
+        return b"".join(response.streaming_content)
+
+    async def acontent(self, response):
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    def assertSameResponse(self, name, async_name, external_id, params=None):
+        sync = self.client.get(reverse(name, args=[external_id]), params)
+        balance_cache.clear()
+        asynchronous = self.client.get(reverse(async_name, args=[external_id]), params)
+        self.assertEqual(asynchronous.status_code, sync.status_code)
+        # Page links point to the endpoint that served the page
+        self.assertEqual(
+            self.content(asynchronous).replace(b"/async/", b"/"), self.content(sync)
+        )
+
+    def test_balance_matches_sync_view(self):
+        for external_id in ("customer_1", "no_loans", "nobody"):
+            self.assertSameResponse(
+                "customer-detail", "customer-detail-async", external_id
+            )
+
+    def test_balance_without_ledger_row(self):
+        # The async read aggregates the loans instead of building the ledger row
+        response = self.client.get(
+            reverse("customer-detail-async", args=["customer_1"])
+        )
+        self.assertEqual(response.json()["total_debt"], 35.5)
+        self.assertFalse(CustomerBalance.objects.exists())
+
+    @override_settings(REST_FRAMEWORK={"PAGE_SIZE": 2})
+    def test_loans_match_sync_view(self):
+        names = (
+            "get_loans_by_customer_external_id",
+            "get_loans_by_customer_external_id_async",
+        )
+        for external_id in ("customer_1", "no_loans", "nobody"):
+            self.assertSameResponse(*names, external_id)
+            # Chunks smaller than the loans, so the stream reads several of them
+            with mock.patch.object(AsyncLoansByCustomerView, "stream_chunk_size", 2):
+                self.assertSameResponse(*names, external_id, {"stream": "true"})
+        self.assertSameResponse(*names, "customer_1", {"page_size": 3})
+        cursor = self.client.get(
+            reverse(names[1], args=["customer_1"]), {"page_size": 3}
+        ).json()["next"]
+        second = self.client.get(cursor).json()
+        self.assertEqual(
+            [loan["external_id"] for loan in second["results"]], ["loan_3", "loan_4"]
+        )
+
+    def test_api_key_is_required(self):
+        client = APIClient()
+        for name, async_name in (
+            ("customer-detail", "customer-detail-async"),
+            (
+                "get_loans_by_customer_external_id",
+                "get_loans_by_customer_external_id_async",
+            ),
+        ):
+            sync = client.get(reverse(name, args=["customer_1"]))
+            asynchronous = client.get(reverse(async_name, args=["customer_1"]))
+            self.assertEqual(asynchronous.status_code, 403)
+            self.assertEqual(asynchronous.content, sync.content)
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            # 1 is NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_sqlite_is_the_default(self):
+        database = database_from_environment({"SQLITE_PATH": "/tmp/loans.sqlite3"})
+        self.assertEqual(database["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(database["NAME"], "/tmp/loans.sqlite3")
+
+    def test_postgres_from_environment(self):
+        environ = {
+            "DB_ENGINE": "postgres",
+            "POSTGRES_DB": "loans",
+            "POSTGRES_HOST": "db",
+            "DB_CONN_MAX_AGE": "300",
+        }
+        database = database_from_environment(environ)
+        self.assertEqual(database["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(database["HOST"], "db")
+        self.assertEqual(database["CONN_MAX_AGE"], 300)
+        self.assertTrue(database["CONN_HEALTH_CHECKS"])
+
+
+class MoneyFieldTests(TestCase):
+    # Amounts of DecimalField(max_digits=12, decimal_places=2) columns, with the
+    # values saved by DecimalField: rounded half to even to cents
+    values = [
+        "0",
+        "0.01",
+        "-0.01",
+        "0.005",
+        "0.015",
+        "0.025",
+        "2.675",
+        "100.5",
+        "33.3333333333",
+        "1234567890.12",
+        "9999999999.99",
+        "-9999999999.99",
+    ]
+
+    def decimal_field_value(self, value):
+        return Decimal(format_number(Decimal(value), 12, 2))
+
+    def test_round_trip_matches_decimal_field(self):
+        field = Loan._meta.get_field("amount")
+        generator = random.Random(18)
+        values = self.values + [
+            str(Decimal(generator.randrange(-(10**20), 10**20)).scaleb(-10))
+            for _ in range(1000)
+        ]
+        for value in values:
+            stored = field.get_db_prep_save(Decimal(value), connection)
+            self.assertIsInstance(stored, int)
+            self.assertEqual(
+                field.from_db_value(stored, None, connection),
+                self.decimal_field_value(value),
+            )
+
+    def test_stored_as_integer_cents(self):
+        for index, value in enumerate(self.values):
+            customer = Customer.objects.create(
+                external_id=f"customer_{index}", score=Decimal(value), status=1
+            )
+            customer.refresh_from_db()
+            self.assertEqual(customer.score, self.decimal_field_value(value))
+            self.assertEqual(customer.score.as_tuple().exponent, -2)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT score FROM finances_customer WHERE id = %s", [customer.id]
+                )
+                self.assertEqual(
+                    cursor.fetchone()[0], int(self.decimal_field_value(value) * 100)
+                )
+
+    def test_lookups_and_aggregates_are_exact(self):
+        customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("100000.00"), status=1
+        )
+        amounts = [Decimal("0.10"), Decimal("0.20"), Decimal("1234.56")]
+        for index, amount in enumerate(amounts):
+            create_loan(
+                {
+                    "external_id": f"loan_{index}",
+                    "customer_external_id": "customer_1",
+                    "amount": amount,
+                }
+            )
+        self.assertEqual(
+            Loan.objects.aggregate(total=Sum("outstanding"))["total"], sum(amounts)
+        )
+        self.assertEqual(get_total_debt(customer.id), Decimal("1234.86"))
+        self.assertEqual(
+            Loan.objects.filter(amount=Decimal("0.30") - Decimal("0.20")).count(), 1
+        )
+        self.assertEqual(
+            with_total_debt(Customer.objects.all()).get().total_debt,
+            Decimal("1234.86"),
+        )
+
+    def test_allocation_of_fractional_payments(self):
+        customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("100000.00"), status=1
+        )
+        for index in range(3):
+            create_loan(
+                {
+                    "external_id": f"loan_{index}",
+                    "customer_external_id": "customer_1",
+                    "amount": Decimal("10.00"),
+                }
+            )
+        create_payment(
+            {
+                "external_id": "payment_1",
+                "customer_external_id": "customer_1",
+                "total_amount": Decimal("12.3456789012"),
+            }
+        )
+        outstanding = list(
+            Loan.objects.order_by("id").values_list("outstanding", flat=True)
+        )
+        self.assertEqual(
+            outstanding, [Decimal("0.00"), Decimal("7.65"), Decimal("10.00")]
+        )
+        # The ledger follows the loans to the cent
+        self.assertEqual(get_total_debt(customer.id), sum(outstanding))
+        self.assertEqual(
+            LoanSerializer(Loan.objects.get(external_id="loan_1")).data["outstanding"],
+            "7.65",
+        )
+
+
+class MoneyFieldMigrationTests(TransactionTestCase):
+    before = [("finances", "0008_queuedpayment")]
+    after = [("finances", "0009_money_fields_minor_units")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_amounts_are_converted_both_ways(self):
+        apps = self.migrate(self.before)
+        customer = apps.get_model("finances", "Customer").objects.create(
+            external_id="customer_1", score=Decimal("1234567890.12"), status=1
+        )
+        apps.get_model("finances", "Loan").objects.create(
+            external_id="loan_1",
+            customer_id=customer,
+            amount=Decimal("0.10"),
+            outstanding=Decimal("0.07"),
+            status=2,
+            contract_version="1",
+        )
+        apps.get_model("finances", "CustomerBalance").objects.create(
+            customer_id=customer, total_debt=Decimal("0.07"), open_loans=1
+        )
+
+        apps = self.migrate(self.after)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT amount, outstanding FROM finances_loan")
+            self.assertEqual(cursor.fetchone(), (10, 7))
+            cursor.execute("SELECT score FROM finances_customer")
+            self.assertEqual(cursor.fetchone(), (123456789012,))
+            cursor.execute("SELECT total_debt FROM finances_customerbalance")
+            self.assertEqual(cursor.fetchone(), (7,))
+
+        apps = self.migrate(self.before)
+        loan = apps.get_model("finances", "Loan").objects.get()
+        self.assertEqual(
+            (loan.amount, loan.outstanding), (Decimal("0.10"), Decimal("0.07"))
+        )
+        self.assertEqual(
+            apps.get_model("finances", "Customer").objects.get().score,
+            Decimal("1234567890.12"),
+        )
+        self.assertEqual(
+            apps.get_model("finances", "CustomerBalance").objects.get().total_debt,
+            Decimal("0.07"),
+        )
+
+
+class PortfolioAnalyticsTests(TestCase):
+    def setUp(self):
+        portfolio_cache.clear()
+        self.now = timezone.now()
+        for external_id, score in (
+            ("customer_1", "1000.00"),
+            ("customer_2", "200.00"),
+            ("customer_3", "0.00"),
+        ):
+            Customer.objects.create(
+                external_id=external_id, score=Decimal(score), status=1
+            )
+        for external_id, customer, amount, days in (
+            ("loan_1", "customer_1", "300.00", 10),
+            ("loan_2", "customer_1", "100.00", 45),
+            ("loan_3", "customer_2", "60.00", 200),
+        ):
+            create_loan(
+                {
+                    "external_id": external_id,
+                    "customer_external_id": customer,
+                    "amount": Decimal(amount),
+                }
+            )
+            Loan.objects.filter(external_id=external_id).update(
+                taken_at=self.now - timedelta(days=days)
+            )
+        for external_id, amount, days in (
+            ("payment_1", "150.00", 2),
+            ("payment_2", "10.00", 20),
+        ):
+            payment = create_payment(
+                {
+                    "external_id": external_id,
+                    "customer_external_id": "customer_1",
+                    "total_amount": Decimal(amount),
+                }
+            )
+            PaymentDetail.objects.filter(payment_id=payment).update(
+                created_at=self.now - timedelta(days=days)
+            )
+        # A customer without ledger row, its debt is aggregated from its loans
+        customer = Customer.objects.create(
+            external_id="customer_4", score=Decimal("500.00"), status=1
+        )
+        for external_id, status, outstanding in (
+            ("loan_4", 2, "250.00"),
+            ("loan_5", 4, "0.00"),
+        ):
+            Loan.objects.create(
+                external_id=external_id,
+                customer_id=customer,
+                amount=Decimal("250.00"),
+                outstanding=Decimal(outstanding),
+                status=status,
+            )
+        Loan.objects.filter(customer_id=customer).update(
+            taken_at=self.now - timedelta(days=70)
+        )
+
+    def test_metrics(self):
+        metrics = compute_portfolio_metrics(now=self.now)
+        by_status = {
+            str(row["status"]): {
+                "loans": row["loans"],
+                "outstanding": str(row["outstanding"]),
+                "amount": str(row["amount"]),
+            }
+            for row in Loan.objects.values("status").annotate(
+                loans=Count("id"), outstanding=Sum("outstanding"), amount=Sum("amount")
+            )
+        }
+        self.assertEqual(metrics["loans"]["by_status"], by_status)
+        self.assertEqual(
+            metrics["loans"]["by_status"]["2"],
+            {"loans": 4, "outstanding": "550.00", "amount": "710.00"},
+        )
+        self.assertEqual(
+            metrics["loans"]["aging"],
+            {
+                "0-30": {"loans": 1, "outstanding": "140.00"},
+                "30-60": {"loans": 1, "outstanding": "100.00"},
+                "60-90": {"loans": 1, "outstanding": "250.00"},
+                "90-180": {"loans": 0, "outstanding": "0.00"},
+                "180+": {"loans": 1, "outstanding": "60.00"},
+            },
+        )
+
+        utilization = metrics["utilization"]
+        self.assertEqual(utilization["customers"], 3)
+        self.assertEqual(utilization["customers_without_score"], 1)
+        self.assertEqual(utilization["total_debt"], "550.00")
+        self.assertEqual(utilization["total_score"], "1700.00")
+        self.assertEqual(utilization["portfolio"], 0.3235)
+        # 0.24, 0.3 and 0.5. A utilization of exactly 0.3 counts in 0.3-0.4
+        self.assertEqual(utilization["mean"], 0.3467)
+        self.assertEqual(utilization["p50"], 0.31)
+        self.assertEqual(utilization["distribution"]["0.2-0.3"], 1)
+        self.assertEqual(utilization["distribution"]["0.3-0.4"], 1)
+        self.assertEqual(utilization["distribution"]["0.5-0.6"], 1)
+        self.assertEqual(sum(utilization["distribution"].values()), 3)
+
+        velocity = metrics["repayment_velocity"]
+        self.assertEqual(velocity["payment_details"], 2)
+        self.assertEqual(velocity["last_7_days"], "150.00")
+        self.assertEqual(velocity["last_30_days"], "160.00")
+        self.assertEqual(velocity["last_90_days"], "160.00")
+        self.assertEqual(velocity["per_day"], "1.78")
+
+    def test_chunk_size_does_not_change_the_metrics(self):
+        whole = compute_portfolio_metrics(now=self.now, chunk_size=1000)
+        chunked = compute_portfolio_metrics(now=self.now, chunk_size=2)
+        del whole["compute_seconds"], chunked["compute_seconds"]
+        self.assertEqual(chunked, whole)
+
+    def test_endpoint_is_cached(self):
+        client = APIClient()
+        self.assertEqual(client.get(reverse("analytics-portfolio")).status_code, 403)
+        _, key = APIKey.objects.create_key(name="tests")
+        client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        first = client.get(reverse("analytics-portfolio"))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(
+            first.json()["loans"]["by_status"]["2"]["outstanding"], "550.00"
+        )
+        with self.assertNumQueries(0):
+            second = client.get(reverse("analytics-portfolio"))
+        self.assertEqual(second.json(), first.json())
+
+        with override_settings(ANALYTICS={"TTL": 0}):
+            portfolio_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                portfolio_cache.get_or_compute()
+                portfolio_cache.get_or_compute()
+            # One chunk of each of the three tables, for each call
+            self.assertEqual(len(queries), 6)
+
+
+class DailySnapshotTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        for external_id in ("customer_1", "customer_2"):
+            Customer.objects.create(
+                external_id=external_id, score=Decimal("10000.00"), status=1
+            )
+
+    def create_loans(self, customer, amounts, days_ago):
+        for amount in amounts:
+            loan = create_loan(
+                {
+                    "external_id": f"loan_{Loan.objects.count()}",
+                    "customer_external_id": customer,
+                    "amount": Decimal(amount),
+                }
+            )
+            # Loans taken on earlier days, updated when they were created
+            Loan.objects.filter(id=loan.id).update(
+                created_at=self.now - timedelta(days=days_ago)
+            )
+
+    def pay(self, customer, amount):
+        return create_payment(
+            {
+                "external_id": f"payment_{Payment.objects.count()}",
+                "customer_external_id": customer,
+                "total_amount": Decimal(amount),
+            }
+        )
+
+    def build(self, *args):
+        call_command("build_snapshots", "--lag", "0", *args, stdout=StringIO())
+
+    def snapshots(self):
+        return (
+            sorted(
+                DailyCustomerSnapshot.objects.values_list(
+                    "date",
+                    "customer_id",
+                    "loans",
+                    "originated_amount",
+                    "outstanding",
+                    "payments",
+                    "paid_amount",
+                )
+            ),
+            sorted(
+                DailyStatusSnapshot.objects.values_list(
+                    "date", "status", "loans", "amount", "outstanding"
+                )
+            ),
+        )
+
+    def test_incremental_build_equals_full_recompute(self):
+        self.create_loans("customer_1", ["100.00", "50.00"], days_ago=3)
+        self.create_loans("customer_2", ["80.00"], days_ago=3)
+        self.create_loans("customer_2", ["20.00"], days_ago=1)
+        self.build("--batch-size", "2")
+
+        # Pays off the oldest loan of customer_1, moving it from status 2 to 4
+        self.pay("customer_1", "120.00")
+        self.create_loans("customer_1", ["30.00"], days_ago=0)
+        self.build("--batch-size", "2")
+        self.pay("customer_2", "100.00")
+        self.build("--batch-size", "2")
+        incremental = self.snapshots()
+
+        self.build("--full")
+        self.assertEqual(self.snapshots(), incremental)
+
+        three_days_ago = timezone.localdate(self.now - timedelta(days=3))
+        self.assertEqual(
+            [row for row in incremental[1] if row[0] == three_days_ago],
+            [
+                (three_days_ago, 2, 1, Decimal("50.00"), Decimal("30.00")),
+                (three_days_ago, 4, 2, Decimal("180.00"), Decimal("0.00")),
+            ],
+        )
+        customer_1 = Customer.objects.get(external_id="customer_1").id
+        self.assertIn(
+            (
+                timezone.localdate(self.now),
+                customer_1,
+                1,
+                Decimal("30.00"),
+                Decimal("30.00"),
+                1,
+                Decimal("120.0000000000"),
+            ),
+            incremental[0],
+        )
+
+    def test_only_rows_updated_after_the_watermark_are_processed(self):
+        self.create_loans("customer_1", ["100.00", "50.00"], days_ago=2)
+        self.assertEqual(build_snapshots(lag=0), (2, 0))
+        self.assertEqual(build_snapshots(lag=0), (0, 0))
+        self.pay("customer_1", "100.00")
+        # The paid off loan and the payment
+        self.assertEqual(build_snapshots(lag=0), (1, 1))
+        # Rows younger than the lag wait for a later build
+        self.pay("customer_1", "10.00")
+        self.assertEqual(build_snapshots(lag=3600), (0, 0))
+        self.assertEqual(build_snapshots(lag=0), (1, 1))
+
+    def test_report_after_a_customer_is_deleted(self):
+        self.create_loans("customer_1", ["100.00"], days_ago=2)
+        self.create_loans("customer_2", ["80.00"], days_ago=1)
+        self.build()
+        Customer.objects.filter(external_id="customer_1").delete()
+
+        two_days_ago = timezone.localdate(self.now - timedelta(days=2))
+        report = daily_report()
+        self.assertEqual(
+            [row["date"] for row in report], sorted(row["date"] for row in report)
+        )
+        self.assertEqual(
+            report[0],
+            {
+                "date": two_days_ago,
+                "loans": 0,
+                "originated_amount": Decimal(0),
+                "outstanding": Decimal(0),
+                "payments": 0,
+                "paid_amount": Decimal(0),
+                "by_status": [
+                    {
+                        "status": 2,
+                        "loans": 1,
+                        "amount": Decimal("100.00"),
+                        "outstanding": Decimal("100.00"),
+                    }
+                ],
+            },
+        )
+        self.assertEqual(report[1]["loans"], 1)
+
+    def test_reports_read_the_snapshots(self):
+        self.create_loans("customer_1", ["100.00", "50.00"], days_ago=2)
+        self.pay("customer_1", "120.00")
+        self.build()
+        client = APIClient()
+        _, key = APIKey.objects.create_key(name="tests")
+        client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+
+        with CaptureQueriesContext(connection) as queries:
+            daily = client.get(reverse("report-daily")).json()
+        self.assertFalse(
+            [query for query in queries if "finances_loan" in query["sql"]]
+        )
+        self.assertEqual(
+            daily[0],
+            {
+                "date": str(timezone.localdate(self.now - timedelta(days=2))),
+                "loans": 2,
+                "originated_amount": "150.00",
+                "outstanding": "30.00",
+                "payments": 0,
+                "paid_amount": "0.0000000000",
+                "by_status": [
+                    {
+                        "status": 2,
+                        "loans": 1,
+                        "amount": "50.00",
+                        "outstanding": "30.00",
+                    },
+                    {
+                        "status": 4,
+                        "loans": 1,
+                        "amount": "100.00",
+                        "outstanding": "0.00",
+                    },
+                ],
+            },
+        )
+        self.assertEqual(daily[1]["payments"], 1)
+        today = str(timezone.localdate(self.now))
+        self.assertEqual(
+            len(client.get(reverse("report-daily"), {"from": today}).json()), 1
+        )
+        self.assertEqual(
+            client.get(reverse("report-daily"), {"from": "yesterday"}).status_code,
+            400,
+        )
+
+        rows = client.get(
+            reverse("report-customer-daily", args=["customer_1"]), {"to": today}
+        ).json()
+        self.assertEqual([row["loans"] for row in rows], [2, 0])
+
+        # Well formed dates that do not exist are rejected too
+        for name, params in (
+            ("report-daily", {"from": "2024-02-30"}),
+            ("report-customer-daily", {"to": "2024-13-01"}),
+        ):
+            args = ["customer_1"] if name == "report-customer-daily" else []
+            response = client.get(reverse(name, args=args), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json(),
+                {next(iter(params)): ["Expected a date as YYYY-MM-DD."]},
+            )
+        self.assertEqual(
+            client.get(reverse("report-customer-daily", args=["nobody"])).status_code,
+            404,
+        )
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+        balance_cache.clear()
+        self.addCleanup(balance_cache.clear)
+        _, self.key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {self.key}")
+        Customer.objects.create(
+            external_id="customer_1", score=Decimal("1000.00"), status=1
+        )
+
+    def create_loan(self):
+        return self.client.post(
+            reverse("loan-create"),
+            {
+                "external_id": "loan_1",
+                "customer_external_id": "customer_1",
+                "amount": "100.00",
+            },
+            format="json",
+        )
+
+    def test_sampled_request_gets_server_timing(self):
+        with override_settings(INSTRUMENTATION={"SAMPLE_RATE": 1}):
+            response = self.create_loan()
+        self.assertEqual(response.status_code, 201)
+        entries = [
+            entry.split(";")[0] for entry in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(entries[:2], ["total", "db"])
+        self.assertIn("create_loan", entries)
+        self.assertIn("serializer", entries)
+
+    def test_metrics_per_endpoint(self):
+        with override_settings(INSTRUMENTATION={"SAMPLE_RATE": 1}):
+            self.create_loan()
+            self.client.get(reverse("customer-detail", args=["customer_1"]))
+            self.client.get(reverse("customer-detail", args=["customer_1"]))
+        sections = {
+            section
+            for endpoint, section in registry.sections
+            if endpoint == "loan-create"
+        }
+        self.assertEqual(sections, {"create_loan", "serializer"})
+        self.assertIn(("customer-detail", "get_total_debt"), registry.sections)
+        self.assertGreater(registry.sampled["loan-create"][1], 0)
+
+        # Served as text whatever the client accepts
+        response = self.client.get(reverse("metrics"), HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn(
+            'finances_http_requests_total{endpoint="customer-detail",method="GET",'
+            'status="200"} 2',
+            text,
+        )
+        self.assertIn(
+            'finances_http_request_duration_seconds_count{endpoint="loan-create"} 1',
+            text,
+        )
+        self.assertIn('finances_db_queries_total{endpoint="loan-create"}', text)
+        self.assertIn("finances_payment_queue_depth 0", text)
+
+    def test_unsampled_and_disabled_requests(self):
+        with override_settings(INSTRUMENTATION={"SAMPLE_RATE": 0}):
+            response = self.create_loan()
+        # Counted, but without the detailed timings
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(registry.requests, {("loan-create", "POST", 201): 1})
+        self.assertEqual(registry.sampled, {})
+
+        registry.clear()
+        with override_settings(INSTRUMENTATION={"ENABLED": False}):
+            self.client.get(reverse("customer-detail", args=["customer_1"]))
+        self.assertEqual(registry.requests, {})
+
+    def test_concurrent_async_requests(self):
+        # Under ASGI the middleware runs in the event loop, not adapted to a thread
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(InstrumentationMiddleware(get_response)))
+
+        client = AsyncClient()
+        headers = {"Authorization": f"Api-Key {self.key}"}
+        paths = [
+            reverse("customer-detail-async", args=["customer_1"]),
+            reverse("get_loans_by_customer_external_id_async", args=["customer_1"]),
+        ] * 3
+
+        async def get_all():
+            return await asyncio.gather(
+                *(client.get(path, headers=headers) for path in paths)
+            )
+
+        with override_settings(INSTRUMENTATION={"SAMPLE_RATE": 1}):
+            with CaptureQueriesContext(connection) as queries:
+                responses = async_to_sync(get_all)()
+        self.assertEqual([response.status_code for response in responses], [200] * 6)
+        self.assertEqual(
+            registry.requests,
+            {
+                ("customer-detail-async", "GET", 200): 3,
+                ("get_loans_by_customer_external_id_async", "GET", 200): 3,
+            },
+        )
+        # Each query is timed once, in the request that ran it
+        counts = [
+            int(re.search(r'desc="(\d+) queries"', response["Server-Timing"])[1])
+            for response in responses
+        ]
+        self.assertEqual(sum(counts), len(queries))
+        # The loans are read by every request of their endpoint
+        self.assertTrue(all(counts[1::2]))
+        self.assertEqual(
+            sum(sampled[1] for sampled in registry.sampled.values()), len(queries)
+        )
+
+    def test_nested_sections_are_counted_once(self):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            # Only the outer call reads the clock
+            with mock.patch("time.perf_counter", side_effect=[0.0, 1.0]):
+                timed("outer")(lambda: timed("outer")(lambda: None)())()
+        finally:
+            current_timings.reset(token)
+        self.assertEqual(timings.sections, {"outer": 1.0})
+
+
+class QueryBudgetTestMixin:
+    def assertQueryBudget(self, request, volumes):
+        # volumes maps labels to functions growing the data, called in order and each
+        # followed by request(). Every request must stay within the query_budget of
+        # its view and issue as many queries as the first one. Failures show the SQL
+        # against the one of the first volume
+        captured = []
+        for label, grow in volumes.items():
+            grow()
+            with CaptureQueriesContext(connection) as queries:
+                response = request()
+            self.assertLess(response.status_code, 400, response.content)
+            captured.append((label, counted_statements(queries.captured_queries)))
+
+        view = response.resolver_match.func.view_class
+        method = response.request["REQUEST_METHOD"]
+        budget = view.query_budget[method]
+        first_label, first = captured[0]
+        for label, statements in captured:
+            problems = budget.check(statements)
+            if len(statements) != len(first):
+                problems.append(f"{len(first)} queries with {first_label}")
+            if problems:
+                self.fail(
+                    f"{view.__name__} {method} with {label}: {'; '.join(problems)}\n"
+                    + sql_diff(first, statements, first_label, label)
+                )
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    def setUp(self):
+        balance_cache.clear()
+        self.addCleanup(balance_cache.clear)
+        _, key = APIKey.objects.create_key(name="tests")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Api-Key {key}")
+        # Caches the API key check, the requests below are measured warm
+        self.client.get(reverse("payment-queue-metrics"))
+        self.customer = Customer.objects.create(
+            external_id="customer_1", score=Decimal("1000000.00"), status=1
+        )
+        self.created = 0
+
+    def next_id(self, prefix):
+        self.created += 1
+        return f"{prefix}_{self.created}"
+
+    def add_loans(self, count):
+        Loan.objects.bulk_create(
+            Loan(
+                external_id=self.next_id("loan"),
+                customer_id=self.customer,
+                amount=Decimal("10.00"),
+                outstanding=Decimal("10.00"),
+                status=2,
+            )
+            for _ in range(count)
+        )
+        generate_schedules(Loan.objects.filter(customer_id=self.customer))
+        rebuild_balance(self.customer.id)
+
+    def add_customers(self, count):
+        Customer.objects.bulk_create(
+            Customer(
+                external_id=self.next_id("other"),
+                score=Decimal("100.00"),
+                status=1,
+            )
+            for _ in range(count)
+        )
+
+    def get(self, name, *args):
+        return lambda: self.client.get(reverse(name, args=args))
+
+    def post(self, name, body):
+        return lambda: self.client.post(reverse(name), body(), format="json")
+
+    def test_every_endpoint_declares_a_budget(self):
+        for pattern in urlpatterns:
+            if getattr(pattern, "name", None):
+                with self.subTest(pattern.name):
+                    self.assertTrue(
+                        hasattr(pattern.callback.view_class, "query_budget")
+                    )
+
+    def test_customer_list(self):
+        self.assertQueryBudget(
+            self.get("customer_list"),
+            {
+                "10 customers": lambda: self.add_customers(9),
+                "1000 customers": lambda: self.add_customers(990),
+            },
+        )
+
+    def test_customer_creation(self):
+        self.assertQueryBudget(
+            self.post(
+                "create_customer",
+                lambda: {"external_id": self.next_id("new"), "score": "10.00"},
+            ),
+            {
+                "10 customers": lambda: self.add_customers(9),
+                "1000 customers": lambda: self.add_customers(990),
+            },
+        )
+
+    def test_balance(self):
+        for name in ("customer-detail", "customer-detail-async"):
+            with self.subTest(name):
+                # A cache miss, the cached balance needs no query at all
+                request = self.get(name, "customer_1")
+                self.assertQueryBudget(
+                    lambda: balance_cache.clear() or request(),
+                    {
+                        "1 loan": lambda: self.add_loans(1),
+                        "100 loans": lambda: self.add_loans(99),
+                    },
+                )
+
+    def test_loan_listing(self):
+        for name in (
+            "get_loans_by_customer_external_id",
+            "get_loans_by_customer_external_id_async",
+        ):
+            with self.subTest(name):
+                self.assertQueryBudget(
+                    self.get(name, "customer_1"),
+                    {
+                        "1 loan": lambda: self.add_loans(1),
+                        "100 loans": lambda: self.add_loans(99),
+                    },
+                )
+
+    def test_loan_creation(self):
+        def loan():
+            return {
+                "external_id": self.next_id("loan"),
+                "customer_external_id": "customer_1",
+                "amount": "10.00",
+            }
+
+        self.assertQueryBudget(
+            self.post("loan-create", loan),
+            {
+                "1 loan": lambda: self.add_loans(1),
+                "100 loans": lambda: self.add_loans(99),
+            },
+        )
+        rows = 1
+
+        def grow(count):
+            nonlocal rows
+            rows = count
+
+        # bulk_create splits its inserts at the query parameter limit of SQLite, about
+        # every 90 loans or 150 payments, the batches are kept below it
+        self.assertQueryBudget(
+            self.post("loan-bulk-create", lambda: [loan() for _ in range(rows)]),
+            {"1 row": lambda: grow(1), "80 rows": lambda: grow(80)},
+        )
+
+    def test_payment_pays_any_number_of_loans_with_constant_writes(self):
+        # Every payment pays off all the open loans, those just added
+        paid = Decimal(0)
+
+        def grow(count):
+            nonlocal paid
+            self.add_loans(count)
+            paid = Decimal(10 * count)
+
+        self.assertQueryBudget(
+            self.post(
+                "make_payment",
+                lambda: {
+                    "external_id": self.next_id("payment"),
+                    "customer_external_id": "customer_1",
+                    "total_amount": str(paid),
+                },
+            ),
+            {"1 open loan": lambda: grow(1), "100 open loans": lambda: grow(100)},
+        )
+        self.assertEqual(get_total_debt(self.customer.id), 0)
+
+    def test_payment_bulk_creation_and_listing(self):
+        rows = 1
+
+        def grow(count):
+            nonlocal rows
+            self.add_loans(count)
+            rows = count
+
+        self.assertQueryBudget(
+            self.post(
+                "payment-bulk-create",
+                lambda: [
+                    {
+                        "external_id": self.next_id("payment"),
+                        "customer_external_id": "customer_1",
+                        "total_amount": "10.00",
+                    }
+                    for _ in range(rows)
+                ],
+            ),
+            {"1 row": lambda: grow(1), "80 rows": lambda: grow(80)},
+        )
+        self.assertQueryBudget(self.get("make_payment"), {"81 payments": lambda: None})
+
+    def test_payment_queue(self):
+        def enqueue(count):
+            QueuedPayment.objects.bulk_create(
+                QueuedPayment(
+                    external_id=self.next_id("queued"),
+                    customer_external_id="customer_1",
+                    total_amount=Decimal("1.00"),
+                )
+                for _ in range(count)
+            )
+
+        QueuedPayment.objects.create(
+            external_id="queued",
+            customer_external_id="customer_1",
+            total_amount=Decimal("1.00"),
+        )
+        volumes = {
+            "1 queued payment": lambda: None,
+            "100 queued payments": lambda: enqueue(99),
+        }
+        self.assertQueryBudget(self.get("payment-queue-metrics"), volumes)
+        self.assertQueryBudget(self.get("metrics"), volumes)
+        self.assertQueryBudget(self.get("payment-queue-status", "queued"), volumes)
+
+    def test_daily_reports(self):
+        today = timezone.localdate()
+        days = 0
+
+        def grow(count):
+            nonlocal days
+            for offset in range(days, count):
+                date = today - timedelta(days=offset)
+                DailyCustomerSnapshot.objects.create(
+                    date=date, customer_id=self.customer, loans=1
+                )
+                DailyStatusSnapshot.objects.create(
+                    date=date, status=2, loans=1, amount=1, outstanding=1
+                )
+            days = count
+
+        volumes = {"1 day": lambda: grow(1), "30 days": lambda: grow(30)}
+        self.assertQueryBudget(self.get("report-daily"), volumes)
+        self.assertQueryBudget(
+            self.get("report-customer-daily", "customer_1"),
+            {"30 days": lambda: None, "60 days": lambda: grow(60)},
+        )
+
+    def test_regression_fails_with_the_sql(self):
+        from finances.views import CustomerListView
+
+        with mock.patch.object(
+            CustomerListView, "query_budget", {"GET": QueryBudget(0)}
+        ):
+            with self.assertRaisesRegex(
+                self.failureException, r"(?s)1 queries, budget 0.*SELECT"
+            ):
+                self.assertQueryBudget(
+                    self.get("customer_list"), {"1 customer": lambda: None}
+                )
+
+    def test_sql_diff_shows_the_extra_queries(self):
+        first = ['SELECT "name" FROM "loan" WHERE "id" IN (1, 2)']
+        grown = first + ['SELECT "name" FROM "customer" WHERE "id" = 7']
+        diff = sql_diff(first, grown, "1 loan", "2 loans")
+        self.assertIn('+SELECT "name" FROM "customer" WHERE "id" = ?', diff)
+        # The same query with other values is no difference, the statements are
+        # listed instead
+        self.assertEqual(
+            sql_diff(
+                first, ['SELECT "name" FROM "loan" WHERE "id" IN (3, 4, 5)'], "a", "b"
+            ),
+            '  1. SELECT "name" FROM "loan" WHERE "id" IN (...)',
+        )
@@ -1,24 +1,68 @@
+from django.http import Http404
+from django.utils.dateparse import parse_date
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from rest_framework.views import APIView
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework import generics
-from .models import Customer, Loan, Payment, PaymentDetail
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import BaseRenderer
+from .models import (
+    Customer,
+    DailyCustomerSnapshot,
+    Loan,
+    Payment,
+    PaymentDetail,
+    QueuedPayment,
+)
 from django.db.models import Sum
 from .serializers import (
     CustomerCreateResponseSerializer,
     CustomerSerializer,
+    DailyCustomerSnapshotSerializer,
+    DailyReportSerializer,
+    LoanBulkItemSerializer,
     LoanCreateSerializer,
-    LoanSerializer,
+    LoanReadSerializer,
+    PaymentBulkItemSerializer,
+    PaymentEnqueueSerializer,
     PaymentSerializer,
+    QueuedPaymentSerializer,
+    loan_read_queryset,
+    validate_rows,
+)
+from finances.analytics import portfolio_cache
+from finances.business_logic.customer_logic import (
+    balance_cache,
+    get_balance_payload,
+    with_total_debt,
+)
+from finances.business_logic.loan_logic import create_loans_bulk
+from finances.business_logic.payment_logic import create_payments_bulk
+from finances.business_logic.payment_queue_logic import (
+    payment_queue_settings,
+    queue_metrics,
+)
+from finances.business_logic.snapshot_logic import daily_report
+from finances.idempotency import IdempotentCreateMixin
+from finances.instrumentation import registry
+from finances.permissions import CachedHasAPIKey
+from finances.query_budget import QueryBudget
+from finances.read_plans import (
+    CUSTOMER_READ_PLAN,
+    LOAN_READ_PLAN,
+    PAYMENT_READ_PLAN,
+    ReadPlanListMixin,
 )
-from rest_framework_api_key.permissions import HasAPIKey
 
 
 class CustomerCreateView(generics.CreateAPIView):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
-    permission_classes = [HasAPIKey]
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"POST": QueryBudget(5)}
 
     # Use the custom serializer response, just to show the necessary fields
     def create(self, request):
@@ -36,52 +80,294 @@ class CustomerCreateView(generics.CreateAPIView):
         return Response(response_serializer.data, status=201, headers=headers)
 
 
-class CustomerListView(generics.ListAPIView):
-    queryset = Customer.objects.all()
+class CustomerListView(ReadPlanListMixin, generics.ListAPIView):
+    # total_debt is annotated so the whole list is served in a single query
+    queryset = with_total_debt(Customer.objects.all())
     serializer_class = CustomerSerializer
-    permission_classes = [HasAPIKey]
+    read_plan = CUSTOMER_READ_PLAN
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(1)}
 
 
 class CustomerBalanceView(generics.RetrieveAPIView):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     lookup_field = "external_id"
-    permission_classes = [HasAPIKey]
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(2)}
 
     def retrieve(self, request, *args, **kwargs):
-        # Retrieve the customer object based on the provided external_id
-        instance = self.get_object()
-        # Initialize serializer with retrieved instance and request context
-        serializer = self.get_serializer(instance, context={"request": request})
-        # Return response with serialized customer data
-        return Response(serializer.data)
+        # The payload comes from the balance cache, same fields as CustomerSerializer
+        try:
+            payload = get_balance_payload(kwargs["external_id"])
+        except Customer.DoesNotExist:
+            raise Http404
+        return Response(dict(payload))
 
 
-class LoanCreateView(generics.CreateAPIView):
+class LoanCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     queryset = Loan.objects.all()
     serializer_class = LoanCreateSerializer
-    permission_classes = [HasAPIKey]
+    idempotency_scope = "create_loan"
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"POST": QueryBudget(6)}
+
+
+class BulkCreateView(generics.GenericAPIView):
+    # Validates every row of a batch with serializer_class, creates the valid ones with
+    # a single create_rows_function call and reports each row as accepted or rejected.
+    # create_rows_function takes (index, validated_data) pairs and returns the created
+    # (index, instance) pairs and the refused (index, validated_data, message) triples
+    permission_classes = [CachedHasAPIKey]
+    response_serializer_class = None
+    create_rows_function = None
+    max_rows = 5000
+
+    def get_create_rows_function(self):
+        assert self.create_rows_function is not None, (
+            f"'{self.__class__.__name__}' should include a `create_rows_function` "
+            "attribute."
+        )
+        return self.create_rows_function
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or len(rows) > self.max_rows:
+            return Response(
+                {"detail": f"Expected a list of at most {self.max_rows} rows"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # Validate every row first, then create the valid ones as one batch
+        valid_rows, rejected = validate_rows(self.get_serializer_class(), rows)
+        created, refused = self.get_create_rows_function()(valid_rows)
+
+        accepted = [
+            {"index": index, **self.response_serializer_class(instance).data}
+            for index, instance in created
+        ]
+        rejected += [
+            {"index": index, "errors": {"non_field_errors": [message]}}
+            for index, _, message in refused
+        ]
+        rejected.sort(key=lambda row: row["index"])
+        # A batch is created when at least one of its rows is
+        return Response(
+            {"accepted": accepted, "rejected": rejected},
+            status=(
+                status.HTTP_400_BAD_REQUEST
+                if rejected and not accepted
+                else status.HTTP_201_CREATED
+            ),
+        )
+
+
+class LoanBulkCreateView(BulkCreateView):
+    serializer_class = LoanBulkItemSerializer
+    response_serializer_class = LoanCreateSerializer
+    create_rows_function = staticmethod(create_loans_bulk)
+    query_budget = {"POST": QueryBudget(6)}
 
 
 class LoanListView(generics.ListAPIView):
     queryset = Loan.objects.all()
-    permission_classes = [HasAPIKey]
+    permission_classes = [CachedHasAPIKey]
 
 
-class LoansByCustomerExternalIdView(generics.ListAPIView):
-    serializer_class = LoanSerializer
-    permission_classes = [HasAPIKey]
+class LoansByCustomerExternalIdView(ReadPlanListMixin, generics.ListAPIView):
+    serializer_class = LoanReadSerializer
+    read_plan = LOAN_READ_PLAN
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(1)}
 
     def get_queryset(self):
         # Retrieve customer external_id from URL kwargs
         customer_external_id = self.kwargs["external_id"]
-        # Get customer object based on external_id or return 404 if not found
-        customer = get_object_or_404(Customer, external_id=customer_external_id)
-        # Return queryset of loans filtered by customer_id
-        return Loan.objects.filter(customer_id=customer.id)
+        # Loans of the customer joined with the customer in a single query
+        return loan_read_queryset(
+            Loan.objects.filter(customer_id__external_id=customer_external_id)
+        )
 
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # Only an empty page needs the customer lookup, to return 404 if not found
+        if not page:
+            get_object_or_404(Customer, external_id=self.kwargs["external_id"])
+        return page
 
-class PaymentListCreateView(generics.ListCreateAPIView):
+    def list(self, request, *args, **kwargs):
+        if self.is_streaming(request):
+            get_object_or_404(Customer, external_id=self.kwargs["external_id"])
+        return super().list(request, *args, **kwargs)
+
+
+class QueuedPaymentCreateMixin:
+    # Queues the payment for the process_payment_queue worker and answers 202 with
+    # the URL of its status, when the request sends "Prefer: respond-async" or the
+    # PAYMENT_QUEUE setting makes every payment asynchronous
+    def create(self, request, *args, **kwargs):
+        prefer = request.headers.get("Prefer", "")
+        if not (
+            payment_queue_settings()["ASYNC"]
+            or "respond-async" in prefer.replace(" ", "").split(",")
+        ):
+            return super().create(request, *args, **kwargs)
+        serializer = PaymentEnqueueSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queued = serializer.save()
+        status_url = request.build_absolute_uri(
+            reverse("payment-queue-status", args=[queued.external_id])
+        )
+        return Response(
+            {
+                "external_id": queued.external_id,
+                "status": "pending",
+                "status_url": status_url,
+            },
+            status=202,
+            headers={"Location": status_url, "Preference-Applied": "respond-async"},
+        )
+
+
+class PaymentListCreateView(
+    IdempotentCreateMixin,
+    QueuedPaymentCreateMixin,
+    ReadPlanListMixin,
+    generics.ListCreateAPIView,
+):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
-    permission_classes = [HasAPIKey]
+    idempotency_scope = "make_payment"
+    read_plan = PAYMENT_READ_PLAN
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(1), "POST": QueryBudget(9, writes=5)}
+
+
+class QueuedPaymentStatusView(generics.RetrieveAPIView):
+    queryset = QueuedPayment.objects.all()
+    serializer_class = QueuedPaymentSerializer
+    lookup_field = "external_id"
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(1)}
+
+
+class PaymentQueueMetricsView(APIView):
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(3)}
+
+    def get(self, request):
+        return Response(queue_metrics())
+
+
+class PortfolioAnalyticsView(APIView):
+    # Portfolio-wide metrics, computed at most once per ANALYTICS["TTL"] seconds
+    permission_classes = [CachedHasAPIKey]
+    # No budget: a computation reads the tables in ANALYTICS["CHUNK_SIZE"] chunks,
+    # its queries grow with them
+    query_budget = None
+
+    def get(self, request):
+        return Response(portfolio_cache.get_or_compute())
+
+
+class ReportPeriodMixin:
+    # ?from= and ?to= dates (YYYY-MM-DD) bounding a report, both optional
+    def get_period(self, request):
+        period = []
+        for name in ("from", "to"):
+            value = request.query_params.get(name)
+            try:
+                # parse_date raises for a well formed date that does not exist
+                day = parse_date(value) if value else None
+            except ValueError:
+                day = None
+            if value and day is None:
+                raise ValidationError({name: ["Expected a date as YYYY-MM-DD."]})
+            period.append(day)
+        return period
+
+
+class DailyReportView(ReportPeriodMixin, APIView):
+    # Daily totals read from the snapshot tables kept by build_snapshots
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(2)}
+
+    def get(self, request):
+        start, end = self.get_period(request)
+        return Response(DailyReportSerializer(daily_report(start, end), many=True).data)
+
+
+class CustomerDailyReportView(ReportPeriodMixin, generics.ListAPIView):
+    serializer_class = DailyCustomerSnapshotSerializer
+    pagination_class = None
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(2)}
+
+    def get_queryset(self):
+        customer = get_object_or_404(Customer, external_id=self.kwargs["external_id"])
+        start, end = self.get_period(self.request)
+        queryset = DailyCustomerSnapshot.objects.filter(customer_id=customer)
+        if start:
+            queryset = queryset.filter(date__gte=start)
+        if end:
+            queryset = queryset.filter(date__lte=end)
+        return queryset.order_by("date")
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        # Error bodies (missing API key)
+        return "".join(f"# {key}: {value}\n" for key, value in data.items()).encode(
+            self.charset
+        )
+
+
+class PlainTextNegotiation(BaseContentNegotiation):
+    # Always the text format, whatever the Accept header of the scraper or client
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MetricsView(APIView):
+    # Prometheus metrics of this process: the request instrumentation, the balance
+    # cache and the payment queue
+    permission_classes = [CachedHasAPIKey]
+    query_budget = {"GET": QueryBudget(3)}
+    renderer_classes = [PrometheusRenderer]
+    content_negotiation_class = PlainTextNegotiation
+
+    def get(self, request):
+        cache = balance_cache.stats()
+        queue = queue_metrics()
+        gauges = {
+            "finances_balance_cache_hits": ("Balance cache hits.", cache["hits"]),
+            "finances_balance_cache_misses": ("Balance cache misses.", cache["misses"]),
+            "finances_payment_queue_depth": (
+                "Pending queued payments.",
+                queue["depth"],
+            ),
+            "finances_payment_queue_lag_seconds": (
+                "Age of the oldest pending queued payment.",
+                queue["lag_seconds"],
+            ),
+        }
+        return Response(
+            registry.prometheus(gauges),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+class PaymentBulkCreateView(BulkCreateView):
+    serializer_class = PaymentBulkItemSerializer
+    response_serializer_class = PaymentSerializer
+    max_rows = 50000
+    create_rows_function = staticmethod(create_payments_bulk)
+    query_budget = {"POST": QueryBudget(9)}